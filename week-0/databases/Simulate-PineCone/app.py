@@ -9,9 +9,15 @@ from typing import Dict, Any, List
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from data_processor import load_and_process_datasets
-from vector_db import setup_vector_database, find_similar_content
+from vector_db import MockPineconeDB, setup_vector_database, find_similar_content
 from clustering import perform_clustering_analysis
 from visualizations import create_visualization_engine
+from snapshot import load_clustering_results, snapshot_is_current
+
+SPOTIFY_PATH = "data/spotify_sample.csv"
+NETFLIX_PATH = "data/netflix_movies.csv"
+SNAPSHOT_PATH = "data/snapshot"
+CACHE_PATH = "data/cache"
 
 
 # Page configuration
@@ -26,10 +32,7 @@ st.set_page_config(
 def load_data():
     """Load and process datasets (cached for performance)"""
     try:
-        spotify_path = "data/spotify_sample.csv"
-        netflix_path = "data/netflix_movies.csv"
-        
-        processed_data = load_and_process_datasets(spotify_path, netflix_path)
+        processed_data = load_and_process_datasets(SPOTIFY_PATH, NETFLIX_PATH, cache_dir=CACHE_PATH)
         return processed_data
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
@@ -46,44 +49,80 @@ def perform_clustering(_processed_data):
         return None
 
 @st.cache_resource
-def setup_database(_processed_data):
+def setup_database(_processed_data, _clustering_results=None):
     """Setup vector database (cached for performance)"""
     try:
-        db = setup_vector_database(_processed_data, use_real_pinecone=False)
+        db = setup_vector_database(
+            _processed_data,
+            use_real_pinecone=False,
+            clustering_results=_clustering_results,
+            index_type='ivf',
+            # Only Netflix lookups skip MMR re-ranking, so only they can read the graph
+            knn_k=16,
+            knn_namespaces=('netflix',)
+        )
         return db
     except Exception as e:
         st.error(f"Error setting up database: {str(e)}")
         return None
 
+@st.cache_resource
+def load_snapshot():
+    """Warm start from the on-disk snapshot if it matches the current CSVs"""
+    if not snapshot_is_current(SNAPSHOT_PATH, [SPOTIFY_PATH, NETFLIX_PATH]):
+        return None
+    try:
+        db = MockPineconeDB.load(SNAPSHOT_PATH)
+        clustering_results = load_clustering_results(SNAPSHOT_PATH, verify=False)
+        return db, clustering_results
+    except (OSError, ValueError) as e:
+        st.warning(f"Ignoring unreadable snapshot: {str(e)}")
+        return None
+
+def save_snapshot(db, clustering_results):
+    """Persist the database and clustering outputs for the next start"""
+    if snapshot_is_current(SNAPSHOT_PATH, [SPOTIFY_PATH, NETFLIX_PATH]):
+        return
+    try:
+        db.save(SNAPSHOT_PATH, clustering_results=clustering_results, sources=[SPOTIFY_PATH, NETFLIX_PATH])
+    except OSError as e:
+        st.warning(f"Could not write snapshot: {str(e)}")
+
 def main():
     """Main application function"""
     
     # Title
     st.title("Vector Database Similarity Demo")
     
-    # Load data
-    with st.spinner("Loading and processing datasets..."):
-        processed_data = load_data()
-    
-    if processed_data is None:
-        st.error("Failed to load data. Please check if the data files exist in the 'data' directory.")
-        return
-    
-    # Perform clustering
-    with st.spinner("Performing clustering analysis..."):
-        clustering_results = perform_clustering(processed_data)
-    
-    if clustering_results is None:
-        st.error("Failed to perform clustering analysis.")
-        return
-    
-    # Setup vector database
-    with st.spinner("Setting up vector database..."):
-        db = setup_database(processed_data)
-    
-    if db is None:
-        st.error("Failed to setup vector database.")
-        return
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        db, clustering_results = snapshot
+    else:
+        # Load data
+        with st.spinner("Loading and processing datasets..."):
+            processed_data = load_data()
+        
+        if processed_data is None:
+            st.error("Failed to load data. Please check if the data files exist in the 'data' directory.")
+            return
+        
+        # Perform clustering
+        with st.spinner("Performing clustering analysis..."):
+            clustering_results = perform_clustering(processed_data)
+        
+        if clustering_results is None:
+            st.error("Failed to perform clustering analysis.")
+            return
+        
+        # Setup vector database
+        with st.spinner("Setting up vector database..."):
+            db = setup_database(processed_data, clustering_results)
+        
+        if db is None:
+            st.error("Failed to setup vector database.")
+            return
+        
+        save_snapshot(db, clustering_results)
     
     # Create visualization engine
     viz_engine = create_visualization_engine()
@@ -246,7 +285,9 @@ def main():
                         
                         # Find similar items
                         try:
-                            similar_items = find_similar_content(db, 'spotify', selected_item['id'], top_k=6)
+                            similar_items = find_similar_content(
+                                db, 'spotify', selected_item['id'], top_k=6, diversity=0.3
+                            )
                             
                             if similar_items and len(similar_items) > 1:
                                 # Show vector similarity map first
@@ -329,7 +370,9 @@ def main():
                         
                         # Find similar items
                         try:
-                            similar_items = find_similar_content(db, 'netflix', selected_item['id'], top_k=6)
+                            similar_items = find_similar_content(
+                                db, 'netflix', selected_item['id'], top_k=6, filter={'type': 'Movie'}
+                            )
                             
                             if similar_items and len(similar_items) > 1:
                                 # Show vector similarity map first
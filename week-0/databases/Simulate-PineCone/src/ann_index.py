@@ -0,0 +1,339 @@
+import heapq
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from sklearn.cluster import KMeans
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of a matrix with unit-length rows"""
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1)
+    nonzero = norms > 0
+    matrix[nonzero] /= norms[nonzero, None]
+    return matrix
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index over the rows of a VectorIndex.
+    Every row is bucketed under its nearest centroid and a query only
+    scores the rows in the nprobe lists whose centroids are closest to it.
+    """
+
+    # Rows assigned per block so the (rows x centroids) score matrix stays small
+    ASSIGN_BLOCK_SIZE = 16384
+
+    def __init__(self, centroids: np.ndarray, nprobe: Optional[int] = None):
+        self.centroids = _normalize_rows(centroids)
+        self.nlist = len(self.centroids)
+        self.nprobe = nprobe if nprobe is not None else max(1, self.nlist // 8)
+        self._storage = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists = None
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: Optional[int] = None, nprobe: Optional[int] = None,
+              random_state: int = 42, max_training_points: int = 256) -> 'IVFIndex':
+        """Fit centroids with KMeans on (a sample of) the normalized vectors"""
+        vectors = _normalize_rows(vectors)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+
+        # Like faiss, a few hundred points per centroid is plenty for training
+        sample_size = max_training_points * nlist
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(random_state)
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+        kmeans = KMeans(n_clusters=nlist, random_state=random_state, n_init=1)
+        kmeans.fit(vectors)
+        return cls(kmeans.cluster_centers_, nprobe)
+
+    def _nearest_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        """Assign unit-length rows to their most similar centroid, block by block"""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.ASSIGN_BLOCK_SIZE):
+            end = min(start + self.ASSIGN_BLOCK_SIZE, len(vectors))
+            assignments[start:end] = np.argmax(vectors[start:end] @ self.centroids.T, axis=1)
+        return assignments
+
+    def attach(self, storage):
+        """Assign every occupied row of a storage from scratch"""
+        self._assignments = np.zeros(storage.capacity, dtype=np.int32)
+        self._assignments[:storage.size] = self._nearest_centroids(storage.vectors[:storage.size])
+        self._storage = storage
+        self._lists = None
+
+    def add_rows(self, storage, rows: np.ndarray):
+        """(Re)assign rows that were just written into the attached storage"""
+        if len(self._assignments) < storage.capacity:
+            grown = np.zeros(storage.capacity, dtype=np.int32)
+            grown[:len(self._assignments)] = self._assignments
+            self._assignments = grown
+        self._assignments[rows] = self._nearest_centroids(storage.vectors[rows])
+        self._storage = storage
+        self._lists = None
+
+    def remap(self, storage, keep: Optional[np.ndarray] = None):
+        """Follow the index onto a new storage, optionally keeping only some rows"""
+        if keep is not None:
+            # Readers of the old layout fall back to exact search while rows are renumbered
+            self._storage = None
+            assignments = np.zeros(storage.capacity, dtype=np.int32)
+            assignments[:len(keep)] = self._assignments[keep]
+            self._assignments = assignments
+        self._storage = storage
+        self._lists = None
+
+    def __getstate__(self):
+        # Snapshots store the index without the storage it points at; remap() re-binds it
+        state = dict(self.__dict__)
+        state['_storage'] = None
+        state['_lists'] = None
+        return state
+
+    def _build_lists(self, assignments: np.ndarray,
+                     size: int) -> Tuple[np.ndarray, int, np.ndarray, np.ndarray]:
+        """
+        Group rows [0, size) by list as (assignments, size, rows sorted by
+        list, per-list offsets); the first two say what the lists describe
+        """
+        order = np.argsort(assignments[:size], kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        return assignments, size, order, offsets
+
+    def candidates(self, storage, query: np.ndarray, top_k: int, nprobe: Optional[int] = None,
+                   **_) -> Optional[np.ndarray]:
+        """
+        Rows stored in the nprobe lists closest to a unit-length query, or
+        None when the index does not describe this storage layout (caller
+        falls back to exact search).
+        """
+        indexed = self._storage
+        if indexed is None or storage.layout is not indexed.layout:
+            return None
+        assignments, lists = self._assignments, self._lists
+        if self._storage is not indexed:
+            # remap() started after the check above; these may describe the new layout
+            return None
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        # Rows below a version's size never change, so lists are cached per assignments and size
+        if lists is None or lists[0] is not assignments or lists[1] != storage.size:
+            lists = self._build_lists(assignments, storage.size)
+            self._lists = lists
+        _, _, order, offsets = lists
+
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+        return np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes])
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small-world graph over the rows of a VectorIndex.
+    Rows are inserted incrementally; a query descends greedily through the
+    sparse upper layers and runs a best-first search of width ef on layer 0.
+    Tombstoned rows stay in the graph as waypoints and are filtered by the caller.
+    """
+
+    METRICS = ('cosine', 'dotproduct', 'euclidean')
+
+    def __init__(self, metric: str = 'cosine', M: int = 16, ef_construction: int = 200,
+                 ef: int = 64, random_state: int = 42):
+        if metric not in self.METRICS:
+            raise ValueError(f"Unsupported metric '{metric}'. Choose from {self.METRICS}")
+        self.metric = metric
+        self.M = M
+        self.max_links_0 = 2 * M
+        self.ef_construction = max(ef_construction, M)
+        self.ef = ef
+        self._level_mult = 1 / np.log(max(M, 2))
+        self._rng = np.random.default_rng(random_state)
+        self._storage = None
+        self._links = []
+        self._levels = {}
+        self._entry = None
+
+    def _similarity(self, storage, query: np.ndarray, rows) -> np.ndarray:
+        """Higher-is-better similarity between a prepared query and stored rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        dots = storage.vectors[rows] @ query
+        if self.metric == 'cosine':
+            return dots
+        norms = storage.norms[rows]
+        if self.metric == 'dotproduct':
+            return dots * norms
+        return 2 * norms * dots - norms * norms - query @ query
+
+    def _prepare(self, storage, query: np.ndarray) -> np.ndarray:
+        """Bring a raw query into the form _similarity expects"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if self.metric == 'cosine':
+            norm = np.linalg.norm(query)
+            return query / norm if norm > 0 else query
+        return query
+
+    def _row_query(self, storage, row: int) -> np.ndarray:
+        """Prepared query for a stored row (used while inserting it)"""
+        if self.metric == 'cosine':
+            return storage.vectors[row]
+        return storage.vectors[row] * storage.norms[row]
+
+    def _search_layer(self, storage, query: np.ndarray, entry_points, ef: int, layer: int,
+                      limit: Optional[int] = None, graph: Optional[List[Dict[int, List[int]]]] = None):
+        """
+        Best-first search on one layer; returns [(similarity, row)] best first.
+        With limit, links to rows at or past it (not yet published) are skipped;
+        graph is the per-layer links a reader captured (the live ones by default).
+        """
+        links = (self._links if graph is None else graph)[layer]
+        visited = set(entry_points)
+        entry_scores = self._similarity(storage, query, entry_points)
+        candidates = [(-score, row) for score, row in zip(entry_scores.tolist(), entry_points)]
+        results = [(score, row) for score, row in zip(entry_scores.tolist(), entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_score, row = heapq.heappop(candidates)
+            if -negative_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [neighbor for neighbor in links.get(row, ())
+                         if neighbor not in visited and (limit is None or neighbor < limit)]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for score, neighbor in zip(self._similarity(storage, query, neighbors).tolist(), neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _shrink(self, storage, row: int, layer: int, max_links: int):
+        """Keep only the max_links most similar neighbours of a node"""
+        neighbors = self._links[layer][row]
+        if len(neighbors) <= max_links:
+            return
+        scores = self._similarity(storage, self._row_query(storage, row), neighbors)
+        keep = np.argpartition(-scores, max_links - 1)[:max_links]
+        self._links[layer][row] = [neighbors[position] for position in keep]
+
+    def _insert(self, storage, row: int):
+        """Insert a new row, or re-link a row whose vector was overwritten"""
+        level = self._levels.get(row)
+        if level is None:
+            level = int(-np.log(1.0 - self._rng.random()) * self._level_mult)
+            self._levels[row] = level
+            while len(self._links) <= level:
+                self._links.append({})
+            for layer in range(level + 1):
+                self._links[layer][row] = []
+
+        entry_row = self._entry
+        if entry_row == row:
+            # Re-linking the entry point: start from any of its neighbours instead
+            entry_row = next(
+                (neighbor for layer in range(level, -1, -1) for neighbor in self._links[layer][row]),
+                None
+            )
+        if entry_row is None:
+            self._entry = row
+            return
+
+        query = self._row_query(storage, row)
+        entry = [entry_row]
+        top_level = self._levels[entry_row]
+        for layer in range(top_level, level, -1):
+            entry = [self._search_layer(storage, query, entry, 1, layer)[0][1]]
+
+        for layer in range(min(level, top_level), -1, -1):
+            found = [match for match in self._search_layer(storage, query, entry, self.ef_construction, layer)
+                     if match[1] != row]
+            max_links = self.max_links_0 if layer == 0 else self.M
+            neighbors = [neighbor for _, neighbor in found[:self.M]]
+            self._links[layer][row] = neighbors
+            for neighbor in neighbors:
+                if row not in self._links[layer][neighbor]:
+                    self._links[layer][neighbor].append(row)
+                    self._shrink(storage, neighbor, layer, max_links)
+            entry = [neighbor for _, neighbor in found] or entry
+
+        if level > self._levels[self._entry]:
+            self._entry = row
+
+    def attach(self, storage):
+        """Insert every occupied row of a storage"""
+        self._storage = storage
+        self._links = []
+        self._levels = {}
+        self._entry = None
+        for row in range(storage.size):
+            self._insert(storage, row)
+
+    def add_rows(self, storage, rows: np.ndarray):
+        """Insert new rows or re-link rows whose vectors were overwritten"""
+        self._storage = storage
+        for row in np.asarray(rows).tolist():
+            self._insert(storage, row)
+
+    def remap(self, storage, keep: Optional[np.ndarray] = None):
+        """Follow the index onto a new storage, dropping rows not kept"""
+        if keep is not None:
+            # Readers of the old layout fall back to exact search while rows are renumbered
+            self._storage = None
+            new_rows = {old: new for new, old in enumerate(np.asarray(keep).tolist())}
+            self._links = [
+                {
+                    new_rows[row]: [new_rows[neighbor] for neighbor in neighbors if neighbor in new_rows]
+                    for row, neighbors in layer.items() if row in new_rows
+                }
+                for layer in self._links
+            ]
+            self._levels = {new_rows[row]: level for row, level in self._levels.items() if row in new_rows}
+            while self._links and not self._links[-1]:
+                self._links.pop()
+            if self._entry in new_rows:
+                self._entry = new_rows[self._entry]
+            elif self._levels:
+                self._entry = max(self._levels, key=self._levels.get)
+            else:
+                self._entry = None
+        self._storage = storage
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_storage'] = None
+        return state
+
+    def candidates(self, storage, query: np.ndarray, top_k: int, ef: Optional[int] = None,
+                   **_) -> Optional[np.ndarray]:
+        """Rows of the ef best matches found by graph search, or None if unusable"""
+        indexed = self._storage
+        entry_row = self._entry
+        if indexed is None or storage.layout is not indexed.layout or entry_row is None:
+            return None
+        if entry_row >= storage.size:
+            # The entry point was inserted after this version was published
+            return None
+        graph, levels = self._links, self._levels
+        if self._storage is not indexed:
+            # remap() started after the check above; the graph may be renumbered already
+            return None
+        ef = max(ef or self.ef, top_k)
+        query = self._prepare(storage, query)
+
+        entry = [entry_row]
+        for layer in range(levels[entry_row], 0, -1):
+            entry = [self._search_layer(storage, query, entry, 1, layer, storage.size, graph)[0][1]]
+        found = self._search_layer(storage, query, entry, ef, 0, storage.size, graph)
+        return np.array([row for _, row in found], dtype=np.int64)
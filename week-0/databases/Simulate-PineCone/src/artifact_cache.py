@@ -0,0 +1,107 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import scipy.sparse as sparse
+from typing import Any, Dict, Optional, Tuple
+
+from snapshot import CHECKSUM_BLOCK_SIZE, json_default, save_array, load_array, save_pickle, load_pickle
+
+
+# Bumped whenever processors change what they compute, so older entries stop matching
+ARTIFACT_CACHE_VERSION = 1
+MANIFEST_FILE = 'artifact.json'
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a file's contents, read block by block"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        while True:
+            block = handle.read(CHECKSUM_BLOCK_SIZE)
+            if not block:
+                return digest.hexdigest()
+            digest.update(block)
+
+
+def artifact_key(path: str, config: Dict[str, Any]) -> str:
+    """Cache key of a processed dataset: its file contents plus the processor configuration"""
+    description = json.dumps({
+        'version': ARTIFACT_CACHE_VERSION,
+        'content': content_hash(path),
+        'config': config
+    }, sort_keys=True, default=json_default)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class ArtifactCache:
+    """
+    On-disk cache of preprocessing results, one directory per dataset and
+    key: the fitted processor (scalers or TF-IDF vectorizer, and its
+    dataframe) as a pickle and the embedding matrix as .npy files (the
+    data, indices and indptr arrays for a sparse matrix). Entries are
+    written to a staging directory and renamed into place, so processes
+    sharing the directory never read a partial entry; dense vectors are
+    loaded as copy-on-write mappings that those processes share.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+
+    def _entry_path(self, name: str, key: str) -> str:
+        return os.path.join(self.directory, f'{name}-{key}')
+
+    def load(self, name: str, key: str) -> Optional[Tuple[Any, Any]]:
+        """(processor, vectors) stored under key, or None on a miss or an unreadable entry"""
+        path = self._entry_path(name, key)
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as handle:
+                manifest = json.load(handle)
+            if manifest['key'] != key:
+                return None
+            processor = load_pickle(path, manifest['processor'])
+            if manifest['shape'] is None:
+                vectors = load_array(path, manifest['vectors'])
+            else:
+                vectors = sparse.csr_matrix(
+                    tuple(load_array(path, file_name, mmap=False) for file_name in manifest['vectors']),
+                    shape=tuple(manifest['shape'])
+                )
+        except (OSError, KeyError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        return processor, vectors
+
+    def store(self, name: str, key: str, processor: Any, vectors) -> str:
+        """Write an entry and drop the dataset's entries for other keys; returns its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entry_path(name, key)
+        staging = f'{path}.tmp-{os.getpid()}'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        manifest = {'key': key, 'processor': save_pickle(staging, 'processor', processor)}
+        if sparse.issparse(vectors):
+            vectors = vectors.tocsr()
+            manifest['vectors'] = [save_array(staging, part, getattr(vectors, part))
+                                   for part in ('data', 'indices', 'indptr')]
+            manifest['shape'] = list(vectors.shape)
+        else:
+            manifest['vectors'] = save_array(staging, 'vectors', vectors)
+            manifest['shape'] = None
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as handle:
+            json.dump(manifest, handle)
+
+        if os.path.exists(path) and self.load(name, key) is None:
+            # Replace an unreadable entry (e.g. a half-deleted one) rather than keep missing on it
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(staging, path)
+        except OSError:
+            # Another process stored the same key first; its entry is identical
+            shutil.rmtree(staging, ignore_errors=True)
+
+        for entry in os.listdir(self.directory):
+            if entry.startswith(f'{name}-') and entry != os.path.basename(path) and '.tmp-' not in entry:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+        return path
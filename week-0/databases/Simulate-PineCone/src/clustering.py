@@ -9,6 +9,15 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from typing import List, Dict, Tuple, Any
 
+from data_processor import EmbeddingBatch
+
+
+def _embedding_vectors(embeddings) -> np.ndarray:
+    """Dense vector matrix of an EmbeddingBatch or of a list of item dicts"""
+    if isinstance(embeddings, EmbeddingBatch):
+        return embeddings.dense_vectors()
+    return np.array([emb['vector'] for emb in embeddings])
+
 
 class ContentClusterer:
     """Clustering algorithms for content similarity analysis"""
@@ -26,7 +35,7 @@ class ContentClusterer:
     def cluster_spotify_data(self, embeddings: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Perform clustering on Spotify data"""
         # Extract vectors
-        vectors = np.array([emb['vector'] for emb in embeddings])
+        vectors = _embedding_vectors(embeddings)
         
         # Perform K-means clustering
         self.spotify_kmeans = KMeans(
@@ -69,7 +78,7 @@ class ContentClusterer:
     def cluster_netflix_data(self, embeddings: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Perform clustering on Netflix data"""
         # Extract vectors
-        vectors = np.array([emb['vector'] for emb in embeddings])
+        vectors = _embedding_vectors(embeddings)
         
         # Perform K-means clustering
         self.netflix_kmeans = KMeans(
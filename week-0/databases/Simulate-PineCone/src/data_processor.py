@@ -1,13 +1,90 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sparse
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.feature_extraction.text import TfidfVectorizer
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import copy
 import re
 
+from artifact_cache import ArtifactCache, artifact_key
+
+
+class EmbeddingBatch:
+    """
+    Columnar embeddings of one catalogue: an (items x dimension) vector
+    matrix (dense float32, or scipy CSR such as TF-IDF rows), an id array,
+    and one array per top-level field and per metadata field, all aligned
+    by row position. Processors fill it with whole-column operations.
+    The per-item dicts ({'id', fields..., 'vector', 'metadata'}) that
+    clustering and the UI read are only built when the batch is first
+    indexed or iterated, and are not pickled with it.
+    """
+
+    def __init__(self, ids, vectors, fields: Dict[str, np.ndarray], metadata: Dict[str, np.ndarray]):
+        self.ids = np.asarray(ids, dtype=object)
+        self.vectors = vectors
+        self.fields = fields
+        self.metadata = metadata
+        self._items = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self.to_dicts()[row]
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_items'] = None
+        return state
+
+    def _row_values(self, columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """Per-row dicts of a group of columns, converting each column to Python values once"""
+        names = list(columns)
+        values = [np.asarray(columns[name]).tolist() for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)] if names else [{} for _ in self.ids]
+
+    def dense_vectors(self) -> np.ndarray:
+        """The vectors as a dense float32 matrix; sparse batches are densified in one call"""
+        if sparse.issparse(self.vectors):
+            return self.vectors.astype(np.float32).toarray()
+        return self.vectors
+    
+    def records(self) -> List[Dict[str, Any]]:
+        """Item dicts without their vectors, e.g. for upsert_matrix"""
+        fields = self._row_values(self.fields)
+        metadata = self._row_values(self.metadata)
+        return [{'id': item_id, **item_fields, 'metadata': item_metadata}
+                for item_id, item_fields, item_metadata in zip(self.ids, fields, metadata)]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Item dicts with 'vector' lists, built on first use and then reused"""
+        if self._items is None:
+            vectors = self.dense_vectors().tolist()
+            self._items = [
+                {'id': record['id'], **{name: record[name] for name in self.fields},
+                 'vector': vector, 'metadata': record['metadata']}
+                for record, vector in zip(self.records(), vectors)
+            ]
+        return self._items
+
+
+def _read_csv_chunks(csv_path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """A CSV as DataFrames of at most chunk_size rows, labelled by their row in the file"""
+    yield from pd.read_csv(csv_path, chunksize=chunk_size)
+
 
 class SpotifyDataProcessor:
-    def __init__(self, csv_path):
-        self.df = pd.read_csv(csv_path)
+    def __init__(self, csv_path, chunk_size: Optional[int] = None):
+        # With chunk_size the CSV is never loaded whole: iter_embedding_batches() streams it
+        self.csv_path = csv_path
+        self.chunk_size = chunk_size
+        self.df = pd.read_csv(csv_path) if chunk_size is None else None
         self.scaler = StandardScaler()
         self.audio_features = [
             'danceability', 'energy', 'speechiness', 'acousticness', 
@@ -35,39 +112,65 @@ class SpotifyDataProcessor:
         
         return audio_features_normalized
     
-    def create_embeddings(self):
-        """Create vector embeddings from audio features"""
+    def create_embedding_batch(self) -> EmbeddingBatch:
+        """Create vector embeddings from audio features as one columnar batch"""
         audio_features = self.preprocess_data()
         
-        # Extract features for embedding
-        feature_matrix = self.df[audio_features].values
-        
-        # Standardize the features
-        feature_matrix_scaled = self.scaler.fit_transform(feature_matrix)
+        # Standardize the features; row i of the matrix is the i-th remaining track
+        feature_matrix_scaled = self.scaler.fit_transform(self.df[audio_features].values).astype(np.float32)
         
-        # Create embeddings dictionary
-        embeddings = []
-        for idx, row in self.df.iterrows():
-            embedding = {
-                'id': f"spotify_{idx}",
-                'title': f"{row['track_name']} - {row['artists']}",
-                'genre': row['track_genre'],
-                'vector': feature_matrix_scaled[idx].tolist(),
-                'metadata': {
-                    'track_name': row['track_name'],
-                    'artists': row['artists'],
-                    'album_name': row['album_name'],
-                    'genre': row['track_genre'],
-                    'popularity': row['popularity'],
-                    'danceability': row['danceability'],
-                    'energy': row['energy'],
-                    'valence': row['valence'],
-                    'tempo': row['tempo']
-                }
+        return self._embedding_batch(self.df, feature_matrix_scaled)
+    
+    @staticmethod
+    def _embedding_batch(df: pd.DataFrame, vectors: np.ndarray) -> EmbeddingBatch:
+        """Batch of the tracks in df, whose row i has vector i"""
+        # Ids keep the CSV row label, so they survive rows dropped by dropna()
+        return EmbeddingBatch(
+            ids=('spotify_' + df.index.astype(str)).to_numpy(dtype=object),
+            vectors=vectors,
+            fields={
+                'title': (df['track_name'] + ' - ' + df['artists']).to_numpy(dtype=object),
+                'genre': df['track_genre'].to_numpy(dtype=object)
+            },
+            metadata={
+                'track_name': df['track_name'].to_numpy(dtype=object),
+                'artists': df['artists'].to_numpy(dtype=object),
+                'album_name': df['album_name'].to_numpy(dtype=object),
+                'genre': df['track_genre'].to_numpy(dtype=object),
+                'popularity': df['popularity'].to_numpy(),
+                'danceability': df['danceability'].to_numpy(),
+                'energy': df['energy'].to_numpy(),
+                'valence': df['valence'].to_numpy(),
+                'tempo': df['tempo'].to_numpy()
             }
-            embeddings.append(embedding)
+        )
+    
+    def create_embeddings(self):
+        """Create vector embeddings from audio features"""
+        return self.create_embedding_batch().to_dicts()
+    
+    def iter_embedding_batches(self) -> Iterator[EmbeddingBatch]:
+        """
+        Streaming ingest for processors created with chunk_size: a first pass
+        over the CSV fits the scaler with partial_fit, a second yields one
+        EmbeddingBatch per chunk, so memory is bounded by the chunk size.
+        Min-max scaling tempo and loudness (as preprocess_data does) is affine
+        and standardization cancels it, so the raw columns are standardized
+        directly and give the same vectors.
+        """
+        if self.chunk_size is None:
+            raise ValueError("Streaming ingest needs a processor created with chunk_size")
+        self.scaler = StandardScaler()
+        for chunk in _read_csv_chunks(self.csv_path, self.chunk_size):
+            chunk = chunk.dropna()
+            if len(chunk):
+                self.scaler.partial_fit(chunk[self.audio_features].values)
         
-        return embeddings
+        for chunk in _read_csv_chunks(self.csv_path, self.chunk_size):
+            chunk = chunk.dropna()
+            if len(chunk):
+                vectors = self.scaler.transform(chunk[self.audio_features].values).astype(np.float32)
+                yield self._embedding_batch(chunk, vectors)
     
     def get_processed_dataframe(self):
         """Return the processed dataframe"""
@@ -76,10 +179,14 @@ class SpotifyDataProcessor:
 
 
 class NetflixDataProcessor:
-    def __init__(self, csv_path):
-        self.df = pd.read_csv(csv_path)
+    def __init__(self, csv_path, max_features=100, chunk_size: Optional[int] = None):
+        # With chunk_size the CSV is never loaded whole: iter_embedding_batches() streams it
+        self.csv_path = csv_path
+        self.chunk_size = chunk_size
+        self.df = pd.read_csv(csv_path) if chunk_size is None else None
+        self.tfidf_matrix = None
         self.tfidf_vectorizer = TfidfVectorizer(
-            max_features=100, 
+            max_features=max_features, 
             stop_words='english',
             lowercase=True
         )
@@ -92,84 +199,178 @@ class NetflixDataProcessor:
         text = re.sub(r'[^a-zA-Z\s]', '', text)
         return text
     
-    def preprocess_data(self):
-        """Preprocess Netflix data for vector embedding"""
+    def _clean_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Drop incomplete titles and add the cleaned and combined text columns"""
         # Clean and prepare the data
-        self.df = self.df.dropna(subset=['title', 'description'])
+        df = df.dropna(subset=['title', 'description'])
         
         # Clean text fields
-        self.df['description_clean'] = self.df['description'].apply(self.clean_text)
-        self.df['listed_in_clean'] = self.df['listed_in'].apply(self.clean_text)
-        self.df['cast_clean'] = self.df['cast'].fillna('').apply(self.clean_text)
-        self.df['director_clean'] = self.df['director'].fillna('').apply(self.clean_text)
+        df['description_clean'] = df['description'].apply(self.clean_text)
+        df['listed_in_clean'] = df['listed_in'].apply(self.clean_text)
+        df['cast_clean'] = df['cast'].fillna('').apply(self.clean_text)
+        df['director_clean'] = df['director'].fillna('').apply(self.clean_text)
         
         # Combine text features
-        self.df['combined_features'] = (
-            self.df['description_clean'] + ' ' + 
-            self.df['listed_in_clean'] + ' ' + 
-            self.df['cast_clean'] + ' ' + 
-            self.df['director_clean']
+        df['combined_features'] = (
+            df['description_clean'] + ' ' + 
+            df['listed_in_clean'] + ' ' + 
+            df['cast_clean'] + ' ' + 
+            df['director_clean']
         )
         
+        return df
+    
+    def preprocess_data(self):
+        """Preprocess Netflix data for vector embedding"""
+        self.df = self._clean_frame(self.df)
         return self.df
     
+    def create_embedding_batch(self) -> EmbeddingBatch:
+        """Create TF-IDF embeddings as one batch whose vectors are the sparse matrix itself"""
+        df = self.preprocess_data()
+        
+        # Row i of the TF-IDF matrix belongs to the i-th remaining title
+        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(df['combined_features'])
+        return self._embedding_batch(df, self.tfidf_matrix)
+    
+    @staticmethod
+    def _embedding_batch(df: pd.DataFrame, vectors) -> EmbeddingBatch:
+        """Batch of the titles in df, whose row i has vector i"""
+        return EmbeddingBatch(
+            ids=('netflix_' + df.index.astype(str)).to_numpy(dtype=object),
+            vectors=vectors,
+            fields={
+                'title': df['title'].to_numpy(dtype=object),
+                'type': df['type'].to_numpy(dtype=object)
+            },
+            metadata={
+                'title': df['title'].to_numpy(dtype=object),
+                'type': df['type'].to_numpy(dtype=object),
+                'director': df['director'].fillna('Unknown').to_numpy(dtype=object),
+                'cast': df['cast'].fillna('Unknown').to_numpy(dtype=object),
+                'country': df['country'].fillna('Unknown').to_numpy(dtype=object),
+                'release_year': df['release_year'].to_numpy(),
+                'rating': df['rating'].to_numpy(dtype=object),
+                'listed_in': df['listed_in'].to_numpy(dtype=object),
+                'description': df['description'].to_numpy(dtype=object)
+            }
+        )
+    
     def create_embeddings(self):
         """Create vector embeddings from text features using TF-IDF"""
-        self.preprocess_data()
-        
-        # Create TF-IDF vectors
-        tfidf_matrix = self.tfidf_vectorizer.fit_transform(self.df['combined_features'])
+        return self.create_embedding_batch().to_dicts()
+    
+    def _iter_clean_chunks(self) -> Iterator[pd.DataFrame]:
+        for chunk in _read_csv_chunks(self.csv_path, self.chunk_size):
+            chunk = self._clean_frame(chunk)
+            if len(chunk):
+                yield chunk
+    
+    def _count_terms(self, texts) -> Tuple[Counter, Counter]:
+        """Term and document frequencies of cleaned texts under the vectorizer's analyzer"""
+        analyze = self.tfidf_vectorizer.build_analyzer()
+        term_counts, document_counts = Counter(), Counter()
+        for text in texts:
+            tokens = analyze(text)
+            term_counts.update(tokens)
+            document_counts.update(set(tokens))
+        return term_counts, document_counts
+    
+    def _set_vocabulary(self, term_counts: Counter, document_counts: Counter, documents: int):
+        """
+        Fix the vectorizer's vocabulary (the max_features most frequent
+        terms) and smoothed idf from corpus-wide counts, exactly as
+        TfidfVectorizer.fit would
+        """
+        if not term_counts:
+            raise ValueError("Empty vocabulary: the CSV has no usable text")
         
-        # Create embeddings dictionary
-        embeddings = []
-        for idx, row in self.df.iterrows():
-            embedding = {
-                'id': f"netflix_{idx}",
-                'title': row['title'],
-                'type': row['type'],
-                'vector': tfidf_matrix[idx].toarray()[0].tolist(),
-                'metadata': {
-                    'title': row['title'],
-                    'type': row['type'],
-                    'director': row['director'] if not pd.isna(row['director']) else 'Unknown',
-                    'cast': row['cast'] if not pd.isna(row['cast']) else 'Unknown',
-                    'country': row['country'] if not pd.isna(row['country']) else 'Unknown',
-                    'release_year': row['release_year'],
-                    'rating': row['rating'],
-                    'listed_in': row['listed_in'],
-                    'description': row['description']
-                }
-            }
-            embeddings.append(embedding)
+        terms = np.array(sorted(term_counts), dtype=object)
+        limit = self.tfidf_vectorizer.max_features
+        if limit is not None and len(terms) > limit:
+            # Same selection as sklearn: argsort of negated counts over the sorted terms
+            frequencies = np.array([term_counts[term] for term in terms], dtype=np.int64)
+            terms = np.sort(terms[(-frequencies).argsort()[:limit]])
+        document_frequency = np.array([document_counts[term] for term in terms], dtype=np.float64)
         
-        return embeddings
+        self.tfidf_vectorizer.set_params(vocabulary=list(terms))
+        self.tfidf_vectorizer.idf_ = np.log((1 + documents) / (1 + document_frequency)) + 1
+    
+    def _fit_vocabulary_streaming(self):
+        """First streaming pass: count term and document frequencies chunk by chunk"""
+        term_counts, document_counts, documents = Counter(), Counter(), 0
+        for chunk in self._iter_clean_chunks():
+            chunk_terms, chunk_documents = self._count_terms(chunk['combined_features'])
+            term_counts.update(chunk_terms)
+            document_counts.update(chunk_documents)
+            documents += len(chunk)
+        self._set_vocabulary(term_counts, document_counts, documents)
+    
+    def iter_embedding_batches(self) -> Iterator[EmbeddingBatch]:
+        """
+        Streaming ingest for processors created with chunk_size: a first pass
+        fixes the TF-IDF vocabulary and idf from running counts, a second
+        yields one sparse EmbeddingBatch per chunk, so memory is bounded by
+        the chunk size and the vocabulary rather than by the file
+        """
+        if self.chunk_size is None:
+            raise ValueError("Streaming ingest needs a processor created with chunk_size")
+        self._fit_vocabulary_streaming()
+        for chunk in self._iter_clean_chunks():
+            yield self._embedding_batch(chunk, self.tfidf_vectorizer.transform(chunk['combined_features']))
     
     def get_processed_dataframe(self):
         """Return the processed dataframe"""
         return self.preprocess_data()
 
 
-def load_and_process_datasets(spotify_path, netflix_path):
-    """Load and process both datasets"""
-    # Process Spotify data
-    spotify_processor = SpotifyDataProcessor(spotify_path)
-    spotify_embeddings = spotify_processor.create_embeddings()
-    spotify_df = spotify_processor.get_processed_dataframe()
+def _process_dataset(name: str, processor_class, csv_path, cache: Optional[ArtifactCache] = None,
+                     **options) -> Dict[str, Any]:
+    """
+    Embeddings, processed dataframe and fitted processor of one dataset,
+    read from the artifact cache when neither the file contents nor the
+    processor options changed since they were stored
+    """
+    key = None
+    if cache is not None:
+        key = artifact_key(csv_path, {'processor': processor_class.__name__, 'options': options})
+        cached = cache.load(name, key)
+        if cached is not None:
+            processor, vectors = cached
+            if hasattr(processor, 'tfidf_matrix'):
+                processor.tfidf_matrix = vectors
+            return {
+                'embeddings': processor._embedding_batch(processor.df, vectors),
+                'dataframe': processor.df,
+                'processor': processor
+            }
     
-    # Process Netflix data
-    netflix_processor = NetflixDataProcessor(netflix_path)
-    netflix_embeddings = netflix_processor.create_embeddings()
-    netflix_df = netflix_processor.get_processed_dataframe()
+    processor = processor_class(csv_path, **options)
+    embeddings = processor.create_embedding_batch()
+    dataframe = processor.get_processed_dataframe()
+    if cache is not None:
+        # The TF-IDF matrix is stored once, as the vectors
+        stored = copy.copy(processor)
+        if hasattr(stored, 'tfidf_matrix'):
+            stored.tfidf_matrix = None
+        cache.store(name, key, stored, embeddings.vectors)
     
     return {
-        'spotify': {
-            'embeddings': spotify_embeddings,
-            'dataframe': spotify_df,
-            'processor': spotify_processor
-        },
-        'netflix': {
-            'embeddings': netflix_embeddings,
-            'dataframe': netflix_df,
-            'processor': netflix_processor
-        }
-    }
\ No newline at end of file
+        'embeddings': embeddings,
+        'dataframe': dataframe,
+        'processor': processor
+    }
+
+
+def load_and_process_datasets(spotify_path, netflix_path, cache_dir: Optional[str] = None):
+    """
+    Load and process both datasets. With cache_dir, fitted processors and
+    embedding matrices are kept on disk keyed by a hash of each file's
+    contents and the processor options, so a restart or another worker
+    process only recomputes the datasets that changed.
+    """
+    cache = ArtifactCache(cache_dir) if cache_dir else None
+    return {
+        'spotify': _process_dataset('spotify', SpotifyDataProcessor, spotify_path, cache),
+        'netflix': _process_dataset('netflix', NetflixDataProcessor, netflix_path, cache, max_features=100)
+    }
@@ -0,0 +1,235 @@
+import os
+import numpy as np
+import scipy.sparse as sparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from metrics import rank_scores
+
+
+class KNNGraph:
+    """
+    Precomputed k-nearest-neighbour lists for every row of a VectorIndex:
+    int32 neighbour rows and float32 scores, best first (a row lists
+    itself too). Built with blocked matrix products spread over worker
+    threads, so each worker holds at most SCORE_BUDGET scores at once.
+
+    Kept current incrementally: rows added by an upsert get their own
+    lists and are merged into the existing lists they now belong to;
+    tombstoned neighbours are skipped when serving, and compaction
+    renumbers the lists and recomputes those that lost entries. Readers
+    take no lock: neighbour rows and scores are published together as one
+    pair, and lists that readers may see are only ever rewritten in a copy
+    that is then swapped in, as storage versions are.
+
+    Scores follow the index metric, higher is better: cosine similarity,
+    dot product, or the negated squared euclidean distance.
+    """
+
+    # Score-block elements (float32) each worker holds at once
+    SCORE_BUDGET = 1 << 22
+
+    def __init__(self, k: int = 16, workers: Optional[int] = None, metric: str = 'cosine'):
+        if k < 1:
+            raise ValueError("A kNN graph needs k >= 1")
+        self.k = k
+        self.metric = metric
+        self.workers = workers or os.cpu_count() or 1
+        self.layout = None
+        self._lists = self._empty_lists(0)
+
+    def __getstate__(self):
+        # Snapshots keep the arrays as two attributes
+        state = dict(self.__dict__)
+        state['_neighbors'], state['_scores'] = state.pop('_lists')
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        state['_lists'] = (state.pop('_neighbors'), state.pop('_scores'))
+        self.__dict__.update(state)
+
+    def _empty_lists(self, capacity: int) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.full((capacity, self.k), -1, dtype=np.int32),
+                np.full((capacity, self.k), -np.inf, dtype=np.float32))
+
+    @staticmethod
+    def _matrix(storage, size: int):
+        """Rows [0, size) of a storage and their norms, including rows written past its published size"""
+        vectors = storage.version(size, storage.alive, storage.dead).vectors
+        # Sparse versions already span exactly `size` rows; dense ones span the capacity
+        return (vectors[:size] if vectors.shape[0] > size else vectors), storage.norms[:size]
+
+    def _ensure_capacity(self, capacity: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The published lists, first grown to capacity rows if needed"""
+        lists = self._lists
+        if len(lists[0]) < capacity:
+            neighbors, scores = self._empty_lists(capacity)
+            neighbors[:len(lists[0])] = lists[0]
+            scores[:len(lists[1])] = lists[1]
+            lists = neighbors, scores
+            self._lists = lists
+        return lists
+
+    def _best(self, candidates: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Per row, the k best (candidate, score) pairs, best first and padded with (-1, -inf)"""
+        k = min(self.k, scores.shape[1])
+        if k < scores.shape[1]:
+            positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            positions = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        best_scores = np.take_along_axis(scores, positions, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best = np.take_along_axis(np.take_along_axis(candidates, positions, axis=1), order, axis=1)
+
+        neighbors = np.full((len(scores), self.k), -1, dtype=np.int32)
+        padded_scores = np.full((len(scores), self.k), -np.inf, dtype=np.float32)
+        neighbors[:, :k] = np.where(np.isfinite(best_scores), best, -1)
+        padded_scores[:, :k] = best_scores
+        return neighbors, padded_scores
+
+    def _score_rows(self, matrix, norms: np.ndarray, rows: np.ndarray, excluded: np.ndarray) -> np.ndarray:
+        """Dense (rows x matrix rows) similarity block with excluded columns at -inf"""
+        block = matrix[rows] @ matrix.T
+        block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+        if self.metric != 'cosine':
+            block = rank_scores(block * norms[rows, None], norms, self.metric)
+            if self.metric == 'euclidean':
+                # Add the querying row's own term: scores merged into other rows' lists must be symmetric
+                block -= norms[rows, None] ** 2
+        block[:, excluded] = -np.inf
+        return block
+
+    def _blocks(self, rows: np.ndarray, size: int) -> list:
+        block_size = max(1, self.SCORE_BUDGET // max(size, 1))
+        return [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+
+    def _compute(self, lists: Tuple[np.ndarray, np.ndarray], matrix, norms: np.ndarray, rows: np.ndarray,
+                 excluded: np.ndarray):
+        """(Re)build the given rows of unpublished lists against every non-excluded row of matrix"""
+        size = matrix.shape[0]
+        columns = np.arange(size)
+        neighbors, scores = lists
+
+        def build(block: np.ndarray):
+            block_scores = self._score_rows(matrix, norms, block, excluded)
+            neighbors[block], scores[block] = self._best(
+                np.broadcast_to(columns, block_scores.shape), block_scores
+            )
+
+        # numpy releases the GIL inside the products, so blocks run in parallel
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(build, self._blocks(rows, size)))
+
+    def attach(self, storage):
+        """Build the lists of every live row of a storage"""
+        self.layout = None
+        lists = self._empty_lists(storage.capacity)
+        size = storage.size
+        if size:
+            self._compute(lists, *self._matrix(storage, size), np.flatnonzero(storage.alive[:size]),
+                          ~storage.alive[:size])
+        self._lists = lists
+        self.layout = storage.layout
+
+    def add_rows(self, storage, rows: np.ndarray):
+        """
+        List rows just written past the published size and merge them into
+        existing lists. New rows' lists are written in place (no published
+        version reaches them yet); existing lists change in a copy of both
+        arrays, published once every block is merged.
+        """
+        neighbors, scores = self._ensure_capacity(storage.capacity)
+        copied = False
+        rows = np.asarray(rows)
+        start, end = int(rows.min()), int(rows.max()) + 1
+        matrix, norms = self._matrix(storage, end)
+        excluded = np.zeros(end, dtype=bool)
+        excluded[:start] = ~storage.alive[:start]
+        columns = np.arange(end)
+
+        for block in self._blocks(rows, end):
+            block_scores = self._score_rows(matrix, norms, block, excluded)
+            neighbors[block], scores[block] = self._best(
+                np.broadcast_to(columns, block_scores.shape), block_scores
+            )
+            # Existing rows for which some new row beats their current k-th neighbour
+            incoming = block_scores[:, :start].T
+            improved = np.flatnonzero(
+                (incoming > scores[:start, -1:]).any(axis=1) & storage.alive[:start]
+            )
+            if len(improved):
+                if not copied:
+                    neighbors, scores = neighbors.copy(), scores.copy()
+                    copied = True
+                candidates = np.hstack([neighbors[improved], np.broadcast_to(block, (len(improved), len(block)))])
+                candidate_scores = np.hstack([scores[improved], incoming[improved]])
+                neighbors[improved], scores[improved] = self._best(candidates, candidate_scores)
+        self._lists = neighbors, scores
+
+    def remap(self, storage, keep: Optional[np.ndarray] = None):
+        """Follow the index onto a new storage; on compaction renumber and repair the lists"""
+        if keep is None:
+            self._ensure_capacity(storage.capacity)
+            self.layout = storage.layout
+            return
+
+        # Renumbered lists no longer match the published rows until the new layout is
+        self.layout = None
+        old_neighbors, old_scores = self._lists
+        renumber = np.full(len(old_neighbors) + 1, -1, dtype=np.int32)
+        renumber[keep] = np.arange(len(keep), dtype=np.int32)
+        # Index -1 (padding) maps through the extra last slot to -1
+        kept = renumber[old_neighbors[keep]]
+        kept_scores = np.where(kept >= 0, old_scores[keep], -np.inf).astype(np.float32)
+        order = np.argsort(kept < 0, axis=1, kind='stable')
+
+        neighbors, scores = self._empty_lists(storage.capacity)
+        neighbors[:len(keep)] = np.take_along_axis(kept, order, axis=1)
+        scores[:len(keep)] = np.take_along_axis(kept_scores, order, axis=1)
+
+        # Lists that lost neighbours to the compaction are recomputed
+        size = storage.size
+        incomplete = np.flatnonzero((neighbors[:size] >= 0).sum(axis=1) < min(self.k, size))
+        if len(incomplete):
+            self._compute((neighbors, scores), *self._matrix(storage, size), incomplete, ~storage.alive[:size])
+        self._lists = neighbors, scores
+        self.layout = storage.layout
+
+    def neighbors(self, storage, row: int, top_k: int,
+                  allowed: Optional[np.ndarray] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (rows, scores) of the top_k eligible neighbours of a row in a storage
+        version, ties ordered by item id as select_top_k orders them, or None
+        when the stored list cannot answer exactly (other layout, top_k above
+        k, too many neighbours tombstoned/filtered out, or a tie at the k-th
+        result that rows left off a full list could be part of)
+        """
+        layout = self.layout
+        neighbors, scores = self._lists
+        if layout is not storage.layout or top_k > self.k or row >= len(neighbors):
+            return None
+        if self.layout is not layout:
+            # A compaction renumbered the lists while they were read
+            return None
+        listed, listed_scores = neighbors[row], scores[row]
+        eligible = allowed if allowed is not None else storage.alive
+        rows_in_version = (listed >= 0) & (listed < storage.size)
+        keep = rows_in_version.copy()
+        keep[rows_in_version] = eligible[listed[rows_in_version]]
+        if keep.sum() < top_k:
+            return None
+        rows, row_scores = listed[keep].astype(np.int64), listed_scores[keep]
+        if listed[-1] >= 0 and listed_scores[-1] == row_scores[top_k - 1]:
+            # Rows tied with the k-th result may not have made it onto the full list
+            return None
+        if np.any(np.diff(row_scores) == 0):
+            ids = storage.row_ids
+            order = sorted(range(len(rows)), key=lambda position: (-row_scores[position], ids[rows[position]]))
+            rows, row_scores = rows[order], row_scores[order]
+        return rows[:top_k], row_scores[:top_k]
+
+    def nbytes(self, size: int) -> int:
+        """Bytes of neighbour rows and scores held for `size` rows"""
+        return size * self.k * (4 + 4)
@@ -0,0 +1,525 @@
+import copy
+import numbers
+import numpy as np
+from collections.abc import Hashable
+from typing import Any, Dict, List, Optional, Sequence
+from snapshot import save_array, load_array, save_pickle, load_pickle
+
+
+def _lookup_key(value):
+    """
+    Dictionary key of a categorical value: strings as themselves, anything
+    else with its type, so True, 1 and 1.0 keep their own codes and read
+    back unchanged
+    """
+    return value if isinstance(value, str) else (type(value), value)
+
+
+class _CategoricalColumn:
+    """
+    Dictionary-encoded column for repeated values (genre, type, rating...).
+    Each row stores an int32 code; equality bitmaps per value are built on
+    first use over the rows a query can see and reused by later queries.
+    """
+
+    kind = 'categorical'
+
+    def __init__(self, capacity: int):
+        self.codes = np.full(capacity, -1, dtype=np.int32)
+        self.values = []
+        self.lookup = {}
+        self._bitmaps = {}
+
+    def grow(self, capacity: int):
+        if len(self.codes) < capacity:
+            codes = np.full(capacity, -1, dtype=np.int32)
+            codes[:len(self.codes)] = self.codes
+            self.codes = codes
+
+    def _code(self, value) -> int:
+        key = _lookup_key(value)
+        code = self.lookup.get(key)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.lookup[key] = code
+        return code
+
+    def _codes_for(self, value) -> List[int]:
+        """Codes of the stored values equal to a filter operand (bools only match bools)"""
+        if isinstance(value, str):
+            keys = (value,)
+        elif _is_numeric(value):
+            keys = ((int, value), (float, value))
+        else:
+            keys = ((type(value), value),)
+        codes = [self.lookup.get(key) for key in keys]
+        return [code for code in codes if code is not None]
+
+    def set(self, rows, values):
+        # Only rows past every published size are written, so cached bitmaps stay valid
+        self.codes[rows] = [-1 if value is None else self._code(value) for value in values]
+
+    def taken(self, keep: np.ndarray, capacity: int) -> '_CategoricalColumn':
+        """New column holding only the kept rows, renumbered from 0"""
+        column = _CategoricalColumn(capacity)
+        column.codes[:len(keep)] = self.codes[keep]
+        column.values = list(self.values)
+        column.lookup = dict(self.lookup)
+        return column
+
+    def save(self, directory: str, name: str, size: int) -> Dict[str, Any]:
+        return {'kind': self.kind, 'codes': save_array(directory, name, self.codes[:size]), 'values': self.values}
+
+    @classmethod
+    def load(cls, directory: str, entry: Dict[str, Any], mmap: bool) -> '_CategoricalColumn':
+        column = cls(0)
+        column.codes = load_array(directory, entry['codes'], mmap)
+        column.values = list(entry['values'])
+        column.lookup = {_lookup_key(value): code for code, value in enumerate(column.values)}
+        return column
+
+    def rows(self) -> np.ndarray:
+        """Rows holding a value"""
+        return np.flatnonzero(self.codes >= 0)
+
+    def get(self, row: int):
+        code = self.codes[row]
+        return None if code < 0 else self.values[code]
+
+    def _bitmap(self, value, size: int) -> np.ndarray:
+        bitmap = np.zeros(size, dtype=bool)
+        for code in self._codes_for(value):
+            cached = self._bitmaps.get(code)
+            if cached is None or len(cached) < size:
+                cached = self.codes[:size] == code
+                self._bitmaps[code] = cached
+            bitmap |= cached[:size]
+        return bitmap
+
+    def mask(self, operator: str, operand, size: int) -> np.ndarray:
+        present = self.codes[:size] >= 0
+        if operator == '$eq':
+            return self._bitmap(operand, size)
+        if operator == '$ne':
+            return present & ~self._bitmap(operand, size)
+        if operator in ('$in', '$nin'):
+            codes = [code for value in operand for code in self._codes_for(value)]
+            matched = np.isin(self.codes[:size], codes)
+            return matched if operator == '$in' else present & ~matched
+        raise ValueError(f"Operator '{operator}' is not supported on categorical field values")
+
+
+class _NumericColumn:
+    """
+    float64 column (NaN marks missing values). Range predicates use a sorted
+    copy of the values plus the sorting permutation, built lazily and
+    reused while the number of visible rows is unchanged. Values read back
+    are ints while every value written to the column was integral.
+    """
+
+    kind = 'numeric'
+
+    def __init__(self, capacity: int):
+        self.values = np.full(capacity, np.nan, dtype=np.float64)
+        self.integral = True
+        self._sorted = None
+
+    def grow(self, capacity: int):
+        if len(self.values) < capacity:
+            values = np.full(capacity, np.nan, dtype=np.float64)
+            values[:len(self.values)] = self.values
+            self.values = values
+
+    def set(self, rows, values):
+        self.integral = self.integral and all(
+            value is None or isinstance(value, numbers.Integral) for value in values
+        )
+        self.values[rows] = [np.nan if value is None else float(value) for value in values]
+
+    def taken(self, keep: np.ndarray, capacity: int) -> '_NumericColumn':
+        """New column holding only the kept rows, renumbered from 0"""
+        column = _NumericColumn(capacity)
+        column.values[:len(keep)] = self.values[keep]
+        column.integral = self.integral
+        return column
+
+    def save(self, directory: str, name: str, size: int) -> Dict[str, Any]:
+        return {'kind': self.kind, 'values': save_array(directory, name, self.values[:size]),
+                'integral': self.integral}
+
+    @classmethod
+    def load(cls, directory: str, entry: Dict[str, Any], mmap: bool) -> '_NumericColumn':
+        column = cls(0)
+        column.values = load_array(directory, entry['values'], mmap)
+        column.integral = entry['integral']
+        return column
+
+    def rows(self) -> np.ndarray:
+        """Rows holding a value"""
+        return np.flatnonzero(~np.isnan(self.values))
+
+    def get(self, row: int):
+        value = self.values[row]
+        if np.isnan(value):
+            return None
+        return int(value) if self.integral else float(value)
+
+    def _sorted_index(self, size: int):
+        cached = self._sorted
+        if cached is None or cached[0] != size:
+            order = np.argsort(self.values[:size], kind='stable')
+            cached = (size, order, self.values[:size][order])
+            self._sorted = cached
+        return cached[1], cached[2]
+
+    def _range(self, low: float, high: float, include_low: bool, include_high: bool, size: int) -> np.ndarray:
+        order, ordered = self._sorted_index(size)
+        start = np.searchsorted(ordered, low, side='left' if include_low else 'right')
+        end = np.searchsorted(ordered, high, side='right' if include_high else 'left')
+        mask = np.zeros(size, dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    def mask(self, operator: str, operand, size: int) -> np.ndarray:
+        values = self.values[:size]
+        if operator == '$eq':
+            return values == operand
+        if operator == '$ne':
+            return ~np.isnan(values) & (values != operand)
+        if operator in ('$in', '$nin'):
+            matched = np.isin(values, np.asarray(operand, dtype=np.float64))
+            return matched if operator == '$in' else ~np.isnan(values) & ~matched
+        if operator == '$gt':
+            return self._range(operand, np.inf, False, True, size)
+        if operator == '$gte':
+            return self._range(operand, np.inf, True, True, size)
+        if operator == '$lt':
+            return self._range(-np.inf, operand, True, False, size)
+        if operator == '$lte':
+            return self._range(-np.inf, operand, True, True, size)
+        raise ValueError(f"Unsupported filter operator '{operator}'")
+
+
+class _ObjectColumn:
+    """
+    Column of Python objects for values the typed columns cannot hold:
+    lists of values (Pinecone's multi-valued metadata), nested dicts and
+    other unhashable values, alone or mixed with scalars. They are stored
+    and read back as copies. Filters scan the visible rows; a list
+    matches $eq/$in when any of its elements does, and $ne/$nin when none
+    does.
+    """
+
+    kind = 'object'
+
+    def __init__(self, capacity: int):
+        self.values = np.full(capacity, None, dtype=object)
+
+    def grow(self, capacity: int):
+        if len(self.values) < capacity:
+            values = np.full(capacity, None, dtype=object)
+            values[:len(self.values)] = self.values
+            self.values = values
+
+    def set(self, rows, values):
+        column = np.empty(len(values), dtype=object)
+        # Copied, so later changes to the caller's record do not reach the column
+        column[:] = [copy.deepcopy(value) for value in values]
+        self.values[rows] = column
+
+    def taken(self, keep: np.ndarray, capacity: int) -> '_ObjectColumn':
+        """New column holding only the kept rows, renumbered from 0"""
+        column = _ObjectColumn(capacity)
+        column.values[:len(keep)] = self.values[keep]
+        return column
+
+    def save(self, directory: str, name: str, size: int) -> Dict[str, Any]:
+        return {'kind': self.kind, 'values': save_pickle(directory, name, self.values[:size].tolist())}
+
+    @classmethod
+    def load(cls, directory: str, entry: Dict[str, Any], mmap: bool) -> '_ObjectColumn':
+        values = load_pickle(directory, entry['values'])
+        column = cls(len(values))
+        column.values[:] = values
+        return column
+
+    def rows(self) -> np.ndarray:
+        """Rows holding a value"""
+        return np.flatnonzero([value is not None for value in self.values])
+
+    def get(self, row: int):
+        value = self.values[row]
+        return value if isinstance(value, (str, numbers.Number)) else copy.deepcopy(value)
+
+    @staticmethod
+    def _elements(value) -> list:
+        return list(value) if _is_multi_valued(value) else [value]
+
+    def _matching(self, size: int, predicate) -> np.ndarray:
+        """Rows holding a value, or a list with an element, that satisfies predicate"""
+        return np.fromiter(
+            (value is not None and any(predicate(element) for element in self._elements(value))
+             for value in self.values[:size]),
+            dtype=bool, count=size
+        )
+
+    def mask(self, operator: str, operand, size: int) -> np.ndarray:
+        if operator in ('$eq', '$ne', '$in', '$nin'):
+            wanted = [operand] if operator in ('$eq', '$ne') else list(operand)
+            matched = self._matching(size, lambda element: any(
+                element == value and isinstance(element, bool) == isinstance(value, bool) for value in wanted
+            ))
+            if operator in ('$eq', '$in'):
+                return matched
+            present = np.fromiter((value is not None for value in self.values[:size]), dtype=bool, count=size)
+            return present & ~matched
+        comparisons = {
+            '$gt': lambda element: element > operand,
+            '$gte': lambda element: element >= operand,
+            '$lt': lambda element: element < operand,
+            '$lte': lambda element: element <= operand
+        }
+        if operator not in comparisons:
+            raise ValueError(f"Unsupported filter operator '{operator}'")
+        compare = comparisons[operator]
+        return self._matching(size, lambda element: _is_numeric(element) and compare(element))
+
+
+def _is_numeric(value) -> bool:
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _is_multi_valued(value) -> bool:
+    return isinstance(value, (list, tuple, set))
+
+
+def _needs_object_column(value) -> bool:
+    """Lists, dicts and other values a dictionary-encoded column cannot key"""
+    return _is_multi_valued(value) or not isinstance(value, Hashable)
+
+
+class MetadataIndex:
+    """
+    Per-field columns over item records, aligned with VectorIndex rows:
+    `columns` holds the fields of each record's 'metadata' dict and
+    `attributes` its other top-level fields (title, genre...). Records are
+    not kept as dicts; records() rebuilds the requested fields of a few
+    rows from the columns. Values no typed column can hold (lists, nested
+    dicts) live in object columns and round-trip unchanged. Evaluates
+    Pinecone-style filters over the metadata columns ({'genre': 'pop'},
+    {'release_year': {'$gte': 2010}}, {'type': {'$in': [...]}},
+    '$and'/'$or') into a boolean row mask.
+
+    Columns follow the storage `layout` they were built for; evaluate() and
+    records() return None when a storage version's rows are numbered
+    differently (a compaction happened), so the caller can retry on the
+    new version.
+    """
+
+    OPERATORS = ('$eq', '$ne', '$in', '$nin', '$gt', '$gte', '$lt', '$lte')
+
+    # Record keys that never become attribute columns (the vector lives in the row storage)
+    RESERVED_KEYS = ('id', 'metadata', 'values', 'vector', 'sparse_values')
+
+    def __init__(self):
+        self.columns = {}
+        self.attributes = {}
+        self.layout = None
+        self._capacity = 0
+
+    def _column_for(self, group: str, field: str, values) -> Any:
+        """
+        Get or create the column for a field in a group ('columns' or
+        'attributes'), widening numeric columns to categorical on mixed data
+        and either to an object column once lists, dicts or other unhashable
+        values arrive
+        """
+        columns = getattr(self, group)
+        column = columns.get(field)
+        present = [value for value in values if value is not None]
+        objects = any(_needs_object_column(value) for value in present)
+        if column is None:
+            if objects:
+                column = _ObjectColumn(self._capacity)
+            elif present and all(_is_numeric(value) for value in present):
+                column = _NumericColumn(self._capacity)
+            else:
+                column = _CategoricalColumn(self._capacity)
+        elif column.kind != 'object' and (objects or column.kind == 'numeric' and
+                                          not all(_is_numeric(value) for value in present)):
+            widened = _ObjectColumn(self._capacity) if objects else _CategoricalColumn(self._capacity)
+            existing = column.rows()
+            widened.set(existing, [column.get(row) for row in existing])
+            column = widened
+        else:
+            return column
+        # Swap in a new dict so readers iterating the old one are unaffected
+        setattr(self, group, {**columns, field: column})
+        return column
+
+    def _write_group(self, group: str, rows: np.ndarray, items: list):
+        """Store one group of fields for the given rows, clearing fields they lack"""
+        # First-seen order, so rebuilt records list fields in the order they were written
+        fields = dict.fromkeys(getattr(self, group))
+        for item in items:
+            fields.update(dict.fromkeys(item))
+        for field in fields:
+            values = [item.get(field) for item in items]
+            self._column_for(group, field, values).set(rows, values)
+
+    def write(self, storage, rows: np.ndarray, records: list):
+        """Store the records of rows written past the storage's published size"""
+        self.remap(storage)
+        self._write_group('columns', rows, [record.get('metadata') or {} for record in records])
+        self._write_group('attributes', rows, [
+            {key: value for key, value in record.items() if key not in self.RESERVED_KEYS}
+            for record in records
+        ])
+
+    def attach(self, storage):
+        """Start empty columns for a storage (records arrive through write())"""
+        self.layout = None
+        self.columns = {}
+        self.attributes = {}
+        self._capacity = storage.capacity
+        self.layout = storage.layout
+
+    def add_rows(self, storage, rows: np.ndarray):
+        # The rows' fields were stored by write() before the components were notified
+        self.remap(storage)
+
+    def remap(self, storage, keep: Optional[np.ndarray] = None):
+        if keep is None:
+            self._capacity = max(self._capacity, storage.capacity)
+            for column in (*self.columns.values(), *self.attributes.values()):
+                column.grow(self._capacity)
+        else:
+            # Renumbered columns no longer match the published rows until the new layout is
+            self.layout = None
+            self._capacity = storage.capacity
+            self.columns = {field: column.taken(keep, self._capacity) for field, column in self.columns.items()}
+            self.attributes = {
+                field: column.taken(keep, self._capacity) for field, column in self.attributes.items()
+            }
+        self.layout = storage.layout
+
+    def frozen(self, size: int) -> 'MetadataIndex':
+        """
+        Copy of the first size rows of every column, so save() can write
+        them out while writers keep changing this index
+        """
+        keep = np.arange(size)
+        frozen = MetadataIndex()
+        frozen.columns = {field: column.taken(keep, size) for field, column in self.columns.items()}
+        frozen.attributes = {field: column.taken(keep, size) for field, column in self.attributes.items()}
+        frozen._capacity = size
+        frozen.layout = self.layout
+        return frozen
+
+    @staticmethod
+    def _save_group(directory: str, prefix: str, columns: Dict[str, Any], size: int) -> Dict[str, Any]:
+        return {
+            field: column.save(directory, f'{prefix}_{position}', size)
+            for position, (field, column) in enumerate(columns.items())
+        }
+
+    @staticmethod
+    def _load_group(directory: str, fields: Dict[str, Any], mmap: bool) -> Dict[str, Any]:
+        column_types = {'categorical': _CategoricalColumn, 'numeric': _NumericColumn, 'object': _ObjectColumn}
+        return {field: column_types[entry['kind']].load(directory, entry, mmap) for field, entry in fields.items()}
+
+    def save(self, directory: str, size: int) -> Dict[str, Any]:
+        """Write each column as a .npy array (plus its value dictionary) and describe them"""
+        return {
+            'columns': self._save_group(directory, 'metadata', self.columns, size),
+            'attributes': self._save_group(directory, 'attribute', self.attributes, size)
+        }
+
+    def load(self, directory: str, entry: Dict[str, Any], storage, mmap: bool = True):
+        """Restore the columns written by save() for the storage they describe"""
+        self.columns = self._load_group(directory, entry['columns'], mmap)
+        self.attributes = self._load_group(directory, entry['attributes'], mmap)
+        self._capacity = storage.capacity
+        self.layout = storage.layout
+
+    def get(self, row: int, field: str):
+        """Value of one field at a row (None when missing)"""
+        column = self.columns.get(field)
+        return None if column is None else column.get(row)
+
+    def records(self, storage, rows, include_metadata: bool = True,
+                fields: Optional[Sequence[str]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fresh record dicts ({'id', attributes..., 'metadata'}) for rows of a
+        storage version, holding only the given fields (all when None) and
+        no 'metadata' without include_metadata; missing values are left out.
+        None if the columns are not (or stopped being) in the version's layout.
+        """
+        layout = self.layout
+        if layout is not storage.layout:
+            return None
+        attributes, columns = self.attributes, self.columns
+        if self.layout is not layout:
+            return None
+        # Later writes replace columns or touch rows past this version, so these stay consistent
+        if fields is not None:
+            attributes = {field: attributes[field] for field in fields if field in attributes}
+            columns = {field: columns[field] for field in fields if field in columns}
+        records = []
+        for row in rows:
+            record = {'id': storage.row_ids[row]}
+            for field, column in attributes.items():
+                value = column.get(row)
+                if value is not None:
+                    record[field] = value
+            if include_metadata:
+                metadata = {}
+                for field, column in columns.items():
+                    value = column.get(row)
+                    if value is not None:
+                        metadata[field] = value
+                record['metadata'] = metadata
+            records.append(record)
+        return records
+
+    def evaluate(self, filter: Dict[str, Any], storage) -> Optional[np.ndarray]:
+        """
+        Boolean mask over the rows of a storage version matching a filter,
+        or None if the columns are not (or stopped being) in its layout
+        """
+        layout = self.layout
+        if layout is not storage.layout:
+            return None
+        mask = self._evaluate(filter, self.columns, storage.size)
+        # A compaction that started meanwhile may have renumbered the columns read
+        return mask if self.layout is layout else None
+
+    def _evaluate(self, filter: Dict[str, Any], columns: Dict[str, Any], size: int) -> np.ndarray:
+        mask = np.ones(size, dtype=bool)
+        for key, condition in filter.items():
+            if key == '$and':
+                for clause in condition:
+                    mask &= self._evaluate(clause, columns, size)
+            elif key == '$or':
+                matched = np.zeros(size, dtype=bool)
+                for clause in condition:
+                    matched |= self._evaluate(clause, columns, size)
+                mask &= matched
+            elif key.startswith('$'):
+                raise ValueError(f"Unsupported filter operator '{key}'")
+            else:
+                mask &= self._evaluate_field(columns.get(key), condition, size)
+        return mask
+
+    def _evaluate_field(self, column, condition, size: int) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        mask = np.ones(size, dtype=bool)
+        for operator, operand in condition.items():
+            if operator not in self.OPERATORS:
+                raise ValueError(f"Unsupported filter operator '{operator}'")
+            if column is None:
+                return np.zeros(size, dtype=bool)
+            mask &= column.mask(operator, operand, size)
+        return mask
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+# Similarity metrics an index can be created with (Pinecone's names)
+METRICS = ('cosine', 'dotproduct', 'euclidean')
+
+
+def rank_scores(dots: np.ndarray, norms: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Higher-is-better ranking scores from the dot products of a query with
+    L2-normalized rows whose original norms are `norms` (broadcast over
+    the last axis). Cosine queries are unit length, so the dot products
+    are the scores; other metrics keep the raw query and rescale by the
+    cached norms: the dot product itself, or for euclidean
+    2 * <q, x> - |x|^2, the negated squared distance less the per-query
+    constant |q|^2, which does not change the ranking.
+    """
+    if metric == 'cosine':
+        return dots
+    if metric == 'dotproduct':
+        return dots * norms
+    return norms * (2 * dots - norms)
+
+
+def pinecone_scores(scores: np.ndarray, query_sq_norms, metric: str) -> np.ndarray:
+    """
+    Ranking scores as Pinecone reports them: cosine similarity and dot
+    product as is (higher is closer), euclidean as the squared distance
+    (lower is closer). query_sq_norms are the squared query norms,
+    broadcast against scores.
+    """
+    if metric != 'euclidean':
+        return scores
+    return np.maximum(query_sq_norms - scores, 0).astype(np.float32)
+
+
+def mmr_relevance(scores: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Relevance term for MMR re-ranking of reported scores: cosine as is;
+    dot products and negated euclidean distances min-max scaled onto
+    [0, 1] so they trade off against cosine redundancy on a like scale
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if metric == 'cosine':
+        return scores
+    relevance = -scores if metric == 'euclidean' else scores
+    spread = relevance.max() - relevance.min()
+    return (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
@@ -0,0 +1,171 @@
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from data_processor import SpotifyDataProcessor, NetflixDataProcessor, _read_csv_chunks
+
+
+# Netflix rows cleaned, tokenized and embedded per worker task
+DEFAULT_CHUNK_SIZE = 10000
+
+SharedArray = Tuple[str, Tuple[int, ...], str]
+# UTF-8 bytes of a column of strings and the offsets where each one starts
+SharedStrings = Tuple[SharedArray, SharedArray]
+
+
+def _to_shared(array: np.ndarray) -> SharedArray:
+    """Copy an array into a new shared memory block; the receiver unlinks it"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    block.close()
+    return block.name, array.shape, array.dtype.str
+
+
+def _from_shared(handle: SharedArray, release: bool = True) -> np.ndarray:
+    """Copy an array out of a block written by _to_shared, releasing the block unless told not to"""
+    name, shape, dtype = handle
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf).copy()
+    finally:
+        block.close()
+        if release:
+            block.unlink()
+
+
+def _release_shared(handles: Sequence[SharedArray]):
+    for name, _, _ in handles:
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        block.unlink()
+
+
+def _strings_to_shared(values: Sequence[str]) -> SharedStrings:
+    """A column of strings as shared UTF-8 bytes plus offsets, so it is never pickled"""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return _to_shared(np.frombuffer(b''.join(encoded), dtype=np.uint8)), _to_shared(offsets)
+
+
+def _strings_from_shared(handles: SharedStrings, release: bool = True) -> List[str]:
+    data, offsets = (_from_shared(handle, release) for handle in handles)
+    raw = data.tobytes()
+    return [raw[start:end].decode() for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _spotify_task(csv_path) -> Tuple[SpotifyDataProcessor, SharedArray]:
+    """
+    Worker task: the whole Spotify pipeline, which is vectorized already.
+    The processor (with its dataframe) is pickled back, the vector matrix
+    travels through shared memory.
+    """
+    processor = SpotifyDataProcessor(csv_path)
+    vectors = processor.create_embedding_batch().vectors
+    processor.get_processed_dataframe()
+    return processor, _to_shared(vectors)
+
+
+def _netflix_clean_task(processor: NetflixDataProcessor,
+                        chunk: pd.DataFrame) -> Tuple[SharedArray, Dict[str, SharedStrings], Counter, Counter]:
+    """
+    Worker task: clean one chunk of titles and count its terms for the
+    shared vocabulary. The labels of the rows kept and the text columns
+    cleaning added come back through shared memory.
+    """
+    cleaned = processor._clean_frame(chunk)
+    term_counts, document_counts = processor._count_terms(cleaned['combined_features'])
+    columns = {
+        column: _strings_to_shared(cleaned[column].tolist())
+        for column in cleaned.columns if column not in chunk.columns
+    }
+    return _to_shared(cleaned.index.to_numpy()), columns, term_counts, document_counts
+
+
+def _netflix_embed_task(processor: NetflixDataProcessor,
+                        texts: SharedStrings) -> Tuple[Tuple[SharedArray, ...], Tuple[int, int]]:
+    """
+    Worker task: TF-IDF rows of one cleaned chunk, read from the shared
+    text a clean task left, as shared CSR arrays and the matrix shape
+    """
+    matrix = processor.tfidf_vectorizer.transform(_strings_from_shared(texts, release=False))
+    return (_to_shared(matrix.data), _to_shared(matrix.indices), _to_shared(matrix.indptr)), matrix.shape
+
+
+def _csr_from_shared(handles: Tuple[SharedArray, ...], shape: Tuple[int, int]) -> sparse.csr_matrix:
+    return sparse.csr_matrix(tuple(_from_shared(handle) for handle in handles), shape=shape)
+
+
+def load_and_process_parallel(spotify_path, netflix_path, workers: Optional[int] = None,
+                              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Dict]:
+    """
+    load_and_process_datasets on a pool of worker processes: Spotify runs
+    as one task while Netflix is cleaned, counted and embedded chunk by
+    chunk on the remaining workers, so startup costs the slower dataset
+    rather than the sum of both. The TF-IDF vocabulary is fixed from the
+    merged chunk counts exactly as a single fit would. Cleaned text and
+    vector matrices travel through shared memory; the embed tasks read
+    the combined text the clean tasks left there, so only raw rows are
+    pickled (once, to the clean tasks). Returns the same structure as
+    load_and_process_datasets.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Spawned workers only import the processors and never inherit locks held by other threads
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        spotify_future = executor.submit(_spotify_task, spotify_path)
+
+        # A streaming processor carries no dataframe, so it is cheap to send with every task
+        netflix_processor = NetflixDataProcessor(netflix_path, chunk_size=chunk_size)
+        raw_chunks, clean_futures = [], []
+        for chunk in _read_csv_chunks(netflix_path, chunk_size):
+            raw_chunks.append(chunk)
+            clean_futures.append(executor.submit(_netflix_clean_task, netflix_processor, chunk))
+
+        chunks, texts, term_counts, document_counts = [], [], Counter(), Counter()
+        for raw, future in zip(raw_chunks, clean_futures):
+            kept, columns, chunk_terms, chunk_documents = future.result()
+            # Same rows and columns as _clean_frame; the combined text stays shared for the embed task
+            chunk = raw.loc[_from_shared(kept)].copy()
+            for column, handles in columns.items():
+                chunk[column] = _strings_from_shared(handles, release=column != 'combined_features')
+            if len(chunk):
+                chunks.append(chunk)
+                texts.append(columns['combined_features'])
+                term_counts.update(chunk_terms)
+                document_counts.update(chunk_documents)
+            else:
+                _release_shared(columns['combined_features'])
+        netflix_processor._set_vocabulary(term_counts, document_counts, sum(len(chunk) for chunk in chunks))
+
+        try:
+            embed_futures = [executor.submit(_netflix_embed_task, netflix_processor, handles) for handles in texts]
+            tfidf_matrix = sparse.vstack([_csr_from_shared(*future.result()) for future in embed_futures],
+                                         format='csr')
+        finally:
+            for handles in texts:
+                _release_shared(handles)
+
+        spotify_processor, spotify_vectors = spotify_future.result()
+        spotify_vectors = _from_shared(spotify_vectors)
+
+    netflix_processor.df = pd.concat(chunks)
+    netflix_processor.tfidf_matrix = tfidf_matrix
+
+    return {
+        'spotify': {
+            'embeddings': SpotifyDataProcessor._embedding_batch(spotify_processor.df, spotify_vectors),
+            'dataframe': spotify_processor.df,
+            'processor': spotify_processor
+        },
+        'netflix': {
+            'embeddings': NetflixDataProcessor._embedding_batch(netflix_processor.df, tfidf_matrix),
+            'dataframe': netflix_processor.df,
+            'processor': netflix_processor
+        }
+    }
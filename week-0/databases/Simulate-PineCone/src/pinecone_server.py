@@ -0,0 +1,255 @@
+import json
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from snapshot import json_default
+from vector_db import MockPineconeDB, VECTOR_KEYS
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class PineconeServer:
+    """
+    Local stand-in for a Pinecone index's data plane, backed by a
+    MockPineconeDB. Serves the REST surface RealPineconeDB uses
+    (POST /vectors/upsert, POST /query, GET /vectors/fetch,
+    POST /vectors/delete, POST /describe_index_stats) over HTTP/1.1 with
+    keep-alive, so the client path can be exercised and load-tested
+    offline. The event loop only parses and writes HTTP; database calls
+    run in a thread pool, where queries proceed concurrently.
+    """
+
+    def __init__(self, db: Optional[MockPineconeDB] = None, host: str = '127.0.0.1', port: int = 5080,
+                 api_key: Optional[str] = None, workers: int = 8):
+        self.db = db if db is not None else MockPineconeDB()
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='pinecone-server')
+        self._routes = {
+            ('POST', '/vectors/upsert'): self._upsert,
+            ('POST', '/query'): self._query,
+            ('GET', '/vectors/fetch'): self._fetch,
+            ('POST', '/vectors/delete'): self._delete,
+            ('POST', '/describe_index_stats'): self._describe_index_stats,
+            ('GET', '/describe_index_stats'): self._describe_index_stats
+        }
+        self._server = None
+        self._connections = {}
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def _upsert(self, body: Dict[str, Any], params: Dict[str, list]) -> Dict[str, Any]:
+        items = []
+        for vector in body.get('vectors', []):
+            item = {'id': vector['id'], 'metadata': vector.get('metadata', {})}
+            if vector.get('sparseValues') and not vector.get('values'):
+                item['sparse_values'] = vector['sparseValues']
+            elif 'values' in vector:
+                item['values'] = vector['values']
+            else:
+                raise ValueError(f"Vector '{vector['id']}' has neither values nor sparseValues")
+            items.append(item)
+        return {'upsertedCount': self.db.upsert(body.get('namespace', ''), items)}
+
+    def _query(self, body: Dict[str, Any], params: Dict[str, list]) -> Dict[str, Any]:
+        namespace = body.get('namespace', '')
+        vector = body.get('vector')
+        options = {'filter': body.get('filter'), 'include_metadata': bool(body.get('includeMetadata'))}
+        if vector is not None:
+            results = self.db.query(namespace, vector, body.get('topK', 10), **options)
+        elif 'id' in body:
+            results = self.db.query_by_id(namespace, body['id'], body.get('topK', 10), **options)
+        else:
+            raise ValueError("A query needs a 'vector' or an 'id'")
+        values = self._fetch_vectors(namespace, [result['id'] for result in results]) \
+            if body.get('includeValues') else {}
+        matches = []
+        for result in results:
+            match = {'id': result['id'], 'score': result['similarity']}
+            if body.get('includeMetadata'):
+                match['metadata'] = result.get('metadata') or {}
+            if result['id'] in values:
+                match['values'] = values[result['id']]['values']
+            matches.append(match)
+        return {'matches': matches, 'namespace': namespace}
+
+    def _fetch_vectors(self, namespace: str, ids) -> Dict[str, Dict[str, Any]]:
+        """Stored items in Pinecone's fetch format; an unknown namespace has no vectors"""
+        try:
+            fetched = self.db.fetch(namespace, ids)
+        except KeyError:
+            return {}
+        vectors = {}
+        for item_id, record in fetched.items():
+            vector = {'id': item_id, 'metadata': record.get('metadata') or {}}
+            if 'sparse_values' in record:
+                vector['values'] = []
+                vector['sparseValues'] = record['sparse_values']
+            else:
+                vector['values'] = next(record[key] for key in VECTOR_KEYS if key in record)
+            vectors[item_id] = vector
+        return vectors
+
+    def _fetch(self, body: Dict[str, Any], params: Dict[str, list]) -> Dict[str, Any]:
+        namespace = params.get('namespace', [''])[0]
+        return {'vectors': self._fetch_vectors(namespace, params.get('ids', [])), 'namespace': namespace}
+
+    def _delete(self, body: Dict[str, Any], params: Dict[str, list]) -> Dict[str, Any]:
+        namespace = body.get('namespace', '')
+        index = self.db.indexes.get(namespace)
+        if index is not None:
+            ids = list(index.id_to_row) if body.get('deleteAll') else body.get('ids', [])
+            self.db.delete(namespace, ids)
+        return {}
+
+    def _describe_index_stats(self, body: Dict[str, Any], params: Dict[str, list]) -> Dict[str, Any]:
+        stats = self.db.describe_index_stats()
+        dimensions = {entry['dimension'] for entry in stats['namespaces'].values()}
+        return {
+            'namespaces': {name: {'vectorCount': entry['vector_count']} for name, entry in stats['namespaces'].items()},
+            'dimension': dimensions.pop() if len(dimensions) == 1 else None,
+            'totalVectorCount': stats['total_vector_count']
+        }
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str],
+                        payload: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Route one request and map database errors onto HTTP status codes"""
+        if self.api_key is not None and headers.get('api-key') != self.api_key:
+            return 401, {'code': 16, 'message': 'Invalid API key'}
+        url = urlsplit(target)
+        handler = self._routes.get((method, url.path))
+        if handler is None:
+            known_path = any(path == url.path for _, path in self._routes)
+            return (405, {'code': 12, 'message': f'{method} not allowed'}) if known_path \
+                else (404, {'code': 5, 'message': f'Unknown path {url.path}'})
+        try:
+            body = json.loads(payload) if payload else {}
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, handler, body, parse_qs(url.query)
+            )
+        except (ValueError, TypeError) as error:
+            return 400, {'code': 3, 'message': str(error)}
+        except KeyError as error:
+            return 404, {'code': 5, 'message': str(error)}
+        except Exception as error:
+            return 500, {'code': 13, 'message': str(error)}
+        return 200, result
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on one keep-alive connection until the client closes it"""
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                payload = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, result = await self._dispatch(method, target, headers, payload)
+                data = json.dumps(result, default=json_default).encode()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                    f'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Malformed request or client went away: drop the connection
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def start(self):
+        """Start listening; with port 0 the chosen port is stored in self.port"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> str:
+        """Run the server on an event loop in a daemon thread and return its URL"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='pinecone-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    async def _shutdown(self):
+        """Stop accepting, drop open keep-alive connections and stop the loop"""
+        self._server.close()
+        connections = dict(self._connections)
+        for writer in connections:
+            # Closing the transport ends the handler's pending read
+            writer.close()
+        await asyncio.gather(*connections.values(), return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    def stop(self):
+        """Stop a server started with start_in_thread()"""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+        self._executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a MockPineconeDB over the Pinecone REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5080)
+    parser.add_argument('--api-key', default=None, help='Require this Api-Key header')
+    parser.add_argument('--snapshot', default=None, help='Serve a snapshot written by MockPineconeDB.save()')
+    parser.add_argument('--durable', default=None, help='Open a durable database directory instead')
+    args = parser.parse_args()
+
+    if args.durable:
+        db = MockPineconeDB.open(args.durable)
+    elif args.snapshot:
+        db = MockPineconeDB.load(args.snapshot)
+    else:
+        db = MockPineconeDB()
+    server = PineconeServer(db, args.host, args.port, args.api_key)
+    print(f'Serving the Pinecone data plane on http://{args.host}:{args.port}')
+    try:
+        asyncio.run(server.serve_forever())
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import numpy as np
+from typing import Optional
+from sklearn.cluster import KMeans
+
+
+class _Quantizer:
+    """
+    Compressed codes aligned with the rows of a VectorIndex storage.
+    Subclasses define how vectors are encoded and how a query is scored
+    against codes (asymmetric distance: the query itself stays float).
+    """
+
+    # Rows decoded/scored per block so temporaries stay bounded
+    SCORE_BLOCK_SIZE = 65536
+
+    def __init__(self, rerank: int = 64):
+        self.rerank = rerank
+        self.layout = None
+        self._codes = None
+
+    def fit(self, vectors: np.ndarray) -> '_Quantizer':
+        raise NotImplementedError
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    @property
+    def code_size(self) -> int:
+        """Bytes per stored vector"""
+        raise NotImplementedError
+
+    def _ensure_capacity(self, capacity: int):
+        """Grow the code array to match the storage capacity"""
+        if self._codes is None or len(self._codes) < capacity:
+            codes = np.zeros((capacity, self.code_size), dtype=np.uint8)
+            if self._codes is not None:
+                codes[:len(self._codes)] = self._codes
+            self._codes = codes
+
+    def attach(self, storage):
+        """Encode every occupied row of a storage"""
+        self._codes = None
+        self._ensure_capacity(storage.capacity)
+        for start in range(0, storage.size, self.SCORE_BLOCK_SIZE):
+            end = min(start + self.SCORE_BLOCK_SIZE, storage.size)
+            self._codes[start:end] = self.encode(storage.vectors[start:end])
+        self.layout = storage.layout
+
+    def add_rows(self, storage, rows: np.ndarray):
+        """Encode rows that were just written"""
+        self._ensure_capacity(storage.capacity)
+        self._codes[rows] = self.encode(storage.vectors[rows])
+        self.layout = storage.layout
+
+    def remap(self, storage, keep: Optional[np.ndarray] = None):
+        """Follow the index onto a new storage, optionally keeping only some rows"""
+        if keep is not None:
+            # Renumbered codes no longer match the published rows until the new layout is
+            self.layout = None
+            codes = np.zeros((storage.capacity, self.code_size), dtype=np.uint8)
+            codes[:len(keep)] = self._codes[keep]
+            self._codes = codes
+        else:
+            self._ensure_capacity(storage.capacity)
+        self.layout = storage.layout
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None, size: int = 0) -> np.ndarray:
+        """Approximate scores for the given rows, or for rows [0, size)"""
+        if rows is not None:
+            return self._score_codes(query, self._codes[rows])
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, self.SCORE_BLOCK_SIZE):
+            end = min(start + self.SCORE_BLOCK_SIZE, size)
+            scores[start:end] = self._score_codes(query, self._codes[start:end])
+        return scores
+
+    def nbytes(self, size: int) -> int:
+        """Resident bytes used by the codes of `size` rows"""
+        return size * self.code_size
+
+
+class ScalarQuantizer(_Quantizer):
+    """
+    int8 scalar quantization: each dimension is mapped linearly onto
+    256 levels between its observed minimum and maximum (4x smaller than
+    float32, 8x smaller than the float64 lists the processors produce).
+    """
+
+    def __init__(self, rerank: int = 64):
+        super().__init__(rerank)
+        self.offset = None
+        self.scale = None
+
+    def fit(self, vectors: np.ndarray) -> 'ScalarQuantizer':
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.where(high > low, (high - low) / 255.0, 1.0).astype(np.float32)
+        return self
+
+    @property
+    def code_size(self) -> int:
+        return len(self.offset)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = np.rint((vectors - self.offset) / self.scale)
+        return np.clip(levels, 0, 255).astype(np.uint8)
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # q . (offset + scale * code) without decoding the vectors
+        return codes @ (query * self.scale) + float(query @ self.offset)
+
+
+class ProductQuantizer(_Quantizer):
+    """
+    Product quantization: vectors are split into `subspaces` chunks and each
+    chunk is replaced by the id of its nearest of up to 256 sub-centroids,
+    so a vector costs `subspaces` bytes. Queries are scored with per-chunk
+    lookup tables (asymmetric distance computation).
+    """
+
+    def __init__(self, subspaces: Optional[int] = None, rerank: int = 64,
+                 random_state: int = 42, max_training_points: int = 16384):
+        super().__init__(rerank)
+        self.subspaces = subspaces
+        self.random_state = random_state
+        self.max_training_points = max_training_points
+        self.codebooks = None
+        self._dimension = None
+        self._padded_dimension = None
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """Pad to a multiple of the subspace count and reshape to (n, m, d/m)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._padded_dimension != self._dimension:
+            padding = np.zeros((len(vectors), self._padded_dimension - self._dimension), dtype=np.float32)
+            vectors = np.hstack([vectors, padding])
+        return vectors.reshape(len(vectors), self.subspaces, -1)
+
+    def fit(self, vectors: np.ndarray) -> 'ProductQuantizer':
+        self._dimension = vectors.shape[1]
+        if self.subspaces is None:
+            # Aim for 4 dimensions per sub-vector, like common PQ setups
+            self.subspaces = max(1, self._dimension // 4)
+        self.subspaces = min(self.subspaces, self._dimension)
+        self._padded_dimension = -(-self._dimension // self.subspaces) * self.subspaces
+
+        if len(vectors) > self.max_training_points:
+            rng = np.random.default_rng(self.random_state)
+            vectors = vectors[rng.choice(len(vectors), self.max_training_points, replace=False)]
+        chunks = self._split(vectors)
+        n_centroids = min(256, len(vectors))
+
+        self.codebooks = np.empty((self.subspaces, n_centroids, chunks.shape[2]), dtype=np.float32)
+        for subspace in range(self.subspaces):
+            kmeans = KMeans(n_clusters=n_centroids, random_state=self.random_state, n_init=1, max_iter=25)
+            kmeans.fit(chunks[:, subspace])
+            self.codebooks[subspace] = kmeans.cluster_centers_
+        return self
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        chunks = self._split(vectors)
+        codes = np.empty((len(chunks), self.subspaces), dtype=np.uint8)
+        for subspace in range(self.subspaces):
+            codebook = self.codebooks[subspace]
+            # argmin ||x - c||^2 == argmax (x . c - ||c||^2 / 2)
+            affinity = chunks[:, subspace] @ codebook.T - 0.5 * np.einsum('ij,ij->i', codebook, codebook)
+            codes[:, subspace] = np.argmax(affinity, axis=1)
+        return codes
+
+    def _score_codes(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        query_chunks = self._split(query.reshape(1, -1))[0]
+        lookup = np.einsum('mkd,md->mk', self.codebooks, query_chunks)
+        return lookup[np.arange(self.subspaces), codes].sum(axis=1)
+
+
+def create_quantizer(method: str, rerank: int = 64, subspaces: Optional[int] = None) -> _Quantizer:
+    """Build an unfitted quantizer by name ('sq8' or 'pq')"""
+    if method == 'sq8':
+        return ScalarQuantizer(rerank)
+    if method == 'pq':
+        return ProductQuantizer(subspaces, rerank)
+    raise ValueError(f"Unsupported quantization method '{method}'. Choose from ('sq8', 'pq')")
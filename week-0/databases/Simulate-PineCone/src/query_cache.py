@@ -0,0 +1,89 @@
+import json
+import hashlib
+import threading
+import numpy as np
+import scipy.sparse as sparse
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from snapshot import json_default
+
+
+def query_digest(vector) -> bytes:
+    """Stable 16-byte digest of a query vector (dense, Pinecone sparse dict or scipy sparse row)"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(vector, dict):
+        digest.update(b'sparse')
+        digest.update(np.asarray(vector['indices'], dtype=np.int64).tobytes())
+        digest.update(np.asarray(vector['values'], dtype=np.float32).tobytes())
+    elif sparse.issparse(vector):
+        row = sparse.csr_matrix(vector)
+        row.sum_duplicates()
+        digest.update(b'sparse')
+        digest.update(row.indices.astype(np.int64).tobytes())
+        digest.update(row.data.astype(np.float32).tobytes())
+    else:
+        digest.update(np.ascontiguousarray(vector, dtype=np.float32).ravel().tobytes())
+    return digest.digest()
+
+
+def filter_key(filter: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Canonical form of a metadata filter, equal for filters that differ only in key order"""
+    return None if not filter else json.dumps(filter, sort_keys=True, default=json_default)
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results. Every entry is tagged with the
+    version of the index it was computed from; a lookup against a newer
+    version counts as a miss and drops the entry, so upserts and deletes
+    invalidate results without scanning the cache. Hits, misses and
+    evictions are counted for stats().
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """Cached value for key if it was computed at this version, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, value: Any):
+        """Store a value computed at an index version, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters, current size and hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from metrics import rank_scores
+
+
+# Row files each worker keeps mapped (the storages it searched most recently)
+MAPPED_FILES_PER_WORKER = 8
+
+_mapped_files = OrderedDict()
+
+
+def default_shared_dir() -> str:
+    """RAM-backed /dev/shm where the platform has it, the temp directory otherwise"""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _mapped_rows(source: Tuple[str, int, Tuple[int, int]]) -> np.ndarray:
+    """Read-only mapping of a row file, opened once per worker and reused across queries"""
+    rows = _mapped_files.get(source)
+    if rows is None:
+        path, offset, shape = source
+        rows = np.memmap(path, dtype=np.float32, mode='r', offset=offset, shape=shape)
+        _mapped_files[source] = rows
+        while len(_mapped_files) > MAPPED_FILES_PER_WORKER:
+            _mapped_files.popitem(last=False)
+    else:
+        _mapped_files.move_to_end(source)
+    return rows
+
+
+def _local_top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per query, the positions and scores of the k best rows plus every other
+    row tied with the k-th score, padded with (-1, -inf). Workers have no
+    item ids, so rows that could win the caller's id tie-break are all kept,
+    as select_top_k keeps them before ordering.
+    """
+    n_queries, n = scores.shape
+    if k >= n:
+        return np.broadcast_to(np.arange(n), scores.shape), scores
+    rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    row_scores = np.take_along_axis(scores, rows, axis=1)
+    kth = row_scores.min(axis=1, keepdims=True)
+    # Tied rows the partition left out; ties among excluded (-inf) rows never win
+    left_out = (scores == kth).sum(axis=1) - (row_scores == kth).sum(axis=1)
+    left_out[~np.isfinite(kth[:, 0])] = 0
+    if not left_out.any():
+        return rows, row_scores
+
+    width = k + int(left_out.max())
+    padded_rows = np.full((n_queries, width), -1, dtype=np.int64)
+    padded_scores = np.full((n_queries, width), -np.inf, dtype=scores.dtype)
+    padded_rows[:, :k] = rows
+    padded_scores[:, :k] = row_scores
+    for query in np.flatnonzero(left_out):
+        tied = np.setdiff1d(np.flatnonzero(scores[query] == kth[query, 0]), rows[query])
+        padded_rows[query, k:k + len(tied)] = tied
+        padded_scores[query, k:k + len(tied)] = kth[query, 0]
+    return padded_rows, padded_scores
+
+
+def _search_shard(source: Tuple[str, int, Tuple[int, int]], start: int, end: int, queries: np.ndarray,
+                  top_k: int, excluded: Optional[np.ndarray], metric: str = 'cosine',
+                  norms: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Worker task: score rows [start, end) of a mapped file against a block of
+    queries and return each query's local top-k, with the rows tied at its
+    k-th score, as (global rows, scores); padding rows are -1.
+    excluded is a packed bit mask of rows in the range that must not match;
+    norms (the rows' original norms) are needed by every metric but cosine.
+    """
+    scores = rank_scores(queries @ _mapped_rows(source)[start:end].T, norms, metric)
+    if excluded is not None:
+        scores[:, np.unpackbits(excluded, count=end - start).astype(bool)] = -np.inf
+    rows, scores = _local_top_k(scores, min(top_k, end - start))
+    return np.where(rows >= 0, rows + start, -1), scores
+
+
+class ShardPool:
+    """
+    Worker processes that split exact scans of a vector matrix into
+    contiguous row shards, one task per shard, so a single query uses
+    every core. Rows are never pickled: the matrix lives in a memory-mapped
+    file (in /dev/shm by default) that each worker maps read-only, and
+    only the query, the shard bounds and a packed exclusion mask travel to
+    the workers. Each returns its local top-k; the caller merges them.
+    """
+
+    def __init__(self, shards: int, shared_dir: Optional[str] = None):
+        if shards < 1:
+            raise ValueError("A shard pool needs at least one shard")
+        self.shards = shards
+        self.shared_dir = shared_dir or default_shared_dir()
+        # Spawned workers only import this module and never inherit locks held by other threads
+        self._executor = ProcessPoolExecutor(shards, mp_context=multiprocessing.get_context('spawn'))
+
+    def ranges(self, size: int) -> List[Tuple[int, int]]:
+        """Contiguous, near-equal row ranges covering [0, size)"""
+        bounds = np.linspace(0, size, min(self.shards, size) + 1).astype(np.int64).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def search(self, vectors: np.memmap, size: int, queries: np.ndarray, top_k: int,
+               excluded: Optional[np.ndarray] = None, metric: str = 'cosine',
+               norms: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Local top-k candidates of every shard over rows [0, size) of a
+        file-backed matrix, as (rows, scores) arrays shaped (queries x candidates);
+        rows tied with a shard's k-th score are included, padding rows are -1.
+        excluded masks rows (tombstones, filtered out) that must not match.
+        Under metrics other than cosine each task also carries its slice of
+        the row norms (4 bytes per row).
+        """
+        source = (vectors.filename, vectors.offset, vectors.shape)
+        futures = []
+        for start, end in self.ranges(size):
+            shard_excluded = None
+            if excluded is not None and excluded[start:end].any():
+                shard_excluded = np.packbits(excluded[start:end])
+            shard_norms = None if metric == 'cosine' else np.ascontiguousarray(norms[start:end])
+            futures.append(self._executor.submit(
+                _search_shard, source, start, end, queries, top_k, shard_excluded, metric, shard_norms
+            ))
+        results = [future.result() for future in futures]
+        # Shards return different widths when some keep extra tied rows; pad to a common one
+        width = max(rows.shape[1] for rows, _ in results)
+        rows = np.hstack([np.pad(rows, ((0, 0), (0, width - rows.shape[1])), constant_values=-1)
+                          for rows, _ in results])
+        scores = np.hstack([np.pad(scores, ((0, 0), (0, width - scores.shape[1])), constant_values=-np.inf)
+                            for _, scores in results])
+        return rows, scores
+
+    def close(self):
+        """Stop the worker processes"""
+        self._executor.shutdown()
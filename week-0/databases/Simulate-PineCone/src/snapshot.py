@@ -0,0 +1,186 @@
+import os
+import json
+import pickle
+import shutil
+import zlib
+import numpy as np
+from typing import Any, Dict, Optional, Sequence
+
+
+SNAPSHOT_FORMAT = 'simulate-pinecone-snapshot'
+SNAPSHOT_VERSION = 2
+MANIFEST_FILE = 'manifest.json'
+
+# Bytes read per step while checksumming, so large files are never fully resident
+CHECKSUM_BLOCK_SIZE = 1 << 24
+
+
+def json_default(value):
+    """Serialize numpy scalars and arrays that end up inside records and metadata"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def file_checksum(path: str) -> int:
+    """CRC32 of a file, read block by block"""
+    checksum = 0
+    with open(path, 'rb') as handle:
+        while True:
+            block = handle.read(CHECKSUM_BLOCK_SIZE)
+            if not block:
+                return checksum
+            checksum = zlib.crc32(block, checksum)
+
+
+def save_array(directory: str, name: str, array: np.ndarray) -> str:
+    """Write an array as a raw .npy file and return its file name"""
+    file_name = f'{name}.npy'
+    np.save(os.path.join(directory, file_name), np.ascontiguousarray(array), allow_pickle=False)
+    return file_name
+
+
+def load_array(directory: str, file_name: str, mmap: bool = True) -> np.ndarray:
+    """
+    Read a .npy file. With mmap, the array is a copy-on-write mapping: pages
+    are shared with other processes mapping the same file and only copied
+    when this process writes to them.
+    """
+    return np.load(os.path.join(directory, file_name), mmap_mode='c' if mmap else None, allow_pickle=False)
+
+
+def save_json(directory: str, name: str, value: Any) -> str:
+    file_name = f'{name}.json'
+    with open(os.path.join(directory, file_name), 'w') as handle:
+        json.dump(value, handle, default=json_default)
+    return file_name
+
+
+def load_json(directory: str, file_name: str) -> Any:
+    with open(os.path.join(directory, file_name)) as handle:
+        return json.load(handle)
+
+
+def save_pickle(directory: str, name: str, value: Any) -> str:
+    return save_pickled(directory, name, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def save_pickled(directory: str, name: str, payload: bytes) -> str:
+    """Write a value pickled earlier (e.g. while a lock was held) as save_pickle would"""
+    file_name = f'{name}.pkl'
+    with open(os.path.join(directory, file_name), 'wb') as handle:
+        handle.write(payload)
+    return file_name
+
+
+def load_pickle(directory: str, file_name: str) -> Any:
+    # Snapshots are local artifacts written by save_snapshot, never untrusted input
+    with open(os.path.join(directory, file_name), 'rb') as handle:
+        return pickle.load(handle)
+
+
+def source_stamps(paths: Sequence[str]) -> Dict[str, list]:
+    """(size, mtime) of each source file, recorded to detect stale snapshots"""
+    return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in paths}
+
+
+def _externalize(value: Any, directory: str, name: str) -> Any:
+    """Replace numeric arrays nested in dicts/lists by references to .npy files"""
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        return {'__array__': save_array(directory, name, value)}
+    if isinstance(value, dict):
+        return {key: _externalize(item, directory, f'{name}.{key}') for key, item in value.items()}
+    return value
+
+
+def _internalize(value: Any, directory: str, mmap: bool) -> Any:
+    """Inverse of _externalize"""
+    if isinstance(value, dict):
+        if set(value) == {'__array__'}:
+            return load_array(directory, value['__array__'], mmap)
+        return {key: _internalize(item, directory, mmap) for key, item in value.items()}
+    return value
+
+
+def write_snapshot(path: str, write_contents, sources: Optional[Sequence[str]] = None,
+                   clustering_results: Optional[Dict[str, Any]] = None):
+    """
+    Write a snapshot directory atomically. write_contents(directory) writes
+    the database files and returns its manifest section; clustering results
+    are stored as .npy arrays plus a pickle of the remaining objects. The
+    manifest records the format version and a CRC32 of every file.
+    """
+    path = os.path.abspath(path)
+    staging = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'database': write_contents(staging),
+        'clustering': None,
+        'sources': source_stamps(sources) if sources else {}
+    }
+    if clustering_results is not None:
+        clustering_dir = os.path.join(staging, 'clustering')
+        os.makedirs(clustering_dir)
+        manifest['clustering'] = save_pickle(
+            clustering_dir, 'results', _externalize(clustering_results, clustering_dir, 'results')
+        )
+
+    manifest['checksums'] = {
+        os.path.relpath(os.path.join(root, file_name), staging): file_checksum(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(staging)
+        for file_name in file_names
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+
+    # Swap the finished directory into place so readers never see a partial snapshot
+    previous = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def read_manifest(path: str, verify: bool = True) -> Dict[str, Any]:
+    """Read and validate a snapshot manifest, optionally checking every file's CRC32"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No snapshot found at '{path}'")
+    with open(manifest_path) as handle:
+        manifest = json.load(handle)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"'{path}' is not a vector database snapshot")
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot version {manifest.get('version')} is not supported (expected {SNAPSHOT_VERSION})"
+        )
+    if verify:
+        for file_name, checksum in manifest['checksums'].items():
+            file_path = os.path.join(path, file_name)
+            if not os.path.exists(file_path) or file_checksum(file_path) != checksum:
+                raise ValueError(f"Snapshot file '{file_name}' is missing or corrupted")
+    return manifest
+
+
+def snapshot_is_current(path: str, sources: Sequence[str]) -> bool:
+    """True when a snapshot exists and was written from the current source files"""
+    try:
+        manifest = read_manifest(path, verify=False)
+    except (FileNotFoundError, ValueError):
+        return False
+    return manifest['sources'] == json.loads(json.dumps(source_stamps(sources)))
+
+
+def load_clustering_results(path: str, mmap: bool = True, verify: bool = True) -> Optional[Dict[str, Any]]:
+    """Clustering/projection outputs stored alongside a snapshot (None if absent)"""
+    manifest = read_manifest(path, verify)
+    if manifest['clustering'] is None:
+        return None
+    clustering_dir = os.path.join(path, 'clustering')
+    return _internalize(load_pickle(clustering_dir, manifest['clustering']), clustering_dir, mmap)
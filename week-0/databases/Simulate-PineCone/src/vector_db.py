@@ -1,215 +1,2287 @@
 import os
+import copy
+import json
+import time
+import uuid
+import heapq
+import pickle
+import weakref
+import threading
 import numpy as np
-from typing import List, Dict, Any
+import requests
+import scipy.sparse as sparse
+import scipy.sparse.linalg
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from sklearn.metrics.pairwise import cosine_similarity
+
+from data_processor import EmbeddingBatch, SpotifyDataProcessor, NetflixDataProcessor
+from ann_index import IVFIndex, HNSWIndex
+from quantization import create_quantizer
+from metadata_store import MetadataIndex
+from knn_graph import KNNGraph
+from metrics import METRICS, rank_scores, pinecone_scores, mmr_relevance
+from sharding import ShardPool
+from query_cache import QueryCache, query_digest, filter_key
+from snapshot import (
+    save_array, load_array, save_json, load_json, save_pickled, load_pickle,
+    write_snapshot, read_manifest, MANIFEST_FILE, json_default
+)
+from wal import WriteAheadLog
+
+
+def _order_candidates(rows: np.ndarray, scores: np.ndarray, k: int,
+                      ids: Optional[Sequence[str]] = None) -> np.ndarray:
+    """Order candidate rows best first, breaking score ties by item id"""
+    rows = rows[np.argsort(-scores[rows], kind='stable')]
+    if ids is not None and len(rows) > 1 and np.any(np.diff(scores[rows]) == 0):
+        rows = np.array(sorted(rows, key=lambda row: (-scores[row], ids[row])), dtype=np.int64)
+    return rows[:k]
+
+
+def select_top_k(scores: np.ndarray, k: int, ids: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Return the positions of the k highest scores, best first.
+    Uses argpartition so only the k winners are sorted; every row tied
+    with the k-th score is kept as a candidate so the id tie-break is exact.
+    """
+    scores = np.asarray(scores)
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        threshold = scores[candidates].min()
+        candidates = np.union1d(
+            candidates[scores[candidates] > threshold],
+            np.flatnonzero(scores == threshold)
+        )
+    else:
+        candidates = np.arange(n)
+    
+    return _order_candidates(candidates, scores, k, ids)
+
+
+def select_top_k_rows(scores: np.ndarray, k: int, ids: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Row-wise select_top_k over a (queries x items) score block.
+    Partition and sort are vectorized across rows; only rows whose winners
+    contain tied scores fall back to the exact per-row id tie-break.
+    """
+    n_queries, n = scores.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((n_queries, 0), dtype=np.int64)
+    
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), (n_queries, n))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    rows = np.take_along_axis(candidates, order, axis=1)
+    
+    if ids is not None:
+        ranked_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        kth = ranked_scores[:, -1:]
+        tied = np.any(np.diff(ranked_scores, axis=1) == 0, axis=1)
+        tied |= (scores == kth).sum(axis=1) > (ranked_scores == kth).sum(axis=1)
+        for query in np.flatnonzero(tied):
+            rows[query] = select_top_k(scores[query], k, ids)
+    return rows
+
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, k: int, diversity: float) -> np.ndarray:
+    """
+    Positions of k candidates in maximal-marginal-relevance order: each pick
+    maximizes (1 - diversity) * relevance - diversity * (its highest
+    similarity to the candidates already picked). similarity is the
+    candidates' pairwise matrix; the per-candidate maximum is updated with
+    one vectorized step per pick, so the cost is O(k x candidates).
+    """
+    n = len(relevance)
+    k = min(k, n)
+    picked = np.empty(k, dtype=np.int64)
+    taken = np.zeros(n, dtype=bool)
+    redundancy = np.zeros(n, dtype=np.float64)
+    for step in range(k):
+        gain = (1.0 - diversity) * relevance - diversity * redundancy
+        gain[taken] = -np.inf
+        best = int(np.argmax(gain))
+        picked[step] = best
+        taken[best] = True
+        if step == 0:
+            redundancy = similarity[best].astype(np.float64)
+        else:
+            np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
+
+
+class _HeapEntry:
+    """Heap entry ordered so the worst-ranked match sits at the heap root"""
+    
+    __slots__ = ('score', 'item_id', 'payload')
+    
+    def __init__(self, score: float, item_id: str, payload: Any):
+        self.score = score
+        self.item_id = item_id
+        self.payload = payload
+    
+    def __lt__(self, other: '_HeapEntry') -> bool:
+        if self.score != other.score:
+            return self.score < other.score
+        return self.item_id > other.item_id
+
+
+class StreamingTopK:
+    """
+    Bounded min-heap that keeps the k best matches seen across chunked scans.
+    Each chunk is reduced with select_top_k first, so at most k entries per
+    chunk ever touch the heap.
+    """
+    
+    def __init__(self, k: int):
+        self.k = k
+        self._heap = []
+    
+    def push(self, scores: np.ndarray, ids: Sequence[str], payloads: Optional[Sequence[Any]] = None):
+        """Offer a chunk of scored items to the heap"""
+        for position in select_top_k(scores, self.k, ids):
+            entry = _HeapEntry(
+                float(scores[position]),
+                ids[position],
+                payloads[position] if payloads is not None else position
+            )
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif self._heap[0] < entry:
+                heapq.heapreplace(self._heap, entry)
+    
+    def results(self) -> List[Tuple[float, str, Any]]:
+        """Return (score, id, payload) tuples, best first"""
+        ordered = sorted(self._heap, reverse=True)
+        return [(entry.score, entry.item_id, entry.payload) for entry in ordered]
+
+
+SUPPORTED_METRICS = METRICS
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _item_vector(item: Dict[str, Any]):
+    """Read the vector of an upserted item (Pinecone 'values'/'sparse_values' or local 'vector')"""
+    if 'values' in item:
+        return item['values']
+    if 'vector' in item:
+        return item['vector']
+    return item['sparse_values']
+
+
+# Record keys holding the vector itself, which is stored only in the rows
+VECTOR_KEYS = ('values', 'vector', 'sparse_values')
+
+
+def _live_row(storage, item_id: str) -> Optional[int]:
+    """
+    Row of an item in one storage version, or None if it is not live there.
+    The id map is shared by every version and points at an id's newest row;
+    rows past this version's size are not published to it, so the chain of
+    rows the id used before is followed back to the one it can see.
+    """
+    row = storage.id_to_row.get(item_id)
+    while row is not None and row >= storage.size:
+        row = int(storage.previous[row])
+        row = row if row >= 0 else None
+    return row if row is not None and storage.alive[row] else None
+
+
+class _RowStorage:
+    """
+    Row arrays of a VectorIndex, published to readers as immutable versions.
+    Rows below `size` never change: writers fill rows past it and publish a
+    new version (sharing the arrays, with its own size/alive/dead) through a
+    single attribute swap, so a query only ever sees fully applied writes.
+    Growth copies rows into larger arrays; compaction also renumbers them,
+    which starts a new `layout` that row components check before serving a
+    version. The id map is shared by all versions of a layout and only ever
+    points ids at newer rows; `previous` links each row to the one its id
+    used before, so a version resolves ids with _live_row. With vectors_dir
+    set, the float rows live in a memory-mapped file there instead of
+    process memory; shard workers map the same file, which is removed once
+    no version references it any more.
+    """
+    
+    __slots__ = ('vectors', 'norms', 'row_ids', 'alive', 'size', 'dead', 'id_to_row', 'previous', 'vectors_dir',
+                 'layout')
+    
+    def __init__(self, dimension: int, capacity: int, vectors_dir: Optional[str] = None):
+        self.vectors_dir = vectors_dir
+        if vectors_dir is None:
+            self.vectors = np.empty((capacity, dimension), dtype=np.float32)
+        else:
+            # Never reuse a file name: shard workers cache their mappings by path
+            path = os.path.join(vectors_dir, f'vectors-{uuid.uuid4().hex}.f32')
+            self.vectors = np.memmap(path, dtype=np.float32, mode='w+', shape=(capacity, dimension))
+            weakref.finalize(self.vectors, _remove_file, path)
+        self.norms = np.empty(capacity, dtype=np.float32)
+        self.row_ids = np.empty(capacity, dtype=object)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.dead = 0
+        self.id_to_row = {}
+        self.previous = np.full(capacity, -1, dtype=np.int32)
+        self.layout = object()
+    
+    @classmethod
+    def from_arrays(cls, vectors: np.ndarray, norms: np.ndarray, row_ids: Sequence[str]) -> '_RowStorage':
+        """Wrap existing (e.g. memory-mapped) arrays as a full storage with every row live"""
+        storage = cls.__new__(cls)
+        storage.vectors_dir = None
+        storage.vectors = vectors
+        storage.norms = norms
+        storage.row_ids = np.empty(len(row_ids), dtype=object)
+        storage.row_ids[:] = row_ids
+        storage.alive = np.ones(len(row_ids), dtype=bool)
+        storage.size = len(row_ids)
+        storage.dead = 0
+        storage.id_to_row = dict(zip(row_ids, range(len(row_ids))))
+        storage.previous = np.full(len(row_ids), -1, dtype=np.int32)
+        storage.layout = object()
+        return storage
+    
+    @property
+    def capacity(self) -> int:
+        return self.vectors.shape[0]
+    
+    def version(self, size: int, alive: np.ndarray, dead: int) -> '_RowStorage':
+        """A new version sharing this one's arrays, id map and layout"""
+        version = self.__class__.__new__(self.__class__)
+        for name in self.__slots__:
+            setattr(version, name, getattr(self, name))
+        version.size = size
+        version.alive = alive
+        version.dead = dead
+        return version
+    
+    def write(self, start: int, vectors: np.ndarray, norms: np.ndarray):
+        """Fill rows from `start` with normalized vectors and their original norms"""
+        end = start + len(vectors)
+        self.vectors[start:end] = vectors
+        self.norms[start:end] = norms
+    
+    def _copy_rows(self, storage: '_RowStorage', rows, size: int):
+        """Copy the norms and ids of `rows` into the first `size` rows of another storage"""
+        storage.norms[:size] = self.norms[rows]
+        storage.row_ids[:size] = self.row_ids[rows]
+    
+    def grown(self, capacity: int, vectors_dir: Optional[str] = None) -> '_RowStorage':
+        """Copy the used rows into a larger (or relocated) storage with the same layout"""
+        return self._copied(capacity, vectors_dir or self.vectors_dir)
+    
+    def relocated(self, vectors_dir: Optional[str]) -> '_RowStorage':
+        """Copy the used rows into a file in vectors_dir, or into process memory when None"""
+        return self._copied(self.capacity, vectors_dir)
+    
+    def _copied(self, capacity: int, vectors_dir: Optional[str]) -> '_RowStorage':
+        storage = _RowStorage(self.vectors.shape[1], capacity, vectors_dir)
+        size = self.size
+        storage.vectors[:size] = self.vectors[:size]
+        self._copy_rows(storage, slice(0, size), size)
+        storage.alive[:size] = self.alive[:size]
+        storage.size = size
+        storage.dead = self.dead
+        storage.id_to_row = dict(self.id_to_row)
+        storage.previous[:size] = self.previous[:size]
+        storage.layout = self.layout
+        return storage
+    
+    def compacted(self, keep: np.ndarray, min_capacity: int) -> '_RowStorage':
+        """Copy only the kept (live) rows into a fresh storage with rebuilt id maps"""
+        storage = _RowStorage(self.vectors.shape[1], max(min_capacity, len(keep)), self.vectors_dir)
+        size = len(keep)
+        storage.vectors[:size] = self.vectors[keep]
+        self._copy_rows(storage, keep, size)
+        storage.alive[:size] = True
+        storage.size = size
+        storage.id_to_row = dict(zip(storage.row_ids[:size], range(size)))
+        return storage
+
+
+class VectorIndex:
+    """
+    Growable, contiguous float32 vector matrix with L2-normalized rows.
+    Norms are cached at insert time so a cosine query is a single
+    matrix-vector product against memory that is already laid out.
+    'dotproduct' and 'euclidean' indexes score the same rows against the
+    raw query and rescale by the cached norms, so no metric pays for
+    normalizing or re-reading vectors per query; scores follow Pinecone's
+    conventions (euclidean returns squared distances, smallest first).
+    Items are addressed through an id->row dictionary and a row->id array.
+    
+    Readers never lock: a query runs against the storage version that was
+    current when it started, and writers (serialized by a lock) append rows
+    and publish the next version atomically, so concurrent searches never
+    observe half-applied upserts. Overwrites append the new row and
+    tombstone the old one in the same version; deletes only tombstone.
+    Once the dead fraction passes compaction_threshold the matrix is
+    rewritten, by default in a background thread. `version` counts the
+    writes that can change query results and is bumped only after they are
+    published, so results computed at a version never include later writes.
+    
+    An optional approximate index (`ann`) narrows single queries to a
+    candidate set; exact search remains the fallback. index_type selects
+    it: 'flat' (none), 'ivf' (attached by build_ivf) or 'hnsw' (graph
+    maintained incrementally on every upsert); index_params configure it.
+    
+    quantize() adds int8 or product-quantized codes: searches score codes
+    first and re-rank the best candidates against the float rows, which
+    can be moved to disk so only the codes stay resident.
+    
+    shard() hands exact scans of large indexes to a ShardPool: every worker
+    process scores one row range of the shared, memory-mapped matrix and
+    the local top-k lists are merged here.
+    
+    build_knn_graph() precomputes every item's top-k neighbours, so
+    "more like this item" lookups (neighbors()) read a stored list instead
+    of scanning; the lists are extended on upsert like the HNSW graph.
+    """
+    
+    # Corpora larger than this are scored chunk by chunk through a StreamingTopK
+    SCAN_CHUNK_SIZE = 65536
+    
+    # Below this many rows dispatching to shard workers costs more than it saves
+    SHARD_MIN_ROWS = 65536
+    
+    # Upper bound on score-block elements held at once by search_batch (64 MB of float32)
+    BATCH_SCORE_BUDGET = 1 << 24
+    
+    # Below this many live rows a brute-force scan beats any approximate index
+    ANN_MIN_ROWS = 1024
+    
+    # Default MMR candidate pool, as a multiple of top_k
+    MMR_POOL_FACTOR = 4
+    
+    def __init__(self, dimension: Optional[int] = None, metric: str = 'cosine',
+                 index_type: str = 'flat', index_params: Optional[Dict[str, Any]] = None,
+                 initial_capacity: int = 256, compaction_threshold: float = 0.25,
+                 background_compaction: bool = True):
+        if metric not in SUPPORTED_METRICS:
+            raise ValueError(f"Unsupported metric '{metric}'. Choose from {SUPPORTED_METRICS}")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type '{index_type}'. Choose from {INDEX_TYPES}")
+        self.dimension = dimension
+        self.metric = metric
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        self.compaction_threshold = compaction_threshold
+        self.background_compaction = background_compaction
+        self._initial_capacity = initial_capacity
+        self._storage = None
+        self._lock = threading.RLock()
+        self._compaction_thread = None
+        self.version = 0
+        self.ann = HNSWIndex(metric, **self.index_params) if index_type == 'hnsw' else None
+        self.quantizer = None
+        self.knn = None
+        self.metadata = MetadataIndex()
+        self.shard_pool = None
+        self._vectors_dir = None
+        self._unsharded_vectors_dir = None
+        if dimension is not None:
+            self._set_storage(_RowStorage(dimension, initial_capacity))
+    
+    def __len__(self):
+        storage = self._storage
+        return 0 if storage is None else storage.size - storage.dead
+    
+    def __contains__(self, item_id: str) -> bool:
+        storage = self._storage
+        return storage is not None and _live_row(storage, item_id) is not None
+    
+    @property
+    def id_to_row(self) -> Dict[str, int]:
+        """Mapping from live item id to its row in the current version"""
+        storage = self._storage
+        if storage is None:
+            return {}
+        rows = np.flatnonzero(storage.alive[:storage.size])
+        return dict(zip(storage.row_ids[rows].tolist(), rows.tolist()))
+    
+    @property
+    def dead_fraction(self) -> float:
+        """Fraction of occupied rows that are tombstones"""
+        storage = self._storage
+        if storage is None or storage.size == 0:
+            return 0.0
+        return storage.dead / storage.size
+    
+    def _row_components(self) -> list:
+        """Structures holding per-row state that must follow every storage change"""
+        return [component for component in (self.metadata, self.ann, self.quantizer, self.knn)
+                if component is not None]
+    
+    def _set_storage(self, storage: _RowStorage):
+        """Install the first (empty) storage and attach row components to it"""
+        for component in self._row_components():
+            component.attach(storage)
+        self._storage = storage
+    
+    def _reserve(self, size: int):
+        """Grow storage geometrically so appends are amortized O(1) per row"""
+        capacity = self._storage.capacity
+        if size > capacity:
+            storage = self._storage.grown(max(size, capacity * 2))
+            for component in self._row_components():
+                component.remap(storage)
+            self._storage = storage
+    
+    def _new_storage(self, capacity: int) -> _RowStorage:
+        return _RowStorage(self.dimension, capacity, self._vectors_dir)
+    
+    def _prepare_rows(self, vectors) -> Tuple[np.ndarray, np.ndarray]:
+        """Float32 copy of a batch with unit-length rows, plus the original norms"""
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(vectors, axis=1)
+        nonzero = norms > 0
+        vectors[nonzero] /= norms[nonzero, None]
+        return vectors, norms
+    
+    def _stack_vectors(self, vectors: list):
+        """Stack item vectors into the matrix type this index stores"""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("All vectors in an upsert must have the same dimension")
+        return matrix
+    
+    def upsert(self, items: List[Dict[str, Any]]) -> int:
+        """Insert new items and overwrite existing ids"""
+        # Later duplicates of the same id within a batch win
+        batch = {item['id']: item for item in items}
+        if not batch:
+            return 0
+        ids = list(batch)
+        vectors = self._stack_vectors([_item_vector(batch[item_id]) for item_id in ids])
+        return self.upsert_rows(ids, vectors, [batch[item_id] for item_id in ids])
+    
+    @staticmethod
+    def _dedupe_rows(ids: Sequence[str], vectors, records: Optional[List[Dict[str, Any]]]):
+        """Keep only the last occurrence of each id in a row-aligned batch"""
+        ids = list(ids)
+        if records is None:
+            records = [{'id': item_id} for item_id in ids]
+        last = {item_id: position for position, item_id in enumerate(ids)}
+        if len(last) == len(ids):
+            return ids, vectors, list(records)
+        keep = np.array(sorted(last.values()))
+        return [ids[position] for position in keep], vectors[keep], [records[position] for position in keep]
+    
+    def upsert_rows(self, ids: Sequence[str], vectors, records: Optional[List[Dict[str, Any]]] = None) -> int:
+        """
+        Upsert a row-aligned batch: ids, a (rows x dimension) matrix and
+        optional records, whose fields are stored column by column
+        """
+        ids, vectors, records = self._dedupe_rows(ids, vectors, records)
+        if not ids:
+            return 0
+        vectors, norms = self._prepare_rows(vectors)
+        
+        with self._lock:
+            if self._storage is None:
+                self.dimension = vectors.shape[1]
+                self._set_storage(self._new_storage(max(self._initial_capacity, len(ids))))
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dimension}"
+                )
+            
+            start = self._storage.size
+            end = start + len(ids)
+            self._reserve(end)
+            storage = self._storage
+            
+            # Fill rows past the published size, which no reader looks at yet
+            storage.write(start, vectors, norms)
+            storage.row_ids[start:end] = ids
+            self.metadata.write(storage, np.arange(start, end), records)
+            for component in self._row_components():
+                component.add_rows(storage, np.arange(start, end))
+            
+            # Point ids at the new rows first: until they are published, readers follow `previous`
+            replaced = [row for row in (_live_row(storage, item_id) for item_id in ids) if row is not None]
+            storage.previous[start:end] = [storage.id_to_row.get(item_id, -1) for item_id in ids]
+            storage.id_to_row.update(zip(ids, range(start, end)))
+            
+            # Publish the new rows and tombstone the rows they replace in one version
+            alive = storage.alive
+            if replaced:
+                alive = alive.copy()
+                alive[replaced] = False
+            alive[start:end] = True
+            self._storage = storage.version(end, alive, storage.dead + len(replaced))
+            self.version += 1
+        
+        if replaced:
+            self._maybe_compact()
+        return len(ids)
+    
+    def delete(self, ids: Sequence[str]) -> int:
+        """Tombstone items by id; rows are reclaimed by the next compaction"""
+        with self._lock:
+            storage = self._storage
+            if storage is None:
+                return 0
+            rows = [row for row in (_live_row(storage, item_id) for item_id in dict.fromkeys(ids))
+                    if row is not None]
+            if not rows:
+                return 0
+            # Deleted ids keep their (now dead) rows in the id map until compaction rebuilds it
+            alive = storage.alive.copy()
+            alive[rows] = False
+            self._storage = storage.version(storage.size, alive, storage.dead + len(rows))
+            self.version += 1
+        
+        self._maybe_compact()
+        return len(rows)
+    
+    def _maybe_compact(self):
+        """Compact (in the background by default) once tombstones pass the threshold"""
+        if self.dead_fraction > self.compaction_threshold:
+            if self.background_compaction:
+                self.compact_async()
+            else:
+                self.compact()
+    
+    def compact(self):
+        """Rewrite the matrix and id maps without tombstoned rows"""
+        with self._lock:
+            storage = self._storage
+            if storage is None or storage.dead == 0:
+                return
+            keep = np.flatnonzero(storage.alive[:storage.size])
+            compacted = storage.compacted(keep, self._initial_capacity)
+            for component in self._row_components():
+                component.remap(compacted, keep)
+            self._storage = compacted
+    
+    def compact_async(self) -> threading.Thread:
+        """Run compact() in a background thread unless one is already running"""
+        with self._lock:
+            thread = self._compaction_thread
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self.compact, name='vector-index-compaction', daemon=True)
+                self._compaction_thread = thread
+                thread.start()
+        return thread
+    
+    def build_ivf(self, nlist: Optional[int] = None, centroids: Optional[np.ndarray] = None,
+                  nprobe: Optional[int] = None) -> IVFIndex:
+        """Attach an IVF index, reusing given centroids or training new ones"""
+        if nlist is None:
+            nlist = self.index_params.get('nlist')
+        if nprobe is None:
+            nprobe = self.index_params.get('nprobe')
+        with self._lock:
+            storage = self._storage
+            if centroids is not None:
+                ivf = IVFIndex(centroids, nprobe)
+            else:
+                if storage is None or storage.size == storage.dead:
+                    raise ValueError("Cannot train an IVF index on an empty index")
+                ivf = IVFIndex.train(storage.vectors[np.flatnonzero(storage.alive[:storage.size])], nlist, nprobe)
+            if storage is not None:
+                ivf.attach(storage)
+            self.ann = ivf
+            self.index_type = 'ivf'
+            self.version += 1
+        return ivf
+    
+    def quantize(self, method: str = 'sq8', rerank: int = 64, subspaces: Optional[int] = None,
+                 offload_dir: Optional[str] = None):
+        """
+        Compress stored vectors with 'sq8' (int8 scalar) or 'pq' (product)
+        quantization. With offload_dir, the float rows used for exact
+        re-ranking move to a disk-backed memmap in that directory.
+        """
+        quantizer = create_quantizer(method, rerank, subspaces)
+        with self._lock:
+            storage = self._storage
+            if storage is None or storage.size == storage.dead:
+                raise ValueError("Cannot train a quantizer on an empty index")
+            quantizer.fit(storage.vectors[np.flatnonzero(storage.alive[:storage.size])])
+            if offload_dir is not None:
+                storage = storage.grown(storage.capacity, vectors_dir=offload_dir)
+                for component in self._row_components():
+                    component.remap(storage)
+            quantizer.attach(storage)
+            self.quantizer = quantizer
+            self._storage = storage
+            self.version += 1
+        return quantizer
+    
+    def build_knn_graph(self, k: int = 16, workers: Optional[int] = None) -> KNNGraph:
+        """
+        Precompute the k nearest neighbours of every item (blocked matrix
+        products over `workers` threads); later upserts extend the lists
+        """
+        graph = KNNGraph(k, workers, self.metric)
+        with self._lock:
+            if self._storage is not None:
+                graph.attach(self._storage)
+            self.knn = graph
+        return graph
+    
+    def neighbors(self, item_id: str, top_k: int, filter: Optional[Dict[str, Any]] = None,
+                  include_metadata: bool = True,
+                  fields: Optional[Sequence[str]] = None) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """
+        (records, scores) of a stored item's top-k neighbours (itself included)
+        read from the kNN graph and ordered as a live search orders them, or
+        None when there is no graph or it cannot answer exactly (unknown item,
+        top_k above its k, too many neighbours deleted or filtered out, ties
+        the list may have cut off); callers then fall back to a live search
+        """
+        graph = self.knn
+        if graph is None:
+            return None
+        storage, allowed = self.read_view(filter)
+        row = None if storage is None else _live_row(storage, item_id)
+        if row is None:
+            return None
+        found = graph.neighbors(storage, row, top_k, allowed)
+        if found is None:
+            return None
+        rows, scores = found
+        records = self.metadata.records(storage, rows, include_metadata, fields)
+        if records is None:
+            return None
+        # Graph scores already hold whole (negated) euclidean distances
+        return records, pinecone_scores(scores, 0.0, self.metric)
+    
+    def shard(self, pool: Optional[ShardPool]):
+        """
+        Serve exact scans of this index from a ShardPool (None stops). The
+        rows move into a memory-mapped file in the pool's shared directory,
+        where every later version keeps them, so workers map them directly;
+        detaching moves them back to process memory.
+        """
+        with self._lock:
+            previous, self.shard_pool = self.shard_pool, pool
+            storage = self._storage
+            if pool is None:
+                if previous is None:
+                    return
+                # Rows, and later growth and compaction, leave the detached pool's directory
+                self._vectors_dir = self._unsharded_vectors_dir
+                if storage is not None and storage.vectors_dir == previous.shared_dir:
+                    storage = storage.relocated(self._vectors_dir)
+                    for component in self._row_components():
+                        component.remap(storage)
+                    self._storage = storage
+                return
+            if previous is None:
+                self._unsharded_vectors_dir = self._vectors_dir
+            self._vectors_dir = pool.shared_dir
+            if storage is not None and storage.vectors_dir is None:
+                storage = storage.grown(storage.capacity, vectors_dir=pool.shared_dir)
+                for component in self._row_components():
+                    component.remap(storage)
+                self._storage = storage
+    
+    def _sharded(self, storage: _RowStorage) -> bool:
+        """Whether an exact scan of this version should go to the shard workers"""
+        return (self.shard_pool is not None and storage.vectors_dir is not None
+                and storage.size >= self.SHARD_MIN_ROWS)
+    
+    def _search_shards(self, storage: _RowStorage, queries: np.ndarray, top_k: int,
+                       excluded_rows: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge the shard workers' local top-k lists into (rows, scores) shaped (queries x k)"""
+        candidates, candidate_scores = self.shard_pool.search(
+            storage.vectors, storage.size, queries, top_k, excluded_rows, self.metric, storage.norms
+        )
+        rows = np.empty((len(queries), top_k), dtype=np.int64)
+        scores = np.empty((len(queries), top_k), dtype=np.float32)
+        for query in range(len(queries)):
+            listed = candidates[query] >= 0
+            query_rows, query_scores = candidates[query, listed], candidate_scores[query, listed]
+            # Shards kept every row tied at their k-th score, so the id tie-break here is exact
+            best = select_top_k(query_scores, top_k, storage.row_ids[query_rows])
+            rows[query] = query_rows[best]
+            scores[query] = query_scores[best]
+        return rows, scores
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Resident bytes of the row storage, split by component"""
+        storage = self._storage
+        if storage is None:
+            return {'vectors': 0, 'codes': 0, 'norms': 0, 'knn': 0}
+        offloaded = isinstance(storage.vectors, np.memmap)
+        return {
+            'vectors': 0 if offloaded else storage.size * self.dimension * 4,
+            'codes': self.quantizer.nbytes(storage.size) if self.quantizer is not None else 0,
+            'norms': storage.size * 4,
+            'knn': self.knn.nbytes(storage.size) if self.knn is not None else 0
+        }
+    
+    def _save_rows(self, directory: str, storage: _RowStorage) -> Dict[str, str]:
+        size = storage.size
+        return {
+            'vectors': save_array(directory, 'vectors', storage.vectors[:size]),
+            'norms': save_array(directory, 'norms', storage.norms[:size])
+        }
+    
+    @staticmethod
+    def _load_rows(directory: str, entry: Dict[str, Any], row_ids: List[str], mmap: bool) -> _RowStorage:
+        files = entry['files']
+        return _RowStorage.from_arrays(
+            load_array(directory, files['vectors'], mmap), load_array(directory, files['norms'], mmap), row_ids
+        )
+    
+    @classmethod
+    def _from_config(cls, entry: Dict[str, Any]) -> 'VectorIndex':
+        return cls(entry['dimension'], entry['metric'], index_type=entry['index_type'],
+                   index_params=entry['index_params'])
+    
+    def capture(self) -> Dict[str, Any]:
+        """
+        What save() writes, taken in one step under the index lock after
+        compacting tombstones: the published row storage (its rows never
+        change), a copy of the metadata columns and the pickled approximate
+        index, quantizer and kNN graph. Writing it out needs no lock.
+        """
+        with self._lock:
+            self.compact()
+            storage = self._storage
+            return {
+                'storage': storage,
+                'metadata': self.metadata.frozen(0 if storage is None else storage.size),
+                'components': pickle.dumps(
+                    {'ann': self.ann, 'quantizer': self.quantizer, 'knn': self.knn},
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            }
+    
+    def save(self, directory: str, captured: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Write the index into a snapshot directory: rows and norms as .npy,
+        ids as JSON, metadata and attribute columns as .npy and the
+        approximate index, quantizer and kNN graph pickled.
+        Tombstones are compacted first, so the files hold live rows only.
+        captured (from capture()) defaults to the current state.
+        """
+        if captured is None:
+            captured = self.capture()
+        storage = captured['storage']
+        os.makedirs(directory, exist_ok=True)
+        entry = {
+            'kind': 'dense',
+            'dimension': self.dimension,
+            'metric': self.metric,
+            'index_type': self.index_type,
+            'index_params': self.index_params,
+            'size': 0 if storage is None else storage.size,
+            'files': {},
+            'metadata': {}
+        }
+        if not entry['size']:
+            return entry
+        row_ids = storage.row_ids[:storage.size].tolist()
+        files = self._save_rows(directory, storage)
+        files['row_ids'] = save_json(directory, 'row_ids', row_ids)
+        files['components'] = save_pickled(directory, 'components', captured['components'])
+        entry['files'] = files
+        entry['metadata'] = captured['metadata'].save(directory, storage.size)
+        return entry
+    
+    @classmethod
+    def load(cls, directory: str, entry: Dict[str, Any], mmap: bool = True) -> 'VectorIndex':
+        """Rebuild an index written by save(); with mmap the row arrays are mapped, not read"""
+        index = cls._from_config(entry)
+        if not entry['size']:
+            return index
+        files = entry['files']
+        row_ids = load_json(directory, files['row_ids'])
+        storage = cls._load_rows(directory, entry, row_ids, mmap)
+        index.metadata.load(directory, entry['metadata'], storage, mmap)
+        components = load_pickle(directory, files['components'])
+        index.ann = components['ann']
+        index.quantizer = components['quantizer']
+        index.knn = components.get('knn')
+        for component in (index.ann, index.quantizer, index.knn):
+            if component is not None:
+                component.remap(storage)
+        index._storage = storage
+        return index
+    
+    @property
+    def vectors(self) -> np.ndarray:
+        """View of the normalized rows currently stored, tombstones included"""
+        storage = self._storage
+        if storage is None:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        return storage.vectors[:storage.size]
+    
+    @property
+    def norms(self) -> np.ndarray:
+        """View of the cached L2 norms of the original vectors"""
+        storage = self._storage
+        if storage is None:
+            return np.empty(0, dtype=np.float32)
+        return storage.norms[:storage.size]
+    
+    @property
+    def row_ids(self) -> np.ndarray:
+        """Item id stored at each row"""
+        storage = self._storage
+        if storage is None:
+            return np.empty(0, dtype=object)
+        return storage.row_ids[:storage.size]
+    
+    def get_vector(self, item_id: str) -> np.ndarray:
+        """Reconstruct the original (unnormalized) vector of an item"""
+        storage = self._storage
+        row = None if storage is None else _live_row(storage, item_id)
+        if row is None:
+            raise KeyError(item_id)
+        return storage.vectors[row] * storage.norms[row]
+    
+    def _prepare_query(self, query_vector) -> np.ndarray:
+        """Convert a query to a float32 vector, unit length under cosine (other metrics keep its scale)"""
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dimension:
+            raise ValueError(
+                f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}"
+            )
+        query_norm = np.linalg.norm(query)
+        if query_norm > 0 and self.metric == 'cosine':
+            query = query / query_norm
+        return query
+    
+    def _prepare_queries(self, query_matrix) -> np.ndarray:
+        """Convert a (queries x dimension) matrix to float32 rows, unit length under cosine"""
+        queries = np.array(query_matrix, dtype=np.float32, ndmin=2)
+        if queries.shape[1] != self.dimension:
+            raise ValueError(
+                f"Query dimension {queries.shape[1]} does not match index dimension {self.dimension}"
+            )
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(queries, axis=1)
+            nonzero = norms > 0
+            queries[nonzero] /= norms[nonzero, None]
+        return queries
+    
+    def _score_rows(self, storage: _RowStorage, query: np.ndarray, start: int, end: int,
+                    allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rank-score rows [start, end) of a storage, masking tombstones (or disallowed rows) to -inf"""
+        scores = rank_scores(storage.vectors[start:end] @ query, storage.norms[start:end], self.metric)
+        if allowed is not None:
+            scores[~allowed[start:end]] = -np.inf
+        elif storage.dead:
+            scores[~storage.alive[start:end]] = -np.inf
+        return scores
+    
+    def cosine_scores(self, query_vector) -> np.ndarray:
+        """Cosine similarity of a query against every row, whatever the metric (tombstones score -inf)"""
+        storage = self._storage
+        if storage is None:
+            return np.empty(0, dtype=np.float32)
+        query = self._prepare_query(query_vector)
+        query_norm = np.linalg.norm(query)
+        scores = storage.vectors[:storage.size] @ (query / query_norm if query_norm > 0 else query)
+        if storage.dead:
+            scores[~storage.alive[:storage.size]] = -np.inf
+        return scores
+    
+    def read_view(self, filter: Optional[Dict[str, Any]] = None) -> Tuple[Optional[_RowStorage], Optional[np.ndarray]]:
+        """
+        The current storage version plus the mask of its live rows matching a
+        metadata filter (None without a filter). If a compaction renumbers rows
+        while the filter is evaluated, the read is retried on the new version.
+        """
+        while True:
+            storage = self._storage
+            if storage is None or not filter:
+                return storage, None
+            matched = self.metadata.evaluate(filter, storage)
+            if matched is not None:
+                return storage, matched & storage.alive[:storage.size]
+    
+    def _ann_candidates(self, storage: _RowStorage, query: np.ndarray, top_k: int,
+                        allowed: Optional[np.ndarray], **search_params) -> Optional[np.ndarray]:
+        """Eligible rows proposed by the approximate index, or None if it cannot serve this query"""
+        candidates = self.ann.candidates(storage, query, top_k, **search_params)
+        if candidates is None:
+            return None
+        # Graph links may already point at rows a newer version is still writing
+        candidates = candidates[candidates < storage.size]
+        eligible = allowed if allowed is not None else storage.alive
+        candidates = candidates[eligible[candidates]]
+        if len(candidates) < top_k:
+            return None
+        return candidates
+    
+    def _score_candidates(self, storage: _RowStorage, query: np.ndarray, top_k: int,
+                          candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Exactly score a set of eligible rows and keep the top-k"""
+        scores = rank_scores(storage.vectors[candidates] @ query, storage.norms[candidates], self.metric)
+        row_ids = storage.row_ids[candidates]
+        best = select_top_k(scores, top_k, row_ids)
+        return candidates[best], row_ids[best], scores[best]
+    
+    def _search_quantized(self, storage: _RowStorage, query: np.ndarray, top_k: int,
+                          candidates: Optional[np.ndarray],
+                          allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rank by compressed codes, then re-rank the best few against the float rows"""
+        quantizer = self.quantizer
+        eligible = allowed if allowed is not None else storage.alive
+        if candidates is None:
+            approximate = rank_scores(quantizer.scores(query, size=storage.size),
+                                      storage.norms[:storage.size], self.metric)
+            if allowed is not None or storage.dead:
+                approximate[~eligible[:storage.size]] = -np.inf
+            shortlist = select_top_k(approximate, max(quantizer.rerank, top_k))
+        else:
+            approximate = rank_scores(quantizer.scores(query, rows=candidates), storage.norms[candidates], self.metric)
+            shortlist = candidates[select_top_k(approximate, max(quantizer.rerank, top_k))]
+        shortlist = shortlist[eligible[shortlist]]
+        return self._score_candidates(storage, query, top_k, np.sort(shortlist))
+    
+    def search(self, query_vector, top_k: int, nprobe: Optional[int] = None, ef: Optional[int] = None,
+               exact: bool = False, filter: Optional[Dict[str, Any]] = None, diversity: Optional[float] = None,
+               pool_size: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return (rows, ids, scores) of the top-k live rows under the index metric.
+        Uses the attached approximate index when there is one, unless exact
+        is requested or the index is too small to benefit. nprobe (IVF) and
+        ef (HNSW) tune the approximate search per query. A metadata filter
+        is applied as a row mask before top-k selection. With diversity in
+        (0, 1], the best pool_size rows are re-ranked by maximal marginal
+        relevance, trading similarity for variety among the results.
+        """
+        # Work against one version so concurrent writes and compactions cannot shift rows
+        storage, allowed = self.read_view(filter)
+        return self._search_diverse(storage, allowed, query_vector, top_k, nprobe, ef, exact, diversity, pool_size)
+    
+    def search_records(self, query_vector, top_k: int, nprobe: Optional[int] = None, ef: Optional[int] = None,
+                       exact: bool = False, filter: Optional[Dict[str, Any]] = None,
+                       include_metadata: bool = True, fields: Optional[Sequence[str]] = None,
+                       diversity: Optional[float] = None,
+                       pool_size: Optional[int] = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        Like search(), but returns (records, scores) built from the same
+        storage version, holding only the requested fields (see MetadataIndex.records)
+        """
+        while True:
+            storage, allowed = self.read_view(filter)
+            rows, _, scores = self._search_diverse(
+                storage, allowed, query_vector, top_k, nprobe, ef, exact, diversity, pool_size
+            )
+            if not len(rows):
+                return [], scores
+            records = self.metadata.records(storage, rows, include_metadata, fields)
+            if records is not None:
+                return records, scores
+    
+    def fetch(self, ids: Sequence[str], include_metadata: bool = True,
+              fields: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Records of live items by id with their stored vectors; unknown ids are skipped"""
+        while True:
+            storage = self._storage
+            if storage is None:
+                return {}
+            rows = [_live_row(storage, item_id) for item_id in dict.fromkeys(ids)]
+            rows = [row for row in rows if row is not None]
+            records = self.metadata.records(storage, rows, include_metadata, fields)
+            if records is not None:
+                break
+        for record, row in zip(records, rows):
+            record.update(self._vector_fields(storage, row))
+        return {record['id']: record for record in records}
+    
+    def _vector_fields(self, storage: _RowStorage, row: int) -> Dict[str, Any]:
+        """A row's original (unnormalized) vector in Pinecone's fetch format"""
+        return {'values': (storage.vectors[row] * storage.norms[row]).tolist()}
+    
+    def _search_diverse(self, storage: Optional[_RowStorage], allowed: Optional[np.ndarray], query_vector,
+                        top_k: int, nprobe: Optional[int], ef: Optional[int], exact: bool,
+                        diversity: Optional[float],
+                        pool_size: Optional[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """_search_view, followed by an MMR re-rank of a larger candidate pool when diversity is set"""
+        if not diversity:
+            return self._search_view(storage, allowed, query_vector, top_k, nprobe, ef, exact)
+        if not 0 < diversity <= 1:
+            raise ValueError("diversity must be between 0 and 1")
+        pool_size = max(top_k, pool_size or self.MMR_POOL_FACTOR * top_k)
+        rows, ids, scores = self._search_view(storage, allowed, query_vector, pool_size, nprobe, ef, exact)
+        if len(rows) <= 1:
+            return rows, ids, scores
+        candidates = storage.vectors[rows]
+        picked = mmr_select(mmr_relevance(scores, self.metric), self._score_block(candidates, candidates),
+                            top_k, diversity)
+        return rows[picked], ids[picked], scores[picked]
+    
+    def _search_view(self, storage: Optional[_RowStorage], allowed: Optional[np.ndarray], query_vector,
+                     top_k: int, nprobe: Optional[int], ef: Optional[int],
+                     exact: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k (rows, ids, scores) within one storage version, scored as Pinecone reports them"""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+        if storage is None or storage.size == storage.dead:
+            return empty
+        
+        eligible_count = storage.size - storage.dead if allowed is None else int(allowed.sum())
+        if eligible_count == 0:
+            return empty
+        query = self._prepare_query(query_vector)
+        rows, ids, scores = self._rank_view(storage, allowed, query, min(top_k, eligible_count),
+                                            eligible_count, nprobe, ef, exact)
+        return rows, ids, pinecone_scores(scores, float(query @ query), self.metric)
+    
+    def _rank_view(self, storage: _RowStorage, allowed: Optional[np.ndarray], query: np.ndarray,
+                   top_k: int, eligible_count: int, nprobe: Optional[int], ef: Optional[int],
+                   exact: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k (rows, ids, ranking scores) of a prepared query within one storage version"""
+        size = storage.size
+        candidates = None
+        if self.ann is not None and not exact and eligible_count >= self.ANN_MIN_ROWS:
+            candidates = self._ann_candidates(storage, query, top_k, allowed, nprobe=nprobe, ef=ef)
+        if self.quantizer is not None and not exact and self.quantizer.layout is storage.layout:
+            return self._search_quantized(storage, query, top_k, candidates, allowed)
+        if candidates is not None:
+            return self._score_candidates(storage, query, top_k, candidates)
+        
+        row_ids = storage.row_ids[:size]
+        if self._sharded(storage):
+            if allowed is not None:
+                excluded_rows = ~allowed
+            else:
+                excluded_rows = ~storage.alive[:size] if storage.dead else None
+            rows, scores = self._search_shards(storage, query[None, :], top_k, excluded_rows)
+            return rows[0], row_ids[rows[0]], scores[0]
+        if size <= self.SCAN_CHUNK_SIZE:
+            scores = self._score_rows(storage, query, 0, size, allowed)
+            rows = select_top_k(scores, top_k, row_ids)
+            return rows, row_ids[rows], scores[rows]
+        
+        # Bound the score buffer on very large corpora by scanning in chunks
+        heap = StreamingTopK(top_k)
+        for start in range(0, size, self.SCAN_CHUNK_SIZE):
+            end = min(start + self.SCAN_CHUNK_SIZE, size)
+            heap.push(self._score_rows(storage, query, start, end, allowed), row_ids[start:end], range(start, end))
+        matches = heap.results()
+        rows = np.array([row for _, _, row in matches], dtype=np.int64)
+        scores = np.array([score for score, _, _ in matches], dtype=np.float32)
+        return rows, row_ids[rows], scores
+    
+    @staticmethod
+    def _score_block(queries, vectors) -> np.ndarray:
+        """Dense (queries x rows) score block"""
+        return queries @ vectors.T
+    
+    def search_batch(self, query_matrix, top_k: int, block_size: Optional[int] = None,
+                     filter: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score many queries with one matrix multiply per block of queries.
+        Returns (rows, ids, scores) arrays shaped (queries x k).
+        """
+        storage, allowed = self.read_view(filter)
+        queries = self._prepare_queries(query_matrix)
+        n_queries = queries.shape[0]
+        empty = (np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=object),
+                 np.empty((n_queries, 0), dtype=np.float32))
+        if storage is None or storage.size == storage.dead:
+            return empty
+        
+        size = storage.size
+        eligible_count = size - storage.dead if allowed is None else int(allowed.sum())
+        if eligible_count == 0:
+            return empty
+        top_k = min(top_k, eligible_count)
+        vectors = storage.vectors[:size]
+        norms = storage.norms[:size]
+        row_ids = storage.row_ids[:size]
+        if allowed is not None:
+            excluded_rows = ~allowed
+        else:
+            excluded_rows = ~storage.alive[:size] if storage.dead else None
+        
+        # Size query blocks so each (block x corpus) score matrix stays within budget
+        sharded = self._sharded(storage)
+        if block_size is None:
+            shard_rows = -(-size // self.shard_pool.shards) if sharded else size
+            block_size = max(1, self.BATCH_SCORE_BUDGET // shard_rows)
+        
+        rows = np.empty((n_queries, top_k), dtype=np.int64)
+        scores = np.empty((n_queries, top_k), dtype=np.float32)
+        for start in range(0, n_queries, block_size):
+            end = min(start + block_size, n_queries)
+            if sharded:
+                # Each worker holds only a (block x shard) score matrix
+                rows[start:end], scores[start:end] = self._search_shards(
+                    storage, queries[start:end], top_k, excluded_rows
+                )
+                continue
+            block_scores = rank_scores(self._score_block(queries[start:end], vectors), norms, self.metric)
+            if excluded_rows is not None:
+                block_scores[:, excluded_rows] = -np.inf
+            block_rows = select_top_k_rows(block_scores, top_k, row_ids)
+            rows[start:end] = block_rows
+            scores[start:end] = np.take_along_axis(block_scores, block_rows, axis=1)
+        if self.metric == 'euclidean':
+            squared = queries.multiply(queries) if sparse.issparse(queries) else queries * queries
+            scores = pinecone_scores(scores, np.asarray(squared.sum(axis=1)).reshape(-1, 1), self.metric)
+        return rows, row_ids[rows], scores
+
+
+class _SparseRowStorage:
+    """
+    CSR counterpart of _RowStorage, versioned the same way. Rows are
+    appended into growable data/indices buffers (int32 indices, so each
+    version's CSR view is built without copying), and a version's `vectors`
+    is the CSR matrix over its first `size` rows.
+    """
+    
+    __slots__ = ('dimension', 'data', 'indices', 'indptr', 'norms', 'row_ids', 'alive', 'size', 'dead',
+                 'id_to_row', 'previous', 'layout', '_matrix')
+    
+    def __init__(self, dimension: int, capacity: int, nnz_capacity: Optional[int] = None):
+        self.dimension = dimension
+        nnz_capacity = nnz_capacity if nnz_capacity is not None else 16 * capacity
+        self.data = np.empty(nnz_capacity, dtype=np.float32)
+        self.indices = np.empty(nnz_capacity, dtype=np.int32)
+        self.indptr = np.zeros(capacity + 1, dtype=np.int32)
+        self.norms = np.empty(capacity, dtype=np.float32)
+        self.row_ids = np.empty(capacity, dtype=object)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.dead = 0
+        self.id_to_row = {}
+        self.previous = np.full(capacity, -1, dtype=np.int32)
+        self.layout = object()
+        self._matrix = None
+    
+    @classmethod
+    def from_arrays(cls, matrix: sparse.csr_matrix, norms: np.ndarray,
+                    row_ids: Sequence[str]) -> '_SparseRowStorage':
+        """Wrap an existing CSR matrix and norms as a full storage with every row live"""
+        storage = cls(matrix.shape[1], 0, 0)
+        storage.data = matrix.data
+        storage.indices = matrix.indices
+        storage.indptr = matrix.indptr
+        storage.norms = norms
+        storage.row_ids = np.empty(len(row_ids), dtype=object)
+        storage.row_ids[:] = row_ids
+        storage.alive = np.ones(len(row_ids), dtype=bool)
+        storage.size = len(row_ids)
+        storage.id_to_row = dict(zip(row_ids, range(len(row_ids))))
+        storage.previous = np.full(len(row_ids), -1, dtype=np.int32)
+        return storage
+    
+    @property
+    def capacity(self) -> int:
+        return len(self.alive)
+    
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[self.size])
+    
+    @property
+    def vectors(self) -> sparse.csr_matrix:
+        """This version's rows as a CSR matrix (normalized rows)"""
+        if self._matrix is None:
+            nnz = self.nnz
+            self._matrix = sparse.csr_matrix(
+                (self.data[:nnz], self.indices[:nnz], self.indptr[:self.size + 1]),
+                shape=(self.size, self.dimension),
+                copy=False
+            )
+        return self._matrix
+    
+    def version(self, size: int, alive: np.ndarray, dead: int) -> '_SparseRowStorage':
+        """A new version sharing this one's buffers, id map and layout"""
+        version = _SparseRowStorage.__new__(_SparseRowStorage)
+        for name in self.__slots__:
+            setattr(version, name, getattr(self, name))
+        version.size = size
+        version.alive = alive
+        version.dead = dead
+        version._matrix = None
+        return version
+    
+    def write(self, start: int, vectors: sparse.csr_matrix, norms: np.ndarray):
+        """Append CSR rows at `start`, growing the data/indices buffers geometrically"""
+        end = start + vectors.shape[0]
+        offset = int(self.indptr[start])
+        nnz_end = offset + vectors.nnz
+        if nnz_end > len(self.data):
+            nnz_capacity = max(nnz_end, 2 * len(self.data))
+            data = np.empty(nnz_capacity, dtype=np.float32)
+            indices = np.empty(nnz_capacity, dtype=np.int32)
+            data[:offset] = self.data[:offset]
+            indices[:offset] = self.indices[:offset]
+            self.data = data
+            self.indices = indices
+        self.data[offset:nnz_end] = vectors.data
+        self.indices[offset:nnz_end] = vectors.indices
+        self.indptr[start + 1:end + 1] = offset + vectors.indptr[1:]
+        self.norms[start:end] = norms
+    
+    def _with_rows(self, matrix: sparse.csr_matrix, capacity: int, rows, size: int) -> '_SparseRowStorage':
+        storage = _SparseRowStorage(self.dimension, capacity, max(matrix.nnz, 16))
+        storage.write(0, matrix, self.norms[rows])
+        storage.row_ids[:size] = self.row_ids[rows]
+        return storage
+    
+    def grown(self, capacity: int, vectors_dir: Optional[str] = None) -> '_SparseRowStorage':
+        """Copy the used rows into larger arrays with the same layout"""
+        size = self.size
+        storage = self._with_rows(self.vectors, capacity, slice(0, size), size)
+        storage.alive[:size] = self.alive[:size]
+        storage.size = size
+        storage.dead = self.dead
+        storage.id_to_row = dict(self.id_to_row)
+        storage.previous[:size] = self.previous[:size]
+        storage.layout = self.layout
+        return storage
+    
+    def compacted(self, keep: np.ndarray, min_capacity: int) -> '_SparseRowStorage':
+        """Copy only the kept rows into a fresh storage with rebuilt id maps"""
+        size = len(keep)
+        storage = self._with_rows(self.vectors[keep], max(min_capacity, size), keep, size)
+        storage.alive[:size] = True
+        storage.size = size
+        storage.id_to_row = dict(zip(storage.row_ids[:size], range(size)))
+        return storage
+
+
+class SparseVectorIndex(VectorIndex):
+    """
+    VectorIndex over sparse (CSR) vectors such as TF-IDF rows. Vectors are
+    never densified: rows are normalized once at upsert and scored with
+    sparse-dense or sparse-sparse products, so memory grows with the number
+    of non-zeros rather than with the vocabulary size. Metadata filters,
+    tombstones and compaction work as for dense indexes; approximate indexes
+    and quantization are dense-only.
+    """
+    
+    def __init__(self, dimension: int, metric: str = 'cosine', initial_capacity: int = 256,
+                 compaction_threshold: float = 0.25, background_compaction: bool = True):
+        super().__init__(
+            None,
+            metric,
+            initial_capacity=initial_capacity,
+            compaction_threshold=compaction_threshold,
+            background_compaction=background_compaction
+        )
+        self.dimension = dimension
+        self._set_storage(_SparseRowStorage(dimension, initial_capacity))
+    
+    def _to_csr(self, vector) -> sparse.csr_matrix:
+        """Convert one vector (CSR row, {'indices', 'values'} or dense) to a 1 x dimension CSR row"""
+        if sparse.issparse(vector):
+            return sparse.csr_matrix(vector, dtype=np.float32).reshape(1, -1)
+        if isinstance(vector, dict):
+            return sparse.csr_matrix(
+                (np.asarray(vector['values'], dtype=np.float32),
+                 np.asarray(vector['indices'], dtype=np.int32),
+                 np.array([0, len(vector['indices'])])),
+                shape=(1, self.dimension)
+            )
+        return sparse.csr_matrix(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+    
+    def _stack_vectors(self, vectors: list) -> sparse.csr_matrix:
+        return sparse.vstack([self._to_csr(vector) for vector in vectors], format='csr')
+    
+    def _prepare_rows(self, vectors) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """CSR copy of a batch with unit-length rows, plus the original norms"""
+        vectors = sparse.csr_matrix(vectors, dtype=np.float32)
+        norms = sparse.linalg.norm(vectors, axis=1).astype(np.float32)
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        normalized = sparse.csr_matrix(sparse.diags(scale) @ vectors, dtype=np.float32)
+        normalized.sort_indices()
+        return normalized, norms
+    
+    def _save_rows(self, directory: str, storage: _SparseRowStorage) -> Dict[str, str]:
+        matrix = storage.vectors
+        return {
+            'data': save_array(directory, 'data', matrix.data),
+            'indices': save_array(directory, 'indices', matrix.indices),
+            'indptr': save_array(directory, 'indptr', matrix.indptr),
+            'norms': save_array(directory, 'norms', storage.norms[:storage.size])
+        }
+    
+    @staticmethod
+    def _load_rows(directory: str, entry: Dict[str, Any], row_ids: List[str], mmap: bool) -> _SparseRowStorage:
+        files = entry['files']
+        matrix = sparse.csr_matrix(
+            (load_array(directory, files['data'], mmap), load_array(directory, files['indices'], mmap),
+             load_array(directory, files['indptr'], mmap)),
+            shape=(len(row_ids), entry['dimension']),
+            copy=False
+        )
+        return _SparseRowStorage.from_arrays(matrix, load_array(directory, files['norms'], mmap), row_ids)
+    
+    @classmethod
+    def _from_config(cls, entry: Dict[str, Any]) -> 'SparseVectorIndex':
+        return cls(entry['dimension'], entry['metric'])
+    
+    def save(self, directory: str, captured: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        entry = super().save(directory, captured)
+        entry['kind'] = 'sparse'
+        return entry
+    
+    def build_ivf(self, *args, **kwargs):
+        raise ValueError("IVF indexes are only supported on dense namespaces")
+    
+    def quantize(self, *args, **kwargs):
+        raise ValueError("Quantization is only supported on dense namespaces")
+    
+    def shard(self, pool: Optional[ShardPool]):
+        if pool is not None:
+            raise ValueError("Sharded search is only supported on dense namespaces")
+    
+    def memory_usage(self) -> Dict[str, int]:
+        storage = self._storage
+        return {
+            'vectors': storage.nnz * 8 + (storage.size + 1) * 4,
+            'codes': 0,
+            'norms': self._storage.size * 4,
+            'knn': self.knn.nbytes(storage.size) if self.knn is not None else 0
+        }
+    
+    def get_vector(self, item_id: str) -> sparse.csr_matrix:
+        """Reconstruct the original (unnormalized) sparse row of an item"""
+        storage = self._storage
+        row = None if storage is None else _live_row(storage, item_id)
+        if row is None:
+            raise KeyError(item_id)
+        return storage.vectors[row] * storage.norms[row]
+    
+    def sparse_values(self, item_id: str) -> Dict[str, list]:
+        """Pinecone-style {'indices', 'values'} of an item's original vector"""
+        vector = self.get_vector(item_id)
+        return {'indices': vector.indices.tolist(), 'values': vector.data.tolist()}
+    
+    def _vector_fields(self, storage: _SparseRowStorage, row: int) -> Dict[str, Any]:
+        vector = storage.vectors[row] * storage.norms[row]
+        return {'sparse_values': {'indices': vector.indices.tolist(), 'values': vector.data.tolist()}}
+    
+    def _prepare_query(self, query_vector) -> np.ndarray:
+        # One dense query keeps CSR-times-vector products returning plain arrays
+        if sparse.issparse(query_vector) or isinstance(query_vector, dict):
+            query_vector = self._to_csr(query_vector).toarray()
+        return super()._prepare_query(query_vector)
+    
+    def _prepare_queries(self, query_matrix) -> sparse.csr_matrix:
+        if sparse.issparse(query_matrix):
+            queries = sparse.csr_matrix(query_matrix, dtype=np.float32)
+        else:
+            queries = self._stack_vectors(list(np.array(query_matrix, dtype=np.float32, ndmin=2)))
+        if self.metric != 'cosine':
+            return queries
+        norms = sparse.linalg.norm(queries, axis=1)
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        return sparse.csr_matrix(sparse.diags(scale) @ queries, dtype=np.float32)
+    
+    @staticmethod
+    def _score_block(queries, vectors) -> np.ndarray:
+        return (queries @ vectors.T).toarray()
 
 
 class MockPineconeDB:
     """
     Mock implementation of Pinecone for demonstration purposes.
     In production, you would use the actual Pinecone client.
+    Each content type lives in its own namespace backed by a VectorIndex.
+    
+    A database opened with MockPineconeDB.open(directory) is durable: every
+    mutation is appended to a write-ahead log before it is acknowledged, and
+    checkpoints fold the log into a snapshot of the whole database.
+    
+    With shards > 0 (or after shard()), exact scans of large dense
+    namespaces are split across a pool of worker processes that share the
+    rows through memory-mapped files.
+    
+    Query results are kept in an LRU cache of cache_size entries (0
+    disables it), invalidated by the namespace's index version.
     """
     
-    def __init__(self):
-        self.spotify_index = {}
-        self.netflix_index = {}
-        self.spotify_vectors = []
-        self.netflix_vectors = []
+    # Log size (bytes) that triggers a background checkpoint
+    CHECKPOINT_BYTES = 64 << 20
     
-    def upsert_spotify_embeddings(self, embeddings: List[Dict[str, Any]]):
-        """Store Spotify embeddings in mock database"""
-        for embedding in embeddings:
-            self.spotify_index[embedding['id']] = embedding
-            self.spotify_vectors.append(embedding['vector'])
+    def __init__(self, index_type: str = 'flat', index_params: Optional[Dict[str, Any]] = None,
+                 shards: int = 0, shared_dir: Optional[str] = None, cache_size: int = 1024):
+        self.indexes: Dict[str, VectorIndex] = {}
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        self.directory = None
+        self.checkpoint_bytes = self.CHECKPOINT_BYTES
+        self.shard_pool = None
+        self.query_cache = QueryCache(cache_size) if cache_size else None
+        self._wal = None
+        self._wal_lsn = 0
+        self._write_lock = threading.RLock()
+        # Checkpoints run one at a time, so an older one never overwrites a newer base
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_thread = None
+        if shards:
+            self.shard(shards, shared_dir)
     
-    def upsert_netflix_embeddings(self, embeddings: List[Dict[str, Any]]):
-        """Store Netflix embeddings in mock database"""
-        for embedding in embeddings:
-            self.netflix_index[embedding['id']] = embedding
-            self.netflix_vectors.append(embedding['vector'])
+    def shard(self, shards: int, shared_dir: Optional[str] = None) -> ShardPool:
+        """
+        Start a pool of `shards` worker processes and serve exact scans of
+        every dense namespace (current and future) from it. Rows are shared
+        through memory-mapped files in shared_dir (default /dev/shm).
+        """
+        pool = ShardPool(shards, shared_dir)
+        previous, self.shard_pool = self.shard_pool, pool
+        for index in self.indexes.values():
+            if not isinstance(index, SparseVectorIndex):
+                index.shard(pool)
+        if previous is not None:
+            previous.close()
+        return pool
     
-    def similarity_search_spotify(self, query_vector: List[float], top_k: int = 5):
-        """Find similar Spotify tracks using cosine similarity"""
-        if not self.spotify_vectors:
-            return []
+    def _new_index(self, *args, **kwargs) -> VectorIndex:
+        """Create a dense namespace index, attached to the shard pool when there is one"""
+        index = VectorIndex(*args, **kwargs)
+        if self.shard_pool is not None:
+            index.shard(self.shard_pool)
+        return index
+    
+    @classmethod
+    def open(cls, directory: str, index_type: str = 'flat', index_params: Optional[Dict[str, Any]] = None,
+             sync: bool = True, group_commit_delay: float = 0.0, checkpoint_bytes: Optional[int] = None,
+             mmap: bool = True) -> 'MockPineconeDB':
+        """
+        Open (or create) a durable database in a directory: load the last
+        checkpoint from <directory>/base, replay <directory>/wal.log on top
+        of it, and log every later mutation there. sync=False skips fsync;
+        group_commit_delay (seconds) lets concurrent writers share a flush.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, 'base')
+        if os.path.exists(os.path.join(base, MANIFEST_FILE)):
+            db = cls.load(base, mmap)
+        else:
+            db = cls(index_type, index_params)
+        db.directory = directory
+        if checkpoint_bytes is not None:
+            db.checkpoint_bytes = checkpoint_bytes
+        
+        wal = WriteAheadLog(os.path.join(directory, 'wal.log'), sync, group_commit_delay)
+        for lsn, (operation, args) in wal.replay():
+            if lsn <= db._wal_lsn:
+                # Already folded into the checkpoint
+                continue
+            try:
+                getattr(db, f'_{operation}')(*args)
+            except (KeyError, ValueError):
+                # The operation failed when it was first issued too
+                pass
+            db._wal_lsn = lsn
+        wal.open(db._wal_lsn + 1)
+        db._wal = wal
+        return db
+    
+    def _write(self, operation: str, *args):
+        """Apply a mutation, logging it first (and waiting for its group commit) when durable"""
+        apply = getattr(self, f'_{operation}')
+        wal = self._wal
+        if wal is None:
+            return apply(*args)
+        with self._write_lock:
+            # LSN order is apply order, so replay reproduces the same state
+            lsn = wal.append((operation, args))
+            result = apply(*args)
+            self._wal_lsn = lsn
+        wal.wait(lsn)
+        if wal.size > self.checkpoint_bytes:
+            self.checkpoint_async()
+        return result
+    
+    def checkpoint(self):
+        """
+        Write a snapshot of every namespace to <directory>/base and drop the
+        logged operations it covers. Writers are only held up while the
+        state is captured, not while the files are written.
+        """
+        if self._wal is None:
+            raise ValueError("checkpoint() requires a database opened with MockPineconeDB.open()")
+        with self._checkpoint_lock:
+            lsn = self._save(os.path.join(self.directory, 'base'))
+            self._wal.truncate(lsn)
+    
+    def checkpoint_async(self) -> threading.Thread:
+        """Run checkpoint() in a background thread unless one is already running"""
+        with self._write_lock:
+            thread = self._checkpoint_thread
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self.checkpoint, name='vector-db-checkpoint', daemon=True)
+                self._checkpoint_thread = thread
+                thread.start()
+        return thread
+    
+    def close(self):
+        """Flush the write-ahead log, stop logging and stop any shard workers"""
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        if self.shard_pool is not None:
+            for index in self.indexes.values():
+                if not isinstance(index, SparseVectorIndex):
+                    index.shard(None)
+            self.shard_pool.close()
+            self.shard_pool = None
+    
+    def create_index(self, name: str, dimension: int, metric: str = 'cosine',
+                     index_type: Optional[str] = None, index_params: Optional[Dict[str, Any]] = None,
+                     sparse: bool = False) -> VectorIndex:
+        """
+        Create a namespace with a fixed dimension, similarity metric ('cosine',
+        'dotproduct' or 'euclidean') and index type. sparse=True stores CSR
+        rows (e.g. TF-IDF) without densifying them.
+        """
+        return self._write('create_index', name, dimension, metric, index_type, index_params, sparse)
+    
+    def upsert(self, namespace: str, items: List[Dict[str, Any]]) -> int:
+        """Insert or overwrite items (dicts with 'id' and 'vector') in a namespace"""
+        return self._write('upsert', namespace, items)
+    
+    def upsert_matrix(self, namespace: str, ids: Sequence[str], matrix,
+                      records: Optional[List[Dict[str, Any]]] = None) -> int:
+        """
+        Upsert a whole matrix at once: row i of `matrix` (dense array or
+        scipy sparse) belongs to ids[i] and records[i]. Sparse matrices go to
+        a sparse namespace, created on first use, without densification.
+        """
+        return self._write('upsert_matrix', namespace, ids, matrix, records)
+    
+    def delete(self, namespace: str, ids: Sequence[str]) -> int:
+        """Delete items by id and return how many were removed"""
+        return self._write('delete', namespace, ids)
+    
+    def quantize(self, namespace: str, method: str = 'sq8', rerank: int = 64,
+                 subspaces: Optional[int] = None, offload_dir: Optional[str] = None):
+        """Compress a namespace's vectors (see VectorIndex.quantize)"""
+        return self._write('quantize', namespace, method, rerank, subspaces, offload_dir)
+    
+    def build_ivf(self, namespace: str, nlist: Optional[int] = None,
+                  centroids: Optional[np.ndarray] = None, nprobe: Optional[int] = None) -> IVFIndex:
+        """Attach an inverted-file index to a namespace (see VectorIndex.build_ivf)"""
+        return self._write('build_ivf', namespace, nlist, centroids, nprobe)
+    
+    def build_knn_graph(self, namespace: str, k: int = 16, workers: Optional[int] = None) -> KNNGraph:
+        """Precompute every item's k nearest neighbours for query_by_id (see VectorIndex.build_knn_graph)"""
+        return self._write('build_knn_graph', namespace, k, workers)
+    
+    def _create_index(self, name: str, dimension: int, metric: str = 'cosine',
+                      index_type: Optional[str] = None, index_params: Optional[Dict[str, Any]] = None,
+                      sparse: bool = False) -> VectorIndex:
+        if name in self.indexes:
+            index = self.indexes[name]
+            if (index.dimension not in (None, dimension) or index.metric != metric
+                    or isinstance(index, SparseVectorIndex) != sparse):
+                raise ValueError(f"Index '{name}' already exists with a different configuration")
+            return index
         
-        # Convert to numpy arrays for computation
-        query_vector = np.array(query_vector).reshape(1, -1)
-        all_vectors = np.array(self.spotify_vectors)
+        if sparse:
+            index = SparseVectorIndex(dimension, metric)
+            self.indexes[name] = index
+            return index
         
-        # Compute cosine similarity
-        similarities = cosine_similarity(query_vector, all_vectors)[0]
+        index = self._new_index(
+            dimension,
+            metric,
+            index_type=index_type or self.index_type,
+            index_params=index_params if index_params is not None else self.index_params
+        )
+        self.indexes[name] = index
+        return index
+    
+    def _get_index(self, namespace: str) -> VectorIndex:
+        """Look up a namespace, failing loudly if it was never created"""
+        if namespace not in self.indexes:
+            raise KeyError(f"Unknown namespace '{namespace}'")
+        return self.indexes[namespace]
+    
+    def _upsert(self, namespace: str, items: List[Dict[str, Any]]) -> int:
+        if namespace not in self.indexes:
+            # Mirror Pinecone's implicit namespaces: infer the dimension from the data
+            self.indexes[namespace] = self._new_index(index_type=self.index_type, index_params=self.index_params)
+        return self.indexes[namespace].upsert(items)
+    
+    def _upsert_matrix(self, namespace: str, ids: Sequence[str], matrix,
+                       records: Optional[List[Dict[str, Any]]] = None) -> int:
+        if namespace not in self.indexes:
+            self._create_index(namespace, matrix.shape[1], sparse=scipy.sparse.issparse(matrix))
+        return self.indexes[namespace].upsert_rows(ids, matrix, records)
+    
+    def query(self, namespace: str, vector: List[float], top_k: int = 5, nprobe: Optional[int] = None,
+              ef: Optional[int] = None, exact: bool = False,
+              filter: Optional[Dict[str, Any]] = None, include_metadata: bool = True,
+              fields: Optional[Sequence[str]] = None, diversity: Optional[float] = None,
+              pool_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Find the top-k most similar items in a namespace, optionally restricted
+        by a metadata filter such as {'genre': {'$in': ['pop', 'rock']}} or
+        {'release_year': {'$gt': 2010}}. Results are built from the stored
+        columns: only the listed fields (all by default), and no 'metadata'
+        dict without include_metadata. diversity (0-1) re-ranks the best
+        pool_size matches by maximal marginal relevance so near-duplicates
+        make room for varied results.
+        """
+        index = self.indexes.get(namespace)
+        if index is None or not len(index):
+            return []
         
-        # Get top-k most similar items
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        cache = self.query_cache
+        if cache is not None:
+            key = (namespace, query_digest(vector), top_k, nprobe, ef, exact, filter_key(filter),
+                   include_metadata, None if fields is None else tuple(fields), diversity, pool_size)
+            # Read before searching: a write landing meanwhile leaves the entry already stale
+            version = (id(index), index.version)
+            cached = cache.get(key, version)
+            if cached is not None:
+                # Metadata dicts and their list values are copied too, so callers never share them
+                return copy.deepcopy(cached)
         
-        results = []
-        for idx in top_indices:
-            item_id = f"spotify_{idx}"
-            if item_id in self.spotify_index:
-                result = self.spotify_index[item_id].copy()
-                result['similarity'] = float(similarities[idx])
-                results.append(result)
+        # Records come from the same version as the scores, never from a later write
+        results, similarities = index.search_records(
+            vector, top_k, nprobe=nprobe, ef=ef, exact=exact, filter=filter,
+            include_metadata=include_metadata, fields=fields, diversity=diversity, pool_size=pool_size
+        )
+        for result, similarity in zip(results, similarities):
+            result['similarity'] = float(similarity)
         
+        if cache is not None:
+            cache.put(key, version, copy.deepcopy(results))
         return results
     
-    def similarity_search_netflix(self, query_vector: List[float], top_k: int = 5):
-        """Find similar Netflix content using cosine similarity"""
-        if not self.netflix_vectors:
+    def query_batch(self, namespace: str, query_matrix, top_k: int = 5, block_size: Optional[int] = None,
+                    filter: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Run many queries at once; returns (ids, scores) arrays shaped (queries x k)"""
+        _, ids, scores = self._get_index(namespace).search_batch(query_matrix, top_k, block_size, filter)
+        return ids, scores
+    
+    def query_by_id(self, namespace: str, item_id: str, top_k: int = 5,
+                    filter: Optional[Dict[str, Any]] = None, include_metadata: bool = True,
+                    fields: Optional[Sequence[str]] = None, diversity: Optional[float] = None,
+                    pool_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Top-k items most similar to a stored item (the item itself first).
+        Served in O(k) from the namespace's kNN graph when it can answer,
+        otherwise by a live query with the item's vector; unknown ids give [].
+        MMR re-ranking (diversity) always runs on a live candidate pool.
+        """
+        index = self.indexes.get(namespace)
+        if index is None:
             return []
+        found = None if diversity else index.neighbors(item_id, top_k, filter, include_metadata, fields)
+        if found is not None:
+            results, similarities = found
+            for result, similarity in zip(results, similarities):
+                result['similarity'] = float(similarity)
+            return results
         
-        # Convert to numpy arrays for computation
-        query_vector = np.array(query_vector).reshape(1, -1)
-        all_vectors = np.array(self.netflix_vectors)
-        
-        # Compute cosine similarity
-        similarities = cosine_similarity(query_vector, all_vectors)[0]
-        
-        # Get top-k most similar items
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        # Not in the graph yet (or no graph): search with the stored vector
+        fetched = index.fetch([item_id], include_metadata=False, fields=())
+        if item_id not in fetched:
+            return []
+        return self.query(namespace, _item_vector(fetched[item_id]), top_k, filter=filter,
+                          include_metadata=include_metadata, fields=fields, diversity=diversity,
+                          pool_size=pool_size)
+    
+    def _build_knn_graph(self, namespace: str, k: int, workers: Optional[int]) -> KNNGraph:
+        return self._get_index(namespace).build_knn_graph(k, workers)
+    
+    def _quantize(self, namespace: str, method: str, rerank: int, subspaces: Optional[int],
+                  offload_dir: Optional[str]):
+        return self._get_index(namespace).quantize(method, rerank, subspaces, offload_dir)
+    
+    def _build_ivf(self, namespace: str, nlist: Optional[int], centroids: Optional[np.ndarray],
+                   nprobe: Optional[int]) -> IVFIndex:
+        return self._get_index(namespace).build_ivf(nlist, centroids, nprobe)
+    
+    def fetch(self, namespace: str, ids: Sequence[str], include_metadata: bool = True,
+              fields: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch stored items by id with their vectors ('values', or
+        'sparse_values' in sparse namespaces); unknown ids are skipped
+        """
+        return self._get_index(namespace).fetch(ids, include_metadata, fields)
+    
+    def _delete(self, namespace: str, ids: Sequence[str]) -> int:
+        return self._get_index(namespace).delete(ids)
+    
+    def compact(self, namespace: Optional[str] = None, background: bool = False):
+        """Reclaim tombstoned rows in one namespace, or in all of them"""
+        names = [namespace] if namespace is not None else list(self.indexes)
+        for name in names:
+            index = self._get_index(name)
+            if background:
+                index.compact_async()
+            else:
+                index.compact()
+    
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """Summarize namespaces, dimensions, item counts and query cache counters"""
+        return {
+            'query_cache': self.query_cache.stats() if self.query_cache is not None else None,
+            'namespaces': {
+                name: {
+                    'vector_count': len(index),
+                    'dimension': index.dimension,
+                    'metric': index.metric,
+                    'index_type': index.index_type,
+                    'sparse': isinstance(index, SparseVectorIndex)
+                }
+                for name, index in self.indexes.items()
+            },
+            'total_vector_count': sum(len(index) for index in self.indexes.values())
+        }
+    
+    def save(self, path: str, clustering_results: Optional[Dict[str, Any]] = None,
+             sources: Optional[Sequence[str]] = None):
+        """
+        Write every namespace to a snapshot directory (see snapshot.py for the
+        layout). Clustering/projection outputs and the (size, mtime) of the
+        source files can be stored alongside for warm starts.
+        """
+        self._save(path, clustering_results, sources)
+    
+    def _save(self, path: str, clustering_results: Optional[Dict[str, Any]] = None,
+              sources: Optional[Sequence[str]] = None) -> int:
+        """save(), returning the LSN of the last logged operation the snapshot holds"""
+        # Compact outside the write lock so the capture below has little left to do
+        for index in list(self.indexes.values()):
+            index.compact()
+        with self._write_lock:
+            lsn = self._wal_lsn
+            captured = {name: (index, index.capture()) for name, index in self.indexes.items()}
         
-        results = []
-        for idx in top_indices:
-            item_id = f"netflix_{idx}"
-            if item_id in self.netflix_index:
-                result = self.netflix_index[item_id].copy()
-                result['similarity'] = float(similarities[idx])
-                results.append(result)
+        def write_namespaces(directory: str) -> Dict[str, Any]:
+            namespaces = {}
+            for position, (name, (index, state)) in enumerate(captured.items()):
+                entry = index.save(os.path.join(directory, f'namespace_{position}'), state)
+                entry['directory'] = f'namespace_{position}'
+                namespaces[name] = entry
+            return {
+                'index_type': self.index_type,
+                'index_params': self.index_params,
+                'namespaces': namespaces,
+                'wal_lsn': lsn
+            }
         
-        return results
+        write_snapshot(path, write_namespaces, sources, clustering_results)
+        return lsn
+    
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, verify: bool = True) -> 'MockPineconeDB':
+        """
+        Open a snapshot written by save(). With mmap, row arrays are
+        copy-on-write file mappings shared through the page cache; verify
+        checks every file's CRC32 against the manifest first.
+        """
+        database = read_manifest(path, verify)['database']
+        db = cls(database['index_type'], database['index_params'])
+        db._wal_lsn = database.get('wal_lsn', 0)
+        for name, entry in database['namespaces'].items():
+            index_class = SparseVectorIndex if entry['kind'] == 'sparse' else VectorIndex
+            db.indexes[name] = index_class.load(os.path.join(path, entry['directory']), entry, mmap)
+        return db
+    
+    def upsert_spotify_embeddings(self, embeddings: List[Dict[str, Any]]):
+        """Store Spotify embeddings in mock database"""
+        self.upsert('spotify', embeddings)
+    
+    def upsert_netflix_embeddings(self, embeddings: List[Dict[str, Any]]):
+        """Store Netflix embeddings in mock database"""
+        self.upsert('netflix', embeddings)
+    
+    def similarity_search_spotify(self, query_vector: List[float], top_k: int = 5):
+        """Find similar Spotify tracks using cosine similarity"""
+        return self.query('spotify', query_vector, top_k)
+    
+    def similarity_search_netflix(self, query_vector: List[float], top_k: int = 5):
+        """Find similar Netflix content using cosine similarity"""
+        return self.query('netflix', query_vector, top_k)
     
     def get_all_spotify_embeddings(self):
         """Get all Spotify embeddings"""
-        return list(self.spotify_index.values())
+        return list(self.fetch('spotify', list(self.indexes['spotify'].id_to_row)).values()) \
+            if 'spotify' in self.indexes else []
     
     def get_all_netflix_embeddings(self):
         """Get all Netflix embeddings"""
-        return list(self.netflix_index.values())
+        return list(self.fetch('netflix', list(self.indexes['netflix'].id_to_row)).values()) \
+            if 'netflix' in self.indexes else []
 
 
 class RealPineconeDB:
     """
-    Real Pinecone implementation (requires API key and setup).
-    This is commented out as it requires actual Pinecone credentials.
+    Pinecone REST client with the same interface as MockPineconeDB. Each
+    namespace is stored in a Pinecone index named '<namespace>-similarity'
+    (under the index namespace of the same name), created on create_index.
+    With host set, every namespace goes to that one data-plane host
+    instead, e.g. the local stand-in served by pinecone_server.py.
+    
+    All requests share one keep-alive session whose connection pool is
+    sized for max_workers; connection errors, 429 and 5xx responses are
+    retried with exponential backoff (honouring Retry-After). Upserts are
+    split into chunks under Pinecone's request limits and sent in parallel,
+    and query_batch runs its queries concurrently.
     """
     
-    def __init__(self, api_key: str, environment: str):
-        """
-        Initialize Pinecone client
-        
-        # Uncomment and modify as needed for real implementation:
-        
-        import pinecone
+    CONTROL_PLANE_URL = 'https://api.pinecone.io'
+    
+    # Pinecone's limits for one upsert request
+    MAX_UPSERT_VECTORS = 1000
+    MAX_REQUEST_BYTES = 2 << 20
+    
+    # Ids per fetch request, which puts them all in the query string
+    FETCH_BATCH_SIZE = 100
+    
+    # Seconds between readiness checks of a newly created index
+    INDEX_READY_POLL = 2.0
+    
+    def __init__(self, api_key: str, environment: Optional[str] = None, host: Optional[str] = None,
+                 batch_size: int = 100, max_workers: int = 8, max_retries: int = 5,
+                 backoff_factor: float = 0.25, timeout: float = 30.0):
+        self.api_key = api_key
+        self.environment = environment
+        self.host = host.rstrip('/') if host else None
+        self.batch_size = min(batch_size, self.MAX_UPSERT_VECTORS)
+        self.timeout = timeout
+        self._hosts = {}
+        self._metrics = {}
         
-        pinecone.init(
-            api_key=api_key,
-            environment=environment
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,  # upserts, queries and deletes are all idempotent
+            respect_retry_after_header=True,
+            raise_on_status=False
         )
-        
-        # Create indexes if they don't exist
-        if "spotify-similarity" not in pinecone.list_indexes():
-            pinecone.create_index(
-                "spotify-similarity",
-                dimension=9,  # Number of audio features
-                metric="cosine"
-            )
-        
-        if "netflix-similarity" not in pinecone.list_indexes():
-            pinecone.create_index(
-                "netflix-similarity", 
-                dimension=100,  # TF-IDF features
-                metric="cosine"
-            )
-        
-        self.spotify_index = pinecone.Index("spotify-similarity")
-        self.netflix_index = pinecone.Index("netflix-similarity")
-        """
-        pass
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Api-Key': api_key, 'Accept': 'application/json'})
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='pinecone-client')
+    
+    def _request(self, method: str, url: str, body=None, params=None) -> Dict[str, Any]:
+        """Send one request (body: JSON-serializable value or pre-encoded bytes) and decode the reply"""
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body, default=json_default).encode()
+        headers = {'Content-Type': 'application/json'} if body is not None else None
+        response = self.session.request(method, url, data=body, params=params, headers=headers,
+                                        timeout=self.timeout)
+        if response.status_code == 404:
+            raise KeyError(f"Not found: {method} {url}")
+        if response.status_code >= 400:
+            raise ValueError(f"Pinecone request {method} {url} failed ({response.status_code}): {response.text}")
+        return response.json() if response.content else {}
     
-    def upsert_spotify_embeddings(self, embeddings):
+    def close(self):
+        """Stop the worker threads and close pooled connections"""
+        self._executor.shutdown()
+        self.session.close()
+    
+    def create_index(self, name: str, dimension: int, metric: str = 'cosine', **_) -> str:
         """
-        # Real implementation:
-        vectors = [
-            (emb['id'], emb['vector'], emb['metadata']) 
-            for emb in embeddings
-        ]
-        self.spotify_index.upsert(vectors=vectors)
+        Make sure the Pinecone index behind a namespace exists (creating it
+        and waiting until it is ready) and return its data-plane URL
         """
-        pass
+        self._metrics[name] = metric
+        if self.host is not None:
+            return self.host
+        index_name = f'{name}-similarity'
+        try:
+            description = self._request('GET', f'{self.CONTROL_PLANE_URL}/indexes/{index_name}')
+        except KeyError:
+            if self.environment:
+                spec = {'pod': {'environment': self.environment, 'pod_type': 'p1.x1'}}
+            else:
+                spec = {'serverless': {'cloud': 'aws', 'region': 'us-east-1'}}
+            self._request('POST', f'{self.CONTROL_PLANE_URL}/indexes', {
+                'name': index_name, 'dimension': dimension, 'metric': metric, 'spec': spec
+            })
+            description = {}
+        while not description.get('status', {}).get('ready'):
+            time.sleep(self.INDEX_READY_POLL)
+            description = self._request('GET', f'{self.CONTROL_PLANE_URL}/indexes/{index_name}')
+        if description['dimension'] != dimension:
+            raise ValueError(f"Index '{index_name}' already exists with dimension {description['dimension']}")
+        self._metrics[name] = description.get('metric', metric)
+        host = description['host']
+        self._hosts[name] = host if host.startswith('http') else f'https://{host}'
+        return self._hosts[name]
     
-    def upsert_netflix_embeddings(self, embeddings):
-        """
-        # Real implementation:
-        vectors = [
-            (emb['id'], emb['vector'], emb['metadata']) 
-            for emb in embeddings
+    def _index_url(self, namespace: str) -> str:
+        """Data-plane URL serving a namespace"""
+        if self.host is not None:
+            return self.host
+        if namespace not in self._hosts:
+            description = self._request('GET', f'{self.CONTROL_PLANE_URL}/indexes/{namespace}-similarity')
+            host = description['host']
+            self._hosts[namespace] = host if host.startswith('http') else f'https://{host}'
+            self._metrics.setdefault(namespace, description.get('metric', 'cosine'))
+        return self._hosts[namespace]
+    
+    @staticmethod
+    def _vector_payload(item: Dict[str, Any]) -> Dict[str, Any]:
+        """Pinecone wire format of an item: id, values or sparseValues, and metadata"""
+        payload = {'id': item['id']}
+        vector = _item_vector(item)
+        if isinstance(vector, dict):
+            payload['values'] = []
+            payload['sparseValues'] = {
+                'indices': [int(index) for index in vector['indices']],
+                'values': np.asarray(vector['values'], dtype=np.float64).tolist()
+            }
+        else:
+            payload['values'] = np.asarray(vector, dtype=np.float64).ravel().tolist()
+        # Pinecone rejects null metadata values, so missing fields are left out
+        metadata = {
+            key: value for key, value in (item.get('metadata') or {}).items()
+            if value is not None and not (isinstance(value, float) and np.isnan(value))
+        }
+        if metadata:
+            payload['metadata'] = metadata
+        return payload
+    
+    def _upsert_bodies(self, namespace: str, items: List[Dict[str, Any]]):
+        """Encoded upsert request bodies, each within the vector count and byte limits"""
+        head = b'{"namespace": ' + json.dumps(namespace).encode() + b', "vectors": ['
+        budget = self.MAX_REQUEST_BYTES - len(head) - 2
+        chunk, chunk_bytes = [], 0
+        for item in items:
+            # Each vector is encoded once and spliced into its chunk's body
+            encoded = json.dumps(self._vector_payload(item), default=json_default).encode()
+            if chunk and (len(chunk) >= self.batch_size or chunk_bytes + len(encoded) + 2 > budget):
+                yield head + b', '.join(chunk) + b']}'
+                chunk, chunk_bytes = [], 0
+            chunk.append(encoded)
+            chunk_bytes += len(encoded) + 2
+        if chunk:
+            yield head + b', '.join(chunk) + b']}'
+    
+    def upsert(self, namespace: str, items: List[Dict[str, Any]]) -> int:
+        """Upsert items in size-limited chunks sent concurrently; returns the upserted count"""
+        url = f'{self._index_url(namespace)}/vectors/upsert'
+        futures = [
+            self._executor.submit(self._request, 'POST', url, body)
+            for body in self._upsert_bodies(namespace, items)
         ]
-        self.netflix_index.upsert(vectors=vectors)
+        return sum(future.result().get('upsertedCount', 0) for future in futures)
+    
+    def upsert_matrix(self, namespace: str, ids: Sequence[str], matrix,
+                      records: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Upsert row i of a dense or scipy sparse matrix as ids[i] (with records[i]'s metadata)"""
+        records = records if records is not None else [{} for _ in ids]
+        if scipy.sparse.issparse(matrix):
+            matrix = matrix.tocsr()
+            rows = (
+                {'indices': matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]],
+                 'values': matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]]}
+                for row in range(matrix.shape[0])
+            )
+            key = 'sparse_values'
+        else:
+            rows = iter(np.asarray(matrix))
+            key = 'values'
+        items = [
+            {'id': item_id, key: row, 'metadata': record.get('metadata')}
+            for item_id, row, record in zip(ids, rows, records)
+        ]
+        return self.upsert(namespace, items)
+    
+    def query(self, namespace: str, vector: List[float], top_k: int = 5,
+              filter: Optional[Dict[str, Any]] = None, include_values: bool = False,
+              include_metadata: bool = True, fields: Optional[Sequence[str]] = None,
+              diversity: Optional[float] = None, pool_size: Optional[int] = None,
+              **_) -> List[Dict[str, Any]]:
         """
-        pass
+        Top-k matches as dicts with 'id', 'similarity', 'metadata' (only the
+        listed fields, none without include_metadata) and 'values' on request.
+        diversity re-ranks a pool of matches by MMR on the client.
+        """
+        body = {
+            'namespace': namespace,
+            'vector': np.asarray(vector, dtype=np.float64).ravel().tolist(),
+            'topK': top_k,
+            'includeMetadata': include_metadata,
+            'includeValues': include_values
+        }
+        return self._query(namespace, body, filter, fields, diversity, pool_size)
+    
+    def query_by_id(self, namespace: str, item_id: str, top_k: int = 5,
+                    filter: Optional[Dict[str, Any]] = None, include_metadata: bool = True,
+                    fields: Optional[Sequence[str]] = None, diversity: Optional[float] = None,
+                    pool_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top-k neighbours of a stored item, queried by id so its vector never leaves the server"""
+        body = {'namespace': namespace, 'id': item_id, 'topK': top_k, 'includeMetadata': include_metadata}
+        return self._query(namespace, body, filter, fields, diversity, pool_size)
     
-    def similarity_search_spotify(self, query_vector, top_k=5):
+    def _query(self, namespace: str, body: Dict[str, Any], filter: Optional[Dict[str, Any]],
+               fields: Optional[Sequence[str]], diversity: Optional[float] = None,
+               pool_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        if filter:
+            body['filter'] = filter
+        top_k, include_values = body['topK'], body.get('includeValues', False)
+        if diversity:
+            if not 0 < diversity <= 1:
+                raise ValueError("diversity must be between 0 and 1")
+            # Pinecone has no MMR: fetch a larger pool with values and re-rank it here
+            body['topK'] = max(top_k, pool_size or VectorIndex.MMR_POOL_FACTOR * top_k)
+            body['includeValues'] = True
+        matches = self._request('POST', f'{self._index_url(namespace)}/query', body).get('matches', [])
+        if diversity and len(matches) > 1:
+            candidates = np.array([match['values'] for match in matches], dtype=np.float32)
+            norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+            candidates /= np.where(norms > 0, norms, 1)
+            relevance = mmr_relevance([match['score'] for match in matches],
+                                      self._metrics.get(namespace, 'cosine'))
+            matches = [matches[position] for position in
+                       mmr_select(relevance, candidates @ candidates.T, top_k, diversity)]
+        results = []
+        for match in matches:
+            result = {'id': match['id'], 'similarity': match['score']}
+            if body['includeMetadata']:
+                metadata = match.get('metadata', {})
+                # Pinecone returns whole metadata; narrowing to fields happens here
+                result['metadata'] = metadata if fields is None else {
+                    field: metadata[field] for field in fields if field in metadata
+                }
+            if include_values:
+                result['values'] = match.get('values', [])
+            results.append(result)
+        return results
+    
+    def query_batch(self, namespace: str, query_matrix, top_k: int = 5,
+                    filter: Optional[Dict[str, Any]] = None, **_) -> Tuple[np.ndarray, np.ndarray]:
         """
-        # Real implementation:
-        results = self.spotify_index.query(
-            vector=query_vector,
-            top_k=top_k,
-            include_metadata=True
-        )
-        return results['matches']
+        Run many queries concurrently; returns (ids, scores) arrays shaped
+        (queries x k), padded with None / NaN where fewer than k matched
         """
-        pass
+        futures = [
+            self._executor.submit(self.query, namespace, vector, top_k, filter)
+            for vector in np.asarray(query_matrix)
+        ]
+        results = [future.result() for future in futures]
+        width = max((len(matches) for matches in results), default=0)
+        ids = np.full((len(results), width), None, dtype=object)
+        scores = np.full((len(results), width), np.nan, dtype=np.float32)
+        for row, matches in enumerate(results):
+            ids[row, :len(matches)] = [match['id'] for match in matches]
+            scores[row, :len(matches)] = [match['similarity'] for match in matches]
+        return ids, scores
+    
+    def fetch(self, namespace: str, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch stored items by id ({id: {'id', 'values', 'metadata'}}); unknown ids are skipped"""
+        url = f'{self._index_url(namespace)}/vectors/fetch'
+        ids = list(ids)
+        futures = [
+            self._executor.submit(
+                self._request, 'GET', url, None,
+                {'ids': ids[start:start + self.FETCH_BATCH_SIZE], 'namespace': namespace}
+            )
+            for start in range(0, len(ids), self.FETCH_BATCH_SIZE)
+        ]
+        fetched = {}
+        for future in futures:
+            for item_id, vector in future.result().get('vectors', {}).items():
+                item = {'id': item_id, 'values': vector.get('values', []), 'metadata': vector.get('metadata', {})}
+                if 'sparseValues' in vector:
+                    item['sparse_values'] = vector['sparseValues']
+                fetched[item_id] = item
+        return fetched
+    
+    def delete(self, namespace: str, ids: Sequence[str]) -> int:
+        """Delete items by id; returns how many ids were sent (Pinecone does not report matches)"""
+        url = f'{self._index_url(namespace)}/vectors/delete'
+        ids = list(ids)
+        futures = [
+            self._executor.submit(
+                self._request, 'POST', url, {'ids': ids[start:start + self.MAX_UPSERT_VECTORS], 'namespace': namespace}
+            )
+            for start in range(0, len(ids), self.MAX_UPSERT_VECTORS)
+        ]
+        for future in futures:
+            future.result()
+        return len(ids)
+    
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """Summarize namespaces and item counts in the same shape as MockPineconeDB"""
+        urls = {self.host} if self.host is not None else set(self._hosts.values())
+        namespaces = {}
+        for url in urls:
+            stats = self._request('POST', f'{url}/describe_index_stats', {})
+            for name, entry in stats.get('namespaces', {}).items():
+                namespaces[name or ''] = {'vector_count': entry.get('vectorCount', 0),
+                                          'dimension': stats.get('dimension')}
+        return {
+            'namespaces': namespaces,
+            'total_vector_count': sum(entry['vector_count'] for entry in namespaces.values())
+        }
+    
+    def upsert_spotify_embeddings(self, embeddings: List[Dict[str, Any]]):
+        """Store Spotify embeddings in Pinecone"""
+        self.upsert('spotify', embeddings)
+    
+    def upsert_netflix_embeddings(self, embeddings: List[Dict[str, Any]]):
+        """Store Netflix embeddings in Pinecone"""
+        self.upsert('netflix', embeddings)
+    
+    def similarity_search_spotify(self, query_vector: List[float], top_k: int = 5):
+        """Find similar Spotify tracks"""
+        return self.query('spotify', query_vector, top_k)
+    
+    def similarity_search_netflix(self, query_vector: List[float], top_k: int = 5):
+        """Find similar Netflix content"""
+        return self.query('netflix', query_vector, top_k)
 
 
-def initialize_vector_database(use_real_pinecone: bool = False):
-    """Initialize vector database (mock or real Pinecone)"""
+def initialize_vector_database(use_real_pinecone: bool = False, index_type: str = 'flat',
+                               index_params: Optional[Dict[str, Any]] = None, shards: int = 0):
+    """
+    Initialize vector database (mock or real Pinecone).
+    For the mock, index_type picks 'flat', 'ivf' or 'hnsw' search, with
+    index_params such as {'M': 16, 'ef_construction': 200, 'ef': 64} or
+    {'nlist': 64, 'nprobe': 8}; shards > 0 splits exact scans across that
+    many worker processes.
+    """
     
     if use_real_pinecone:
         # Check for Pinecone credentials
         api_key = os.getenv('PINECONE_API_KEY')
         environment = os.getenv('PINECONE_ENVIRONMENT')
+        # A data-plane URL such as the local stand-in (python src/pinecone_server.py)
+        host = os.getenv('PINECONE_HOST')
         
-        if not api_key or not environment:
-            st.error("Pinecone API key and environment must be set in environment variables")
+        if not api_key:
+            st.error("The Pinecone API key must be set in the PINECONE_API_KEY environment variable")
             st.info("Using mock database for demonstration")
-            return MockPineconeDB()
+            return MockPineconeDB(index_type, index_params, shards)
         
-        return RealPineconeDB(api_key, environment)
+        return RealPineconeDB(api_key, environment, host)
     else:
-        return MockPineconeDB()
+        return MockPineconeDB(index_type, index_params, shards)
+
+
+def _upsert_batch(db, namespace: str, batch: EmbeddingBatch, create: bool = False) -> int:
+    """
+    Upsert an EmbeddingBatch as one matrix (item dicts are never built),
+    first creating the namespace if asked. Sparse rows stay sparse in the
+    mock; Pinecone indexes get the dense view.
+    """
+    native_sparse = sparse.issparse(batch.vectors) and isinstance(db, MockPineconeDB)
+    matrix = batch.vectors if native_sparse else batch.dense_vectors()
+    if create:
+        db.create_index(namespace, dimension=matrix.shape[1], metric='cosine', sparse=native_sparse)
+    return db.upsert_matrix(namespace, batch.ids, matrix, batch.records())
 
 
-def setup_vector_database(processed_data, use_real_pinecone: bool = False):
-    """Setup and populate vector database with processed data"""
+def setup_vector_database(processed_data, use_real_pinecone: bool = False, clustering_results=None,
+                          index_type: str = 'flat', index_params: Optional[Dict[str, Any]] = None,
+                          shards: int = 0, knn_k: int = 0, knn_namespaces: Optional[Sequence[str]] = None):
+    """
+    Setup and populate vector database with processed data.
+    For index_type='ivf', the KMeans centroids from clustering results (when
+    given) seed the inverted lists so startup clustering work is reused.
+    Processors exposing a tfidf_matrix populate a sparse namespace instead,
+    and EmbeddingBatch embeddings are upserted as one matrix.
+    With knn_k > 0 each mock namespace in knn_namespaces (all by default)
+    gets a precomputed kNN graph. Building one scores every pair of items,
+    so it is off by default: build it only for namespaces served by
+    query_by_id without diversity (MMR always runs a live query), or build
+    it offline and keep it in a snapshot.
+    """
     
     # Initialize database
-    db = initialize_vector_database(use_real_pinecone)
+    db = initialize_vector_database(use_real_pinecone, index_type, index_params, shards)
+    
+    # Upload each content type into its own namespace
+    for namespace in ('spotify', 'netflix'):
+        embeddings = processed_data[namespace]['embeddings']
+        processor = processed_data[namespace].get('processor')
+        tfidf_matrix = getattr(processor, 'tfidf_matrix', None)
+        if isinstance(embeddings, EmbeddingBatch) and len(embeddings):
+            _upsert_batch(db, namespace, embeddings, create=True)
+        elif embeddings and tfidf_matrix is not None and isinstance(db, MockPineconeDB):
+            # TF-IDF rows stay sparse; records drop the dense copy of the vector
+            db.create_index(namespace, dimension=tfidf_matrix.shape[1], metric='cosine', sparse=True)
+            records = [{key: value for key, value in item.items() if key != 'vector'} for item in embeddings]
+            db.upsert_matrix(namespace, [item['id'] for item in embeddings], tfidf_matrix, records)
+        elif embeddings:
+            db.create_index(namespace, dimension=len(_item_vector(embeddings[0])), metric='cosine')
+            db.upsert(namespace, embeddings)
     
-    # Upload Spotify embeddings
-    spotify_embeddings = processed_data['spotify']['embeddings']
-    db.upsert_spotify_embeddings(spotify_embeddings)
+    if index_type == 'ivf' and isinstance(db, MockPineconeDB):
+        clusterer = clustering_results['clusterer'] if clustering_results is not None else None
+        for namespace in ('spotify', 'netflix'):
+            if namespace not in db.indexes or isinstance(db.indexes[namespace], SparseVectorIndex):
+                continue
+            kmeans = getattr(clusterer, f'{namespace}_kmeans', None)
+            centroids = kmeans.cluster_centers_ if kmeans is not None else None
+            db.build_ivf(namespace, centroids=centroids)
     
-    # Upload Netflix embeddings
-    netflix_embeddings = processed_data['netflix']['embeddings']
-    db.upsert_netflix_embeddings(netflix_embeddings)
+    if knn_k and isinstance(db, MockPineconeDB):
+        for namespace in knn_namespaces or ('spotify', 'netflix'):
+            if namespace in db.indexes:
+                db.build_knn_graph(namespace, knn_k)
     
     return db
 
 
-def find_similar_content(db, content_type: str, query_item_id: str, top_k: int = 5):
-    """Find similar content based on a query item"""
+def ingest_csv_streaming(db, spotify_path: Optional[str] = None, netflix_path: Optional[str] = None,
+                         chunk_size: int = 10000, knn_k: int = 0) -> Dict[str, int]:
+    """
+    Populate a database from catalogue CSVs too large to load at once. Each
+    processor fits its scaler or TF-IDF vocabulary in a first pass over its
+    file, then rows are transformed and upserted one chunk at a time, so
+    ingest memory is bounded by chunk_size rather than by the file size.
+    Returns the number of items upserted per namespace.
+    """
+    processors = {}
+    if spotify_path is not None:
+        processors['spotify'] = SpotifyDataProcessor(spotify_path, chunk_size=chunk_size)
+    if netflix_path is not None:
+        processors['netflix'] = NetflixDataProcessor(netflix_path, chunk_size=chunk_size)
     
-    if content_type == 'spotify':
-        # Get the query item's vector
-        if hasattr(db, 'spotify_index') and query_item_id in db.spotify_index:
-            query_vector = db.spotify_index[query_item_id]['vector']
-            return db.similarity_search_spotify(query_vector, top_k)
-        
-    elif content_type == 'netflix':
-        # Get the query item's vector
-        if hasattr(db, 'netflix_index') and query_item_id in db.netflix_index:
-            query_vector = db.netflix_index[query_item_id]['vector']
-            return db.similarity_search_netflix(query_vector, top_k)
+    upserted = {}
+    for namespace, processor in processors.items():
+        upserted[namespace] = 0
+        for chunk, batch in enumerate(processor.iter_embedding_batches()):
+            upserted[namespace] += _upsert_batch(db, namespace, batch, create=chunk == 0)
+    
+    if knn_k and isinstance(db, MockPineconeDB):
+        for namespace in processors:
+            if namespace in db.indexes:
+                db.build_knn_graph(namespace, knn_k)
+    return upserted
+
+
+def find_similar_content(db, content_type: str, query_item_id: str, top_k: int = 5,
+                         filter: Optional[Dict[str, Any]] = None, diversity: Optional[float] = None):
+    """
+    Find similar content based on a query item, optionally restricted by a
+    metadata filter and diversified by MMR re-ranking (diversity 0-1)
+    """
     
-    return []
\ No newline at end of file
+    # Query by id: precomputed neighbour lists answer without fetching the vector
+    try:
+        return db.query_by_id(content_type, query_item_id, top_k, filter=filter, diversity=diversity)
+    except KeyError:
+        return []
\ No newline at end of file
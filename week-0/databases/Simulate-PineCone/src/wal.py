@@ -0,0 +1,150 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+from typing import Any, BinaryIO, Iterator, Optional, Tuple
+
+
+# Frame header: log sequence number, payload length, CRC32 of the payload
+_HEADER = struct.Struct('<QII')
+
+
+class WriteAheadLog:
+    """
+    Append-only log of mutating operations. Every operation gets a log
+    sequence number (LSN) and is framed with its length and CRC32, so replay
+    can stop cleanly at a torn write left by a crash.
+
+    Commits are grouped: append() only queues a frame, and wait(lsn) makes
+    the first waiting thread the leader that writes and fsyncs every frame
+    queued so far, while the others block until their LSN is covered. Under
+    concurrent writers one fsync therefore acknowledges many operations.
+    """
+
+    def __init__(self, path: str, sync: bool = True, group_commit_delay: float = 0.0):
+        self.path = path
+        self.sync = sync
+        self.group_commit_delay = group_commit_delay
+        self._cond = threading.Condition()
+        self._pending = []
+        self._flushing = False
+        self._next_lsn = 1
+        self._durable_lsn = 0
+        self._file = None
+
+    @staticmethod
+    def _frames(handle: BinaryIO) -> Iterator[Tuple[int, bytes, int]]:
+        """(lsn, payload, end offset) of every intact frame, stopping at a torn tail"""
+        while True:
+            header = handle.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            lsn, length, checksum = _HEADER.unpack(header)
+            payload = handle.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            yield lsn, payload, handle.tell()
+
+    def replay(self) -> Iterator[Tuple[int, Any]]:
+        """
+        Yield (lsn, operation) for every intact frame on disk, then cut off
+        any torn tail. Call open() afterwards to append to the log.
+        """
+        valid_end = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as handle:
+                for lsn, payload, end in self._frames(handle):
+                    valid_end = end
+                    yield lsn, pickle.loads(payload)
+            with open(self.path, 'r+b') as handle:
+                handle.truncate(valid_end)
+
+    def open(self, next_lsn: int):
+        """Start appending (closing any handle already open); LSNs continue from next_lsn"""
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'ab')
+            self._next_lsn = max(self._next_lsn, next_lsn)
+            self._durable_lsn = self._next_lsn - 1
+
+    @property
+    def last_lsn(self) -> int:
+        """LSN of the most recently appended operation"""
+        return self._next_lsn - 1
+
+    @property
+    def size(self) -> int:
+        """Bytes currently in the log file"""
+        return self._file.tell() if self._file is not None else 0
+
+    def append(self, operation: Any) -> int:
+        """Queue an operation and return its LSN; it is durable once wait(lsn) returns"""
+        payload = pickle.dumps(operation, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._cond:
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            self._pending.append(_HEADER.pack(lsn, len(payload), zlib.crc32(payload)) + payload)
+        return lsn
+
+    def wait(self, lsn: int):
+        """Block until every operation up to lsn is on disk, flushing as leader if needed"""
+        with self._cond:
+            while self._durable_lsn < lsn:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                if self.group_commit_delay:
+                    # Give concurrent writers a moment to join this group
+                    self._cond.wait(self.group_commit_delay)
+                batch = self._pending
+                self._pending = []
+                batch_lsn = self._next_lsn - 1
+                self._cond.release()
+                try:
+                    self._file.write(b''.join(batch))
+                    self._file.flush()
+                    if self.sync:
+                        os.fsync(self._file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+                self._durable_lsn = max(self._durable_lsn, batch_lsn)
+
+    def flush(self):
+        """Make every queued operation durable"""
+        self.wait(self.last_lsn)
+
+    def truncate(self, through_lsn: Optional[int] = None):
+        """
+        Drop logged operations up to through_lsn (all when None) once a
+        checkpoint has captured them. Later frames are copied into a new
+        file that atomically replaces the log, so operations logged while
+        the checkpoint was being written survive.
+        """
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._file.close()
+            staging = f'{self.path}.tmp'
+            with open(staging, 'wb') as output:
+                if through_lsn is not None:
+                    with open(self.path, 'rb') as handle:
+                        for lsn, payload, _ in self._frames(handle):
+                            if lsn > through_lsn:
+                                output.write(_HEADER.pack(lsn, len(payload), zlib.crc32(payload)) + payload)
+                output.flush()
+                if self.sync:
+                    os.fsync(output.fileno())
+            os.replace(staging, self.path)
+            self._file = open(self.path, 'ab')
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None